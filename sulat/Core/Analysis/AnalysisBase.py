@@ -24,7 +24,9 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 from sulat.Core.DataStructures import Correlator
+from sulat.Core.DataStructures import CorrelatorSet
 from sulat.Core.DataStructures import Configurations
+from sulat.Core.DataStructures import IncrementalCorrelator
 
 
 class AnalysisBase:
@@ -32,6 +34,8 @@ class AnalysisBase:
         self.configurations = {}
         self.correlators = {}
         self.resampler = None
+        self.storage = None
+        self.fit_pool = None
 
     def get_datastruct_lookup_parameters(self, name):
         pairs = [(self.configurations, Configurations),
@@ -31,6 +31,7 @@ from sulat.ExtensibleLibraries.Lib_Combos import ExLib_Combinations
 from sulat.Utilities.ExLibFunction import ExLibFunction
 from sulat.Utilities.Path import deep_search, get_by_path, set_by_path
 from sulat.Utilities.StaticStrings import host_site
+from sulat.Utilities.Storage import is_disk_backed
 
 
 def optional_arg_value(arg, value):
@@ -118,6 +119,12 @@ class MixInCombo(MixInDataIO):
         findreplace_deep_autofills(args, autofills)
         findreplace_deep_autofills(kwargs, autofills)
 
+        if self.is_out_of_core([arg_keys, kwarg_keys], [args, kwargs], lambda x: x.data):
+            data = self.storage.map(lambda chunk: combination(*apply_across_keys(arg_keys, args, lambda x: x.data[chunk]),
+                                                              **apply_across_keys(kwarg_keys, kwargs, lambda x: x.data[chunk])),
+                                    C)
+            return self.build_configurations(data, copy_data=False)
+
         data_args = apply_across_keys(arg_keys, args, lambda x: x.data)
         data_kwargs = apply_across_keys(kwarg_keys, kwargs, lambda x: x.data)
         data = combination(*data_args, **data_kwargs)
@@ -152,15 +159,46 @@ class MixInCombo(MixInDataIO):
         mean = combination(*mean_args, **mean_kwargs)
         del mean_args, mean_kwargs
 
-        submean_args = apply_across_keys(arg_keys, args, lambda x: x.submean)
-        submean_kwargs = apply_across_keys(kwarg_keys, kwargs, lambda x: x.submean)
-        submean = combination(*submean_args, **submean_kwargs)
+        if self.is_out_of_core([arg_keys, kwarg_keys], [args, kwargs], lambda x: x.submean):
+            def combine_chunk(chunk):
+                samples = combination(*apply_across_keys(arg_keys, args, lambda x: chunk_samples(x, chunk)),
+                                      **apply_across_keys(kwarg_keys, kwargs, lambda x: chunk_samples(x, chunk)))
+                return self.resampler.from_samples(mean, samples)
+            submean = self.storage.map(combine_chunk, C)
+            return self.add_correlator(mean, submean)
+
+        submean_args = apply_across_keys(arg_keys, args, lambda x: x.samples)
+        submean_kwargs = apply_across_keys(kwarg_keys, kwargs, lambda x: x.samples)
+        submean = self.resampler.from_samples(mean, combination(*submean_args, **submean_kwargs))
         del submean_args, submean_kwargs
 
         result = self.add_correlator(mean, submean)
 
         return result
 
+    def is_out_of_core(self, keysets, params, get_data):
+        """
+        Returns whether any of the data structures at 'keysets' in 'params' hold disk-backed data to be combined a chunk
+        of measurements at a time. Combinations must then act independently on each measurement.
+        """
+        return self.storage is not None and any(is_disk_backed(get_data(get_by_path(param, keyset)))
+                                                for keyset_list, param in zip(keysets, params)
+                                                for keyset in keyset_list)
+
+    def __eval_combination_string(self, string, namespace, disk_backed):
+        """
+        Evaluates a combination string in 'namespace'. If 'disk_backed', the string slices each data structure by
+        'chunk', and is evaluated one chunk of measurements at a time.
+        """
+        try:
+            if not disk_backed:
+                return eval(string, globals(), namespace)
+            return self.storage.map(lambda chunk: eval(string, globals(), {**namespace, 'chunk': chunk}),
+                                    namespace['C'])
+        except Exception as e:
+            raise BadCombinationError(f"Error in combination string:\n {string}\n"
+                                      f"Thrown error: {e}") from e
+
     def __parse_configurations_string(self, combination):
         datastructs = []
         database = self.configurations
@@ -170,11 +208,14 @@ class MixInCombo(MixInDataIO):
 
         Ts = set()
         Cs = set()
+        disk_backed = self.storage is not None and any(is_disk_backed(self.configurations[datastruct].data)
+                                                       for datastruct in datastructs)
+        chunk = '[chunk]' if disk_backed else ''
         data_string = combination
         for datastruct in datastructs:
             Cs.add(self.configurations[datastruct].data.shape[0])
             Ts.add(self.configurations[datastruct].data.shape[1])
-            data_string = data_string.replace(f"{{{datastruct}}}", f"self.configurations[\'{datastruct}\'].data")
+            data_string = data_string.replace(f"{{{datastruct}}}", f"self.configurations[\'{datastruct}\'].data{chunk}")
 
         assert len(Ts) == 1, f"Configurations did not have the same number of timeslices: {list(Ts)}"
         assert len(Cs) == 1, f"Configurations did not have the same number of configurations: {list(Cs)}"
@@ -183,13 +224,9 @@ class MixInCombo(MixInDataIO):
         C = list(Cs)[0]
         t = np.arange(T)
 
-        try:
-            data = eval(data_string)
-        except Exception as e:
-            raise BadCombinationError(f"Error in combination string:\n {data_string}\n"
-                                      f"Thrown error: {e}") from e
+        data = self.__eval_combination_string(data_string, {'self': self, 't': t, 'T': T, 'C': C}, disk_backed)
 
-        return self.build_configurations(data)
+        return self.build_configurations(data, copy_data=not disk_backed)
 
     def __parse_correlator_string(self, combination):
         datastructs = []
@@ -209,26 +246,33 @@ class MixInCombo(MixInDataIO):
         C = list(Cs)[0]
         t = np.arange(T)
 
+        disk_backed = self.storage is not None and any(is_disk_backed(self.correlators[datastruct].submean)
+                                                       for datastruct in datastructs)
+        chunk_arg = ', chunk' if disk_backed else ''
         mean_string = combination
         submean_string = combination
         for datastruct in datastructs:
             mean_string = mean_string.replace(f"{{{datastruct}}}", f"self.correlators[\'{datastruct}\'].data_mean")
-            submean_string = submean_string.replace(f"{{{datastruct}}}", f"self.correlators[\'{datastruct}\'].submean")
+            submean_string = submean_string.replace(f"{{{datastruct}}}",
+                                                    f"samples(self.correlators[\'{datastruct}\']{chunk_arg})")
 
-        try:
-            mean = eval(mean_string)
-        except Exception as e:
-            raise BadCombinationError(f"Error in combination string:\n {mean_string}\n"
-                                      f"Thrown error: {e}") from e
-        try:
-            submean = eval(submean_string)
-        except Exception as e:
-            raise BadCombinationError(f"Error in combination string:\n {mean_string}\n"
-                                      f"Thrown error: {e}") from e
+        namespace = {'self': self, 't': t, 'T': T, 'C': C}
+        mean = self.__eval_combination_string(mean_string, namespace, False)
+        # The combination is evaluated on the samples of the correlators, from which the submean of the result follows
+        submean_string = f"self.resampler.from_samples(mean, {submean_string})"
+        submean = self.__eval_combination_string(submean_string, {**namespace, 'mean': mean, 'samples': chunk_samples},
+                                                 disk_backed)
 
         return self.add_correlator(mean, submean)
 
 
+def chunk_samples(correlator, chunk=slice(None)):
+    """
+    Returns the samples of the measurements 'chunk' of 'correlator', on which combinations are evaluated.
+    """
+    return correlator.resampler.samples(correlator.data_mean, correlator.submean[chunk])
+
+
 class BadCombinationError(Exception):
     pass
 
@@ -324,14 +368,15 @@ def apply_across_keys(keysets, params, func):
     """
     Gets the values in "params" specified by the sets of keys in "keysets", and replaced those values with the output
     of "func" applied to those values.
-    The return value is a deep copy - "params" is not affected by this operation.
+    The return value is a deep copy - "params" is not affected by this operation. The values at "keysets" are never
+    copied themselves, only replaced by the output of "func".
     :param keysets: A list of keys to access members of a nested collection.
     :param params: An arbitrarily nested list or dict.
     :param func: A function to be applied to values from "params".
     :return: A modified deep copy of "params".
     """
-    param_copy = copy.deepcopy(params)
+    replacements = {}
     for keyset in keysets:
-        datastruct = get_by_path(param_copy, keyset)
-        set_by_path(param_copy, keyset, func(datastruct))
-    return param_copy
+        datastruct = get_by_path(params, keyset)
+        replacements[id(datastruct)] = func(datastruct)
+    return copy.deepcopy(params, replacements)
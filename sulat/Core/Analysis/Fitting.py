@@ -26,9 +26,13 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import itertools
 import numpy as np
 
+from .AnalysisBase import Correlator
 from .IO import MixInDataIO
-from sulat.Core.Fitting.Fit import FitResult, generate_weights, normalise_fit_ranges, mk_fit_results
-from sulat.Core.Fitting.Fit import prepare_functions_for_fitting, transform_args
+from sulat.Core.Fitting.Checkpoint import FitScanCheckpoint, scan_signature
+from sulat.Core.Fitting.Fit import perform_fit
+from sulat.Core.Fitting.FitScanTable import FitScanRow, FitScanTable, ScanFitter
+from sulat.Core.Fitting.JointCovariance import JointCovarianceCache
+from sulat.Core.Fitting.Parallel import FitPool
 from sulat.ExtensibleLibraries.Lib_FitFuncs import ExLib_FitFuncs
 from sulat.ExtensibleLibraries.Lib_Minimisers import ExLib_Minimisers
 from sulat.Utilities.ExLibFunction import ExLibFunction
@@ -65,36 +69,39 @@ class MixInFitting(MixInDataIO):
                                          f"and the number of fit functions ({len(funcs)}): " \
                                          f"{corrs}, {funcs}."
 
-        fit_ranges = normalise_fit_ranges(fit_ranges)
-        mean_data = [corr.mean[fit_range] for corr, fit_range in zip(corrs, fit_ranges)]
-        submean_data = [corr.submean[:, fit_range] for corr, fit_range in zip(corrs, fit_ranges)]
-        C, T = corrs[0].submean.shape
-        weights, subweights = generate_weights(corrs, fit_ranges, correlation, frozen, cov, subcovs, C)
-
-        wrapped_functions = prepare_functions_for_fitting(funcs)
-        parameter_maps_mean, parameter_maps_bin, arg_location_maps, arg_idxs = transform_args(funcs, list(args.keys()),
-                                                                                              constants, arg_identities, T,
-                                                                                              C, self.correlators)
-
-        xs = optional_arg_value(xs, [np.arange(T)[fr] for fr in fit_ranges])
-
-        def fit_wrapper(fit_vector, weights, initial_conditions, parameter_map):
-            return fit_method(fit_vector, initial_conditions, weights, wrapped_functions, xs, parameter_map,
-                              arg_location_maps)
-
-        central_parameters, bin_parameters = mk_fit_results(mean_data, submean_data, weights,
-                                                            fit_wrapper, subweights,
-                                                            C, np.array(list(args.values())),
-                                                            parameter_maps_mean, parameter_maps_bin)
-
-        return FitResult(args, corrs, funcs, central_parameters, bin_parameters, weights, subweights, fit_ranges, constants,
-                         corrs[0].resampler, parameter_maps_mean, arg_location_maps, arg_identities)
+        return perform_fit(corrs, funcs, fit_ranges, args, arg_identities, correlation, frozen, cov, subcovs, constants,
+                           fit_method, xs, self.correlators)
 
     @ExLibFunction(funcs=(ExLib_FitFuncs, get_fitfuncs),
                    fit_method=(ExLib_Minimisers, get_minimiser))
     def fit_scan(self, corrs, funcs, fit_ranges, args, arg_identities, correlation, frozen=None, thinned=1, cov=None, subcovs=None,
                  constants=None, fit_method=ExLib_Minimisers['LevenburgMarquardtScipy'], xs=None,
-                 min_fit=None, scan=None, max_low=None):
+                 min_fit=None, scan=None, max_low=None, processes=None, chunksize=1, screen=None, checkpoint=None,
+                 shard=None):
+        """
+        Fits every combination of the fit ranges generated from 'fit_ranges', 'min_fit', 'max_low', and 'thinned'.
+        Pass 'processes' to distribute the fits over a pool of worker processes. The pool is kept open on the Analysis
+        object and re-used by subsequent scans with the same number of processes; close it with 'close_fit_pool'.
+        'chunksize' sets the number of fits sent to a worker per task.
+        Returns a FitScanTable: a mapping from the stringified fit range combinations, in enumeration order, to the
+        FitResults. The table holds the fitted parameters and goodness-of-fit of every fit in arrays, and re-fits a
+        FitResult only when it is looked up.
+        Unless 'cov' is given, the joint covariance matrix of 'corrs' is computed once for the whole scan and the
+        weights of each fit are sliced out of it.
+        Pass a predicate as 'screen' to only fit the resampled bins of fit range combinations whose central fit passes
+        it. The predicate is called with a CentralFitResult, and the combinations it rejects are left out of the
+        returned table. Predicates for common cuts are provided in sulat.Core.Fitting.Screening; with
+        'processes', the predicate must be picklable.
+        Pass a file path as 'checkpoint' to append each result to that file as soon as it completes. If the file
+        already exists, the fits it holds are loaded rather than repeated, so that an interrupted scan can be resumed
+        by calling fit_scan again with the same arguments.
+        Pass 'shard' as a tuple (i, N) together with a 'checkpoint' to only fit every N-th fit range combination,
+        starting from the i-th, so that a scan can be split between N independent jobs. The shards share the
+        signature of the full scan, so once every job has finished, their checkpoints can be combined with
+        'sulat.Core.Fitting.Checkpoint.merge_checkpoints' and the merged file passed as the 'checkpoint' of the full
+        scan to load its results.
+        """
+        constants = optional_arg_value(constants, {})
         scan = optional_arg_value(scan, [True] * len(fit_ranges))
         max_low = optional_arg_value(max_low, [None] * len(fit_ranges))
         min_fit = optional_arg_value(min_fit, [None] * len(fit_ranges))
@@ -105,10 +112,10 @@ class MixInFitting(MixInDataIO):
         else:
             assert len(fit_ranges) == len(min_fit), "A minimum fit value must be provided for each correlator."
         if not isinstance(max_low, list):
-            assert isinstance(max_low, int), "min_fit must be an int or a list of ints."
-            min_fit = [max_low]*len(fit_ranges)
+            assert isinstance(max_low, int), "max_low must be an int or a list of ints."
+            max_low = [max_low]*len(fit_ranges)
         else:
-            assert len(fit_ranges) == len(max_low), "A minimum fit value must be provided for each correlator."
+            assert len(fit_ranges) == len(max_low), "A maximum lower fit value must be provided for each correlator."
 
         all_fit_ranges = []
         # Produce every combination of fit ranges...
@@ -121,21 +128,120 @@ class MixInFitting(MixInDataIO):
                     submax_low = hi
                 all_fit_ranges.append([[il, ih] for il in range(lo, submax_low+1) for ih in range(il + mfit - 1, hi+1, thinned)])
 
-        total_fits = np.prod([len(sublist) for sublist in all_fit_ranges])
-        all_fit_ranges = itertools.product(*all_fit_ranges)
+        all_fit_ranges = list(itertools.product(*all_fit_ranges))
+        if shard is not None:
+            assert checkpoint is not None, "A checkpoint file must be provided to store the results of a shard."
+            shard_index, num_shards = shard
+            assert 0 <= shard_index < num_shards, f"Invalid shard {shard_index} of {num_shards}."
+        scan_keys = [fit_range_key(combo) for combo in all_fit_ranges]
+        correlator_db = vector_constant_correlators(self.correlators, arg_identities)
         fit_results = {}
-        fit_num = 0
         fails = []
-        for fit_range_combo in all_fit_ranges:
-            fit_num += 1
+        screened_out = 0
+        if checkpoint is not None:
+            signature = scan_signature(list(corrs) + list(correlator_db.values()), funcs=funcs,
+                                       fit_ranges=all_fit_ranges, args=args, arg_identities=arg_identities,
+                                       correlation=correlation, frozen=frozen, cov=cov, subcovs=subcovs,
+                                       constants=constants, fit_method=fit_method, xs=xs, screen=screen)
+            checkpoint = FitScanCheckpoint(checkpoint, signature)
+            if shard is not None:
+                all_fit_ranges = all_fit_ranges[shard_index::num_shards]
+                scan_keys = scan_keys[shard_index::num_shards]
+            for result in [checkpoint.records[key] for key in scan_keys if key in checkpoint.records]:
+                if isinstance(result, str):
+                    fails.append(result)
+                elif result is None:
+                    screened_out += 1
+            all_fit_ranges = [combo for combo in all_fit_ranges if fit_range_key(combo) not in checkpoint.records]
+        total_fits = len(scan_keys)
+        cov_cache = JointCovarianceCache(corrs, correlation, frozen) if cov is None else None
+        if processes is not None and processes > 1:
+            if frozen or cov_cache is not None:
+                # The workers need no configurations for double samples, so they are not sent
+                corrs = without_configurations(corrs)
+                correlator_db = dict(zip(correlator_db, without_configurations(correlator_db.values())))
+            context = {'corrs': corrs, 'funcs': funcs, 'args': args, 'arg_identities': arg_identities,
+                       'correlation': correlation, 'frozen': frozen, 'cov': cov, 'subcovs': subcovs,
+                       'constants': constants, 'fit_method': fit_method, 'xs': xs,
+                       'correlator_db': correlator_db, 'cov_cache': cov_cache, 'screen': screen}
+            fit_iterator = self.get_fit_pool(processes).imap(context, all_fit_ranges, chunksize)
+        else:
+            fit_iterator = self.__serial_fits(all_fit_ranges, corrs, funcs, args, arg_identities, correlation, frozen,
+                                              cov, subcovs, constants, fit_method, xs, cov_cache, screen)
+
+        for fit_num, (fit_range_combo, result) in enumerate(fit_iterator, total_fits - len(all_fit_ranges) + 1):
             print(f"\rFitting {fit_num}/{total_fits}", end='')
+            if checkpoint is not None:
+                checkpoint.append(fit_range_key(fit_range_combo), result)
+            if isinstance(result, str):
+                fails.append(result)
+            elif result is None:
+                screened_out += 1
+            else:
+                fit_results[fit_range_key(fit_range_combo)] = result
+        print()
+        if screened_out:
+            print(f"{screened_out} fits were rejected by the screening predicate.")
+        if len(fails):
+            print(f"{len(fails)} fits failed with the following exceptions:")
+            for fail in fails:
+                print(fail)
+        if checkpoint is not None:
+            fit_results = checkpoint.records
+
+        keys = [key for key in scan_keys
+                if fit_results.get(key) is not None and not isinstance(fit_results[key], str)]
+        fitter = ScanFitter(corrs=corrs, funcs=funcs, args=args, arg_identities=arg_identities,
+                            correlation=correlation, frozen=frozen, cov=cov, subcovs=subcovs, constants=constants,
+                            fit_method=fit_method, xs=xs, correlator_db=correlator_db, cov_cache=cov_cache)
+        return FitScanTable.from_rows(list(args.keys()), keys, [fit_results[key] for key in keys], corrs[0].resampler,
+                                      fitter)
+
+    def __serial_fits(self, all_fit_ranges, corrs, funcs, args, arg_identities, correlation, frozen, cov, subcovs,
+                      constants, fit_method, xs, cov_cache, screen):
+        for fit_range_combo in all_fit_ranges:
             try:
-                result = self.fit(corrs, funcs, fit_range_combo, args, arg_identities, correlation, frozen, cov, subcovs,
-                                  constants, fit_method, xs)
-                key = ', '.join([str(elem) for elem in fit_range_combo])
-                fit_results[key] = result
+                result = perform_fit(corrs, funcs, fit_range_combo, args, arg_identities, correlation, frozen, cov,
+                                     subcovs, constants, fit_method, xs, self.correlators, cov_cache, screen)
+                if result is not None:
+                    result = FitScanRow.from_fit_result(fit_range_combo, result)
             except np.linalg.LinAlgError as lae:
-                fails.append(f"Fit range {fit_range_combo} failed: {lae}")
-            if len(fails):
-                print(f"{len(fails)} fits failed with the following exceptions:")
-        return fit_results
+                result = f"Fit range {fit_range_combo} failed: {lae}"
+            yield fit_range_combo, result
+
+    def get_fit_pool(self, processes):
+        """
+        Returns the persistent pool of fit worker processes, (re)starting it if it does not have 'processes' workers.
+        """
+        if self.fit_pool is not None and self.fit_pool.processes != processes:
+            self.close_fit_pool()
+        if self.fit_pool is None:
+            self.fit_pool = FitPool(processes)
+        return self.fit_pool
+
+    def close_fit_pool(self):
+        if self.fit_pool is not None:
+            self.fit_pool.close()
+            self.fit_pool = None
+
+
+def fit_range_key(fit_range_combo):
+    return ', '.join([str(elem) for elem in fit_range_combo])
+
+
+def without_configurations(correlators):
+    """
+    Returns 'correlators', with those that keep the configurations resampled into them replaced by Correlators of the
+    same samples that do not.
+    """
+    return [corr if getattr(corr, 'configurations', None) is None else Correlator(corr.data_mean, corr.submean, corr.resampler)
+            for corr in correlators]
+
+
+def vector_constant_correlators(correlator_db, arg_identities):
+    """
+    Returns the subset of 'correlator_db' that is referenced by '{name}' vector constants in 'arg_identities', so that
+    only those correlators need to be sent to worker processes.
+    """
+    keys = set([item[1:-1] for argids in arg_identities for item in argids if item[0] == '{' and item[-1] == '}'])
+    return {key: correlator_db[key] for key in keys if key in correlator_db}
@@ -25,11 +25,16 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
 import copy
+import functools
+import numpy as np
 
-from .AnalysisBase import AnalysisBase, Configurations, Correlator
+from .AnalysisBase import AnalysisBase, Configurations, Correlator, CorrelatorSet, IncrementalCorrelator
 from sulat.ExtensibleLibraries.Lib_Combos import ExLib_Combinations
+from sulat.ExtensibleLibraries.Lib_Combos.Resources import is_mutating
 from sulat.ExtensibleLibraries.Lib_FileFormatReaders import ExLib_FileFormatReaders
+from sulat.ExtensibleLibraries.Lib_Stats.GammaMethod import integrated_autocorrelation_time, recommended_binsize
 from sulat.Utilities.ExLibFunction import ExLibFunction
+from sulat.Utilities.Storage import DiskStorage, default_chunksize, is_disk_backed
 from sulat.Utilities.TypeChecking import is_nonstr_collection
 
 
@@ -37,6 +42,43 @@ def optional_arg_value(arg, value):
     return value if arg is None else arg
 
 
+def apply_transforms(data, transforms, copy_data=True, storage=None):
+    """
+    Applies 'transforms' to 'data' in order.
+    If 'copy_data', the transforms act on a copy of 'data'. Otherwise, 'data' is used without copying, and is only
+    copied, once, before the first transform that modifies its input in place, so that the caller's array is never
+    modified. The result may then be a view of 'data'.
+    Disk-backed data is copied into the disk-backed 'storage', if given.
+    """
+    if copy_data:
+        data = copy_measurements(data, storage)
+    owned = copy_data
+    for transform in transforms:
+        if is_mutating(transform) and not owned:
+            data = copy_measurements(data, storage)
+            owned = True
+        result = transform(data)
+        owned = owned or not np.may_share_memory(result, data)
+        data = result
+    return data
+
+
+def copy_measurements(data, storage=None):
+    if storage is not None and is_disk_backed(data):
+        return storage.map(lambda chunk: data[chunk], len(data))
+    return copy.deepcopy(data)
+
+
+def bind_transform(transform, *args, **kwargs):
+    """
+    Returns 'transform' with the arguments after the data bound, keeping its attributes, such as 'mutates_data'.
+    """
+    @functools.wraps(transform)
+    def bound_transform(data):
+        return transform(data, *args, **kwargs)
+    return bound_transform
+
+
 def get_build_configurations_transforms(ExLib, args):
     """
     Pass arguments as either a Collection of single-argument compatible functions and function names, e.g.
@@ -47,14 +89,16 @@ def get_build_configurations_transforms(ExLib, args):
     {'fold': {'cutoff': 1, 'backshift': 0}, 'flip': []}.
     The first parameter of these functions is auto-filled with the input data and cannot be passed values.
     """
-    if issubclass(type(args), dict):
+    if args is None:
+        return []
+    elif issubclass(type(args), dict):
         retval = []
         for key, params in args.items():
             param_type = type(params)
             if param_type == tuple or param_type == list:
-                retval.append(lambda data: ExLib.lookup(key)(data, *params))
+                retval.append(bind_transform(ExLib.lookup(key), *params))
             elif param_type == dict:
-                retval.append(lambda data: ExLib.lookup(key)(data, **params))
+                retval.append(bind_transform(ExLib.lookup(key), **params))
             else:
                 raise ValueError(f"Arguments for parameter {key} was not a tuple, list, or dict: type {param_type} and value {params}.")
         return retval
@@ -69,43 +113,72 @@ class MixInDataIO(AnalysisBase):
     # Importers for non-sulat data #
     ################################
     @ExLibFunction(transforms=(ExLib_Combinations, get_build_configurations_transforms))
-    def build_configurations(self, data, transforms=None):
+    def build_configurations(self, data, transforms=None, copy_data=True):
+        """
+        :param copy_data: If False, take ownership of 'data' without copying it, copying only if a transform modifies
+                          its input. The Configurations may then share memory with 'data'.
+        """
         transforms = optional_arg_value(transforms, [])
-        data = copy.deepcopy(data)
-        for transform in transforms:
-            data = transform(data)
-        return Configurations(data)
+        return Configurations(apply_transforms(data, transforms, copy_data, self.storage), copy_data=False)
 
     @ExLibFunction(format=ExLib_FileFormatReaders,
                    transforms=(ExLib_Combinations, get_build_configurations_transforms))
     def import_configurations(self, filepath, format, transforms=None):
         data = self.import_file(filepath, format)
-        return self.build_configurations(data, transforms)
+        return self.build_configurations(data, transforms=transforms, copy_data=False)
 
     def export_configurations(self):
         raise NotImplementedError
 
     def configs_to_correlator(self, configurations):
-        return Correlator(configurations.mean, self.resampler.resample(configurations.data), self.resampler)
+        if self.storage is not None and is_disk_backed(configurations.data):
+            submean = self.resampler.resample_out_of_core(configurations.data, self.storage)
+        else:
+            submean = self.resampler.resample(configurations.data)
+        data = configurations.data if self.resampler.double_resamples_configurations else None
+        return Correlator(configurations.mean, submean, self.resampler, data)
 
     def add_correlator(self, mean, submean):
         return Correlator(mean, submean, self.resampler)
 
     @ExLibFunction(transforms=(ExLib_Combinations, get_build_configurations_transforms))
-    def build_correlator(self, data, transforms=None):
+    def build_correlator(self, data, transforms=None, copy_data=True):
+        """
+        :param copy_data: If False, resample 'data' without copying it, copying only if a transform modifies its
+                          input, so that the peak memory is close to that of 'data' and its samples.
+        """
         transforms = optional_arg_value(transforms, [])
-        data = copy.deepcopy(data)
-        for transform in transforms:
-            data = transform(data)
-        configs = Configurations(data)
+        configs = Configurations(apply_transforms(data, transforms, copy_data, self.storage), copy_data=False)
 
         return self.configs_to_correlator(configs)
 
+    @ExLibFunction(transforms=(ExLib_Combinations, get_build_configurations_transforms))
+    def build_correlator_set(self, data, transforms=None, copy_data=True):
+        """
+        Returns a CorrelatorSet of the (channels, configurations, timeslices) array, or sequence of equally-shaped
+        (configurations, timeslices) arrays, 'data'. The 'transforms' are applied to each channel, and all channels
+        are then resampled at once.
+        """
+        transforms = optional_arg_value(transforms, [])
+        data = np.stack([apply_transforms(channel, transforms, copy_data, self.storage) for channel in data])
+        mean = np.mean(data, axis=1)
+        submean = np.moveaxis(self.resampler.resample(np.moveaxis(data, 0, 1)), 0, 1)
+        return CorrelatorSet(mean, np.ascontiguousarray(submean), self.resampler)
+
+    @ExLibFunction(transforms=(ExLib_Combinations, get_build_configurations_transforms))
+    def build_incremental_correlator(self, data, transforms=None):
+        """
+        Returns an IncrementalCorrelator of 'data', to which further configurations can be appended. The 'transforms'
+        are applied to each batch of configurations as it is appended, so transforms that combine configurations,
+        such as binning, should only be used with batches that they divide evenly.
+        """
+        return IncrementalCorrelator(data, self.resampler, optional_arg_value(transforms, []))
+
     @ExLibFunction(format=ExLib_FileFormatReaders,
                    transforms=(ExLib_Combinations, get_build_configurations_transforms))
     def import_correlator(self, filepath, format, transforms=None):
         data = self.import_file(filepath, format)
-        return self.build_correlator(data, transforms)
+        return self.build_correlator(data, transforms=transforms, copy_data=False)
 
     ########################################
     # Importers & exporters for sulat data #
@@ -116,3 +189,33 @@ class MixInDataIO(AnalysisBase):
     #####################
     def import_file(self, filepath, format):
         return format(filepath)
+
+    def init_storage(self, directory, chunksize=default_chunksize):
+        """
+        Enables out-of-core analysis of disk-backed (np.memmap) data, such as arrays opened with
+        np.load(..., mmap_mode='r'). Configurations and correlators built from disk-backed data are resampled and
+        combined 'chunksize' measurements at a time, with large results written to files in 'directory'.
+        Pass copy_data=False when building from disk-backed data that need not be copied.
+        """
+        self.storage = DiskStorage(directory, chunksize)
+
+    def integrated_autocorrelation_times(self, *configurations, S=1.5):
+        """
+        Returns the integrated autocorrelation times of each timeslice of each of 'configurations', which may be
+        Configurations or arrays of data with the same number of configurations in Monte Carlo order. The
+        autocorrelation functions of every timeslice of every correlator are computed together with FFTs.
+        :return: A (len(configurations), timeslices) array.
+        """
+        data = [configs.data if isinstance(configs, Configurations) else configs for configs in configurations]
+        return integrated_autocorrelation_time(np.stack(data, axis=1), S)
+
+    def recommend_binsize(self, *configurations, factor=4, S=1.5):
+        """
+        Returns the smallest bin size that is at least 'factor' times the largest integrated autocorrelation time of
+        'configurations'. Pass the same bin size to 'bin_configurations' when building each correlator, or use the
+        'auto_bin_configurations' transform to bin each one independently. Configurations left over after the last
+        whole bin are dropped with a warning.
+        """
+        tau_int = self.integrated_autocorrelation_times(*configurations, S=S)
+        data = configurations[0].data if isinstance(configurations[0], Configurations) else configurations[0]
+        return recommended_binsize(tau_int, data.shape[0], factor)
@@ -24,8 +24,29 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 
+import contextlib
 import operator
 
+import numpy as np
+
+# The lazy arithmetic mode: while enabled, data structures that support it build expression graphs from arithmetic
+# rather than evaluating it, and evaluate them 'chunksize' measurements at a time when their data is requested.
+lazy_mode = {'enabled': False, 'chunksize': 256}
+
+
+@contextlib.contextmanager
+def lazy_arithmetic(chunksize=256):
+    """
+    Context manager enabling the lazy arithmetic mode. Arithmetic and ufuncs on Correlators within the context
+    return LazyCorrelators, whose data is computed from the values of their operands when it is first requested.
+    """
+    previous = dict(lazy_mode)
+    lazy_mode.update(enabled=True, chunksize=chunksize)
+    try:
+        yield
+    finally:
+        lazy_mode.update(previous)
+
 
 class ArithmeticMixin:
     """
@@ -131,3 +152,79 @@ class ArithmeticMixin:
 
     def __invert__(self):
         return self._unop(operator.invert)
+
+
+class ArrayProtocolMixin:
+    """
+    Implements the NumPy ufunc and array-function protocols for data structures made of arrays that share a leading
+    measurements axis, so that NumPy functions apply to every array of the data structure in one dispatch.
+    """
+    def _array_components(self):
+        """
+        Returns the arrays of the data structure, each with a leading measurements axis.
+        """
+        raise NotImplementedError
+
+    def _from_array_components(self, components):
+        raise NotImplementedError
+
+    def _forget_array_stats(self):
+        raise NotImplementedError
+
+    def _is_compatible(self, other):
+        return isinstance(other, ArrayProtocolMixin) and (isinstance(other, type(self)) or isinstance(self, type(other)))
+
+    def __array_ufunc__(self, ufunc, method, *inputs, out=None, **kwargs):
+        if method != '__call__':
+            return NotImplemented
+        out = () if out is None else out
+        operands = [*inputs, *out]
+        if any(isinstance(x, ArithmeticMixin) and not self._is_compatible(x) for x in operands):
+            return NotImplemented
+
+        results = []
+        for i in range(len(self._array_components())):
+            component_inputs = [component_of(x, i) for x in inputs]
+            if out:
+                kwargs['out'] = tuple(component_of(x, i) for x in out)
+            results.append(ufunc(*component_inputs, **kwargs))
+
+        if out:
+            for x in out:
+                if isinstance(x, ArrayProtocolMixin):
+                    x._forget_array_stats()
+            return out[0] if len(out) == 1 else out
+        if ufunc.nout == 1:
+            return self._from_array_components(results)
+        return tuple(self._from_array_components([result[k] for result in results]) for k in range(ufunc.nout))
+
+    def __array_function__(self, func, types, args, kwargs):
+        """
+        Applies 'func' to each array of the data structure. 'func' must act independently on each measurement, keeping
+        the measurements axis, such as np.flip(..., axis=1) or np.mean(..., axis=1).
+        """
+        if not all(issubclass(typ, ArrayProtocolMixin) for typ in types):
+            return NotImplemented
+        components = self._array_components()
+        results = []
+        for i, component in enumerate(components):
+            result = func(*components_in(args, i), **components_in(kwargs, i))
+            if np.ndim(result) == 0 or len(result) != len(component):
+                return NotImplemented
+            results.append(result)
+        return self._from_array_components(results)
+
+
+def component_of(obj, i):
+    return obj._array_components()[i] if isinstance(obj, ArrayProtocolMixin) else obj
+
+
+def components_in(params, i):
+    """
+    Replaces the data structures in the nested lists, tuples and dicts 'params' with their 'i'th arrays.
+    """
+    if isinstance(params, (list, tuple)):
+        return type(params)(components_in(param, i) for param in params)
+    elif isinstance(params, dict):
+        return {key: components_in(param, i) for key, param in params.items()}
+    return component_of(params, i)
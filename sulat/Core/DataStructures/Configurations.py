@@ -26,24 +26,31 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import numpy as np
 import copy
 
-from .ArithmeticMixIn import ArithmeticMixin
+from .ArithmeticMixIn import ArithmeticMixin, ArrayProtocolMixin
 from sulat.Utilities.Evaluation import lazy_readonly
+from sulat.Utilities.Storage import chunked_sum, is_disk_backed
 
 
 measurements = 0
 variables = 1
 
 
-class Configurations(ArithmeticMixin):
+class Configurations(ArithmeticMixin, ArrayProtocolMixin):
     """
 
     """
-    def __init__(self, data):
+    def __init__(self, data, copy_data=True):
+        """
+        :param data: The (configurations, variables) array of data.
+        :param copy_data: If False, take ownership of 'data' rather than copying it.
+        """
         super().__init__()
-        self._data = copy.deepcopy(data)
+        self._data = copy.deepcopy(data) if copy_data else data
 
     @lazy_readonly
     def mean(self):
+        if is_disk_backed(self._data):
+            return chunked_sum(self._data) / self._data.shape[measurements]
         return np.mean(self._data, axis=measurements)
 
     @property
@@ -53,6 +60,18 @@ class Configurations(ArithmeticMixin):
     def forget_stats(self):
         del self.mean
 
+    ##################
+    # NumPy protocol #
+    ##################
+    def _array_components(self):
+        return [self._data]
+
+    def _from_array_components(self, components):
+        return Configurations(components[0], copy_data=False)
+
+    def _forget_array_stats(self):
+        self.forget_stats()
+
     #############
     # Operators #
     #############
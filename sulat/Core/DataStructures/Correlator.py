@@ -25,25 +25,32 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import numpy as np
 
-from .ArithmeticMixIn import ArithmeticMixin
+from .ArithmeticMixIn import ArithmeticMixin, ArrayProtocolMixin, lazy_mode
 from sulat.Utilities.Evaluation import lazy_readonly
+from sulat.Utilities.Storage import chunked_sum, is_disk_backed
 
 measurements = 0
 variables = 1
 
 
-class Correlator(ArithmeticMixin):
+class Correlator(ArithmeticMixin, ArrayProtocolMixin):
     """
 
     """
     ################
     # Constructors #
     ################
-    def __init__(self, mean, submean, resampler):
+    def __init__(self, mean, submean, resampler, configurations=None):
+        """
+        :param configurations: The configurations resampled into 'submean', kept for resamplers whose double samples
+                               resample them again, such as a Bootstrap with 'double_bootstrap'. Correlators derived
+                               from others by arithmetic do not keep configurations.
+        """
         super().__init__()
         self._data_mean = mean
         self._submean = submean
         self.resampler = resampler
+        self.configurations = configurations
 
     ####################
     # Data description #
@@ -54,6 +61,8 @@ class Correlator(ArithmeticMixin):
 
     @lazy_readonly
     def sample_mean(self):
+        if is_disk_backed(self._submean):
+            return chunked_sum(self._submean) / self._submean.shape[measurements]
         return np.mean(self._submean, axis=measurements)
 
     def forget_sample_mean(self):
@@ -63,6 +72,14 @@ class Correlator(ArithmeticMixin):
     def submean(self):
         return self._submean
 
+    @property
+    def samples(self):
+        """
+        The samples on which derived quantities are evaluated, which are 'submean' unless the resampler holds another
+        representation of them.
+        """
+        return self.resampler.samples(self.data_mean, self._submean)
+
     ######################
     # Overridden Members #
     ######################
@@ -72,7 +89,7 @@ class Correlator(ArithmeticMixin):
 
     @lazy_readonly
     def submean_double(self):
-        return self.resampler.submean_double_definition(self._submean)
+        return self.resampler.submean_double_definition(self._submean, self.configurations)
 
     @lazy_readonly
     def cov(self):
@@ -98,36 +115,80 @@ class Correlator(ArithmeticMixin):
         del self.var
         del self.std
 
+    ##################
+    # NumPy protocol #
+    ##################
+    def _array_components(self):
+        return [np.reshape(self.data_mean, (1, *np.shape(self.submean)[1:])), self.samples]
+
+    def _from_array_components(self, components):
+        mean, samples = components
+        mean = np.reshape(mean, np.shape(mean)[1:])
+        return Correlator(mean, self.resampler.from_samples(mean, samples), self.resampler)
+
+    def _forget_array_stats(self):
+        self.forget_sample_mean()
+        self.forget_stats()
+
+    def __array_ufunc__(self, ufunc, method, *inputs, out=None, **kwargs):
+        if lazy_mode['enabled'] and method == '__call__' and out is None and not kwargs and ufunc.nout == 1 and \
+                all(isinstance(x, Correlator) or not isinstance(x, ArithmeticMixin) for x in inputs):
+            from .LazyCorrelator import LazyCorrelator
+            return LazyCorrelator.from_operation(ufunc, *inputs)
+        if out is not None and not self.resampler.holds_samples:
+            # The samples are evaluated from 'submean', so are written back to it rather than evaluated in place
+            results = super().__array_ufunc__(ufunc, method, *inputs, **kwargs)
+            results = (results,) if ufunc.nout == 1 else results
+            for x, result in zip(out, results):
+                x._data_mean[...] = result.data_mean
+                x._submean[...] = result.submean
+                x._forget_array_stats()
+            return out[0] if len(out) == 1 else out
+        return super().__array_ufunc__(ufunc, method, *inputs, out=out, **kwargs)
+
     ####################
     # Binary operators #
     ####################
     def _binop(self, op, other):
+        if lazy_mode['enabled']:
+            from .LazyCorrelator import LazyCorrelator, operator_ufuncs
+            return LazyCorrelator.from_operation(operator_ufuncs[op], self, other)
         cls = type(self)
         other_cls = type(other)
         if issubclass(other_cls, cls):
             mean = op(self._data_mean, other.data_mean)
-            submean = op(self._submean, other.submean_definition)
+            samples = op(self.samples, other.samples)
         else:
             mean = op(self._data_mean, other)
-            submean = op(self._submean, other)
-        return cls(mean, submean, self.resampler)
+            samples = op(self.samples, other)
+        return cls(mean, self.resampler.from_samples(mean, samples), self.resampler)
 
     def _ibinop(self, op, other):
         cls = type(self)
         other_cls = type(other)
         if issubclass(other_cls, cls):
+            samples = op(self.samples, other.samples)
             self._data_mean = op(self._data_mean, other.data_mean)
-            self._submean = op(self._submean, other.submean_definition)
         else:
+            samples = op(self.samples, other)
             self._data_mean = op(self._data_mean, other)
-            self._submean = op(self._submean, other)
+        self._submean = self.resampler.from_samples(self._data_mean, samples)
+        self.configurations = None
+        self.forget_sample_mean()
+        self.forget_stats()
         return self
 
     ##################
     # Unary Operator #
     ##################
     def _unop(self, op):
+        if lazy_mode['enabled']:
+            from .LazyCorrelator import LazyCorrelator, operator_ufuncs
+            return LazyCorrelator.from_operation(operator_ufuncs[op], self)
+        samples = op(self.samples)
         self._data_mean = op(self._data_mean)
-        self._submean = op(self._submean)
+        self._submean = self.resampler.from_samples(self._data_mean, samples)
+        self.configurations = None
+        self.forget_sample_mean()
         self.forget_stats()
         return self
@@ -0,0 +1,247 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/Core/DataStructures/CorrelatorSet.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import weakref
+
+import numpy as np
+
+from .ArithmeticMixIn import ArithmeticMixin
+from .Correlator import Correlator
+from sulat.Utilities.Evaluation import lazy_readonly
+
+channels = 0
+measurements = 1
+variables = 2
+
+
+class CorrelatorSet(ArithmeticMixin):
+    """
+    A stack of N correlators sharing a resampler and shape, held as an (N, T) mean and an (N, samples, T) submean so
+    that arithmetic, transforms and statistics act on every channel at once.
+    Indexing returns Correlators that are views of a single channel, and slicing CorrelatorSets that are views of a
+    range of channels, sharing memory with the stack. In-place arithmetic on the stack or on any of its views forgets
+    the cached statistics of all of them.
+    """
+    ################
+    # Constructors #
+    ################
+    def __init__(self, mean, submean, resampler, base=None):
+        """
+        :param base: The CorrelatorSet whose memory this is a view of, or None if it owns its memory.
+        """
+        super().__init__()
+        self._data_mean = mean
+        self._submean = submean
+        self.resampler = resampler
+        self.base = base
+        self._views = weakref.WeakSet()
+
+    def __reduce__(self):
+        # A copy owns its memory, so neither its views nor the statistics cached for them are kept
+        return type(self), (self._data_mean, self._submean, self.resampler)
+
+    @classmethod
+    def from_correlators(cls, correlators):
+        """
+        Stacks 'correlators', which must share a resampler, into a new CorrelatorSet.
+        """
+        resamplers = {id(corr.resampler) for corr in correlators}
+        if len(resamplers) != 1:
+            raise ValueError(f"Correlators of a CorrelatorSet must share a single resampler, not {len(resamplers)}.")
+        return cls(np.stack([corr.data_mean for corr in correlators]),
+                   np.stack([corr.submean for corr in correlators]),
+                   correlators[0].resampler)
+
+    ####################
+    # Data description #
+    ####################
+    @property
+    def data_mean(self):
+        return self._data_mean
+
+    @lazy_readonly
+    def sample_mean(self):
+        return np.mean(self._submean, axis=measurements)
+
+    @property
+    def submean(self):
+        return self._submean
+
+    @property
+    def samples(self):
+        """
+        The (N, samples, T) samples on which derived quantities are evaluated. See Correlator.samples.
+        """
+        return self.resampler.samples(self._data_mean[:, None, ...], self._submean)
+
+    def from_samples(self, mean, samples):
+        return self.resampler.from_samples(mean[:, None, ...], samples)
+
+    def __len__(self):
+        return len(self._submean)
+
+    def __getitem__(self, channel):
+        """
+        Returns a Correlator view of 'channel', or a CorrelatorSet view of a slice of channels.
+        """
+        owner = self if self.base is None else self.base
+        if isinstance(channel, slice):
+            view = type(self)(self._data_mean[channel], self._submean[channel], self.resampler, owner)
+        else:
+            view = CorrelatorView(self._data_mean[channel], self._submean[channel], self.resampler, owner)
+        owner._views.add(view)
+        return view
+
+    def __iter__(self):
+        return (self[channel] for channel in range(len(self)))
+
+    ######################
+    # Overridden Members #
+    ######################
+    @lazy_readonly
+    def mean(self):
+        return self.resampler.mean_definition(self._data_mean, self.sample_mean)
+
+    @lazy_readonly
+    def cov(self):
+        return self.resampler.batched_cov_definition(self.mean, self._submean)
+
+    @lazy_readonly
+    def var(self):
+        return self.resampler.batched_var_definition(self.cov)
+
+    @lazy_readonly
+    def std(self):
+        return self.resampler.std_definition(self.var)
+
+    def forget_stats(self):
+        del self.sample_mean
+        del self.mean
+        del self.cov
+        del self.var
+        del self.std
+
+    def forget_shared_stats(self):
+        """
+        Forgets the cached statistics of the CorrelatorSet owning the memory of this one, and of each of its views.
+        """
+        owner = self if self.base is None else self.base
+        owner.forget_stats()
+        for view in owner._views:
+            if isinstance(view, Correlator):
+                view.forget_sample_mean()
+            view.forget_stats()
+
+    ##############
+    # Transforms #
+    ##############
+    def apply(self, transform, *args, **kwargs):
+        """
+        Returns a new CorrelatorSet of a transform, such as those of ExLib_Combinations, applied to every measurement of
+        every channel at once by folding the channels into the measurements axis.
+        The transform must act independently on each measurement: transforms over the configurations, such as
+        'bin_configurations' or 'roll_configurations', would mix the channels.
+        """
+        num_channels, num_samples = self._submean.shape[:2]
+        mean = transform(np.array(self._data_mean), *args, **kwargs)
+        samples = self.samples
+        samples = transform(samples.reshape(num_channels*num_samples, *samples.shape[2:]).copy(), *args, **kwargs)
+        if len(mean) != num_channels or len(samples) != num_channels*num_samples:
+            raise ValueError("The transform changed the number of measurements, so cannot be applied to each "
+                             "channel at once.")
+        samples = samples.reshape(num_channels, num_samples, *samples.shape[1:])
+        return type(self)(mean, self.from_samples(mean, samples), self.resampler)
+
+    ####################
+    # Binary operators #
+    ####################
+    def _split_other(self, other):
+        if isinstance(other, CorrelatorSet):
+            return other.data_mean, other.samples
+        elif isinstance(other, Correlator):
+            return other.data_mean[None, ...], other.samples[None, ...]
+        return other, other
+
+    def _binop(self, op, other):
+        other_mean, other_samples = self._split_other(other)
+        mean = op(self._data_mean, other_mean)
+        return type(self)(mean, self.from_samples(mean, op(self.samples, other_samples)), self.resampler)
+
+    def _ibinop(self, op, other):
+        other_mean, other_samples = self._split_other(other)
+        samples = op(self.samples, other_samples)
+        self._data_mean = op(self._data_mean, other_mean)
+        submean = self.from_samples(self._data_mean, samples)
+        if submean is not self._submean:
+            # The views of the stack share its memory
+            self._submean[...] = submean
+        self.forget_shared_stats()
+        return self
+
+    ##################
+    # Unary Operator #
+    ##################
+    def _unop(self, op):
+        mean = op(self._data_mean)
+        return type(self)(mean, self.from_samples(mean, op(self.samples)), self.resampler)
+
+
+class CorrelatorView(Correlator):
+    """
+    A Correlator of a single channel of a CorrelatorSet, sharing memory with the stack. In-place arithmetic on the view
+    forgets the cached statistics of the stack and of its other views, and other arithmetic returns ordinary
+    Correlators.
+    """
+    def __init__(self, mean, submean, resampler, stack):
+        super().__init__(mean, submean, resampler)
+        self.stack = stack
+
+    def __reduce__(self):
+        # A copy no longer shares memory with the stack
+        return Correlator, (self._data_mean, self._submean, self.resampler)
+
+    def _forget_array_stats(self):
+        self.stack.forget_shared_stats()
+
+    def _binop(self, op, other):
+        return Correlator(self._data_mean, self._submean, self.resampler)._binop(op, other)
+
+    def _ibinop(self, op, other):
+        if isinstance(other, Correlator):
+            samples = op(self.samples, other.samples)
+            self._data_mean = op(self._data_mean, other.data_mean)
+        else:
+            samples = op(self.samples, other)
+            self._data_mean = op(self._data_mean, other)
+        submean = self.resampler.from_samples(self._data_mean, samples)
+        if submean is not self._submean:
+            # The view shares the memory of the stack
+            self._submean[...] = submean
+        self.stack.forget_shared_stats()
+        return self
+
+    def _unop(self, op):
+        return Correlator(self._data_mean, self._submean, self.resampler)._unop(op)
@@ -0,0 +1,126 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/Core/DataStructures/IncrementalCorrelator.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import numpy as np
+
+from .Correlator import Correlator
+from sulat.Utilities.Evaluation import lazy_readonly
+
+measurements = 0
+
+
+class IncrementalCorrelator(Correlator):
+    """
+    A Correlator of a growing ensemble. Configurations are appended with 'append', which updates the mean and the
+    covariance matrix from running moments in time proportional to the new configurations. The samples are
+    resampled from the accumulated configurations only when they are requested, and equal those of a Correlator built
+    from all of the configurations at once.
+    Arithmetic returns ordinary Correlators of the current configurations, leaving the accumulated data untouched.
+    """
+    def __init__(self, data, resampler, transforms=None):
+        """
+        :param data: The initial configurations.
+        :param resampler: A resampler providing 'moments', 'merge_moments' and 'cov_from_moments', such as an
+                          IncrementalJackknife.
+        :param transforms: Functions applied to the initial and to each batch of appended configurations.
+        """
+        if not all(hasattr(resampler, attr) for attr in ('moments', 'merge_moments', 'cov_from_moments')):
+            raise TypeError(f"Resampler {type(resampler).__name__} cannot update its statistics incrementally.")
+        super(Correlator, self).__init__()
+        self.resampler = resampler
+        self.configurations = None
+        self.transforms = [] if transforms is None else transforms
+        self._chunks = []
+        self._moments = None
+        self.append(data)
+
+    def append(self, data):
+        """
+        Appends the configurations 'data' to the ensemble.
+        """
+        data = np.array(data)
+        for transform in self.transforms:
+            data = transform(data)
+        moments = self.resampler.moments(data)
+        self._moments = moments if self._moments is None else self.resampler.merge_moments(self._moments, moments)
+        self._chunks.append(data)
+        del self.data
+        del self._submean
+        self.forget_stats()
+
+    @lazy_readonly
+    def data(self):
+        if len(self._chunks) > 1:
+            self._chunks = [np.concatenate(self._chunks, axis=measurements)]
+        return self._chunks[0]
+
+    @property
+    def num_configs(self):
+        return self._moments[0]
+
+    ####################
+    # Data description #
+    ####################
+    @property
+    def _data_mean(self):
+        return self._moments[1]
+
+    @property
+    def sample_mean(self):
+        # The mean of the jackknife samples is the mean of the configurations
+        return self._moments[1]
+
+    @lazy_readonly
+    def _submean(self):
+        return self.resampler.resample(self.data)
+
+    @lazy_readonly
+    def cov(self):
+        return self.resampler.cov_from_moments(*self._moments)
+
+    def snapshot(self):
+        """
+        Returns an ordinary Correlator of the configurations appended so far.
+        """
+        return Correlator(self._data_mean.copy(), self._submean.copy(), self.resampler)
+
+    #############
+    # Operators #
+    #############
+    def __array_ufunc__(self, ufunc, method, *inputs, out=None, **kwargs):
+        # The accumulated configurations are only changed by appending
+        if out is not None and any(x is self for x in out):
+            return NotImplemented
+        return super().__array_ufunc__(ufunc, method, *inputs, out=out, **kwargs)
+
+    def _binop(self, op, other):
+        return self.snapshot()._binop(op, other)
+
+    def _ibinop(self, op, other):
+        return self.snapshot()._ibinop(op, other)
+
+    def _unop(self, op):
+        return self.snapshot()._unop(op)
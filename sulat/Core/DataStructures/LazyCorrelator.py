@@ -0,0 +1,185 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/Core/DataStructures/LazyCorrelator.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import operator
+
+import numpy as np
+
+from .ArithmeticMixIn import lazy_mode
+from .Correlator import Correlator
+from sulat.Utilities.Evaluation import lazy_readonly
+from sulat.Utilities.Storage import measurement_chunks
+
+measurements = 0
+
+# The ufuncs evaluating the operators of ArithmeticMixin, with in-place operators evaluated out of place
+operator_ufuncs = {
+    operator.add: np.add, operator.iadd: np.add,
+    operator.sub: np.subtract, operator.isub: np.subtract,
+    operator.mul: np.multiply, operator.imul: np.multiply,
+    operator.truediv: np.true_divide, operator.itruediv: np.true_divide,
+    operator.floordiv: np.floor_divide, operator.ifloordiv: np.floor_divide,
+    operator.mod: np.remainder, operator.imod: np.remainder,
+    operator.pow: np.power, operator.ipow: np.power,
+    operator.lshift: np.left_shift, operator.ilshift: np.left_shift,
+    operator.rshift: np.right_shift, operator.irshift: np.right_shift,
+    operator.and_: np.bitwise_and, operator.iand: np.bitwise_and,
+    operator.or_: np.bitwise_or, operator.ior: np.bitwise_or,
+    operator.xor: np.bitwise_xor, operator.ixor: np.bitwise_xor,
+    operator.neg: np.negative, operator.pos: np.positive, operator.abs: np.absolute, operator.invert: np.invert
+}
+
+
+class Leaf:
+    """
+    A Correlator operand of an expression graph.
+    """
+    def __init__(self, correlator):
+        self.correlator = correlator
+
+    def evaluate_mean(self):
+        return self.correlator.data_mean
+
+    def evaluate_chunk(self, chunk, buffers, memo):
+        correlator = self.correlator
+        return correlator.resampler.samples(correlator.data_mean, correlator.submean[chunk])
+
+    def leaves(self):
+        yield self
+
+
+class Expression:
+    """
+    A node of an expression graph, applying 'ufunc' to its operands: Expressions, Leaves, or constants.
+    """
+    def __init__(self, ufunc, operands):
+        self.ufunc = ufunc
+        self.operands = operands
+
+    def evaluate_mean(self):
+        return self.ufunc(*[evaluate_mean(operand) for operand in self.operands])
+
+    def evaluate_chunk(self, chunk, buffers, memo, out=None):
+        """
+        Evaluates the expression on the measurements 'chunk' of its leaves. The result of each node is written into a
+        buffer allocated for the first chunk and reused for all later chunks, or into 'out'. Nodes appearing more than
+        once in the graph are evaluated once per chunk.
+        """
+        if id(self) in memo:
+            return memo[id(self)]
+        args = [evaluate_chunk(operand, chunk, buffers, memo) for operand in self.operands]
+        if out is None and id(self) in buffers:
+            out = buffers[id(self)][:chunk.stop - chunk.start]
+        value = self.ufunc(*args) if out is None else self.ufunc(*args, out=out)
+        buffers.setdefault(id(self), value)
+        memo[id(self)] = value
+        return value
+
+    def leaves(self):
+        for operand in self.operands:
+            if isinstance(operand, (Expression, Leaf)):
+                yield from operand.leaves()
+
+
+def evaluate_mean(operand):
+    return operand.evaluate_mean() if isinstance(operand, (Expression, Leaf)) else operand
+
+
+def evaluate_chunk(operand, chunk, buffers, memo):
+    return operand.evaluate_chunk(chunk, buffers, memo) if isinstance(operand, (Expression, Leaf)) else operand
+
+
+def as_operand(obj):
+    """
+    Returns the expression graph of a not-yet-evaluated LazyCorrelator, so that chains of operations are fused, a Leaf
+    of any other Correlator, or the object itself.
+    """
+    if isinstance(obj, LazyCorrelator) and not obj.is_evaluated:
+        return obj.expression
+    elif isinstance(obj, Correlator):
+        return Leaf(obj)
+    return obj
+
+
+class LazyCorrelator(Correlator):
+    """
+    A Correlator defined by an expression graph of arithmetic on other Correlators, built in the lazy arithmetic mode.
+    The graph is evaluated once, from the values of its operands at that time, when the data or statistics of the
+    LazyCorrelator are first requested. The samples are evaluated 'chunksize' measurements at a time, so that the
+    intermediate results of the whole chain occupy one chunk-sized buffer per operation.
+    """
+    def __init__(self, expression, resampler, chunksize=None):
+        super(Correlator, self).__init__()
+        self.expression = expression
+        self.resampler = resampler
+        self.configurations = None
+        self.chunksize = lazy_mode['chunksize'] if chunksize is None else chunksize
+
+    @classmethod
+    def from_operation(cls, ufunc, *operands):
+        resampler = next(operand.resampler for operand in operands if isinstance(operand, Correlator))
+        return cls(Expression(ufunc, [as_operand(operand) for operand in operands]), resampler)
+
+    @property
+    def is_evaluated(self):
+        return hasattr(self, '__value_of__submean')
+
+    @lazy_readonly
+    def _data_mean(self):
+        return self.expression.evaluate_mean()
+
+    @lazy_readonly
+    def _submean(self):
+        num_measurements = next(self.expression.leaves()).correlator.submean.shape[measurements]
+        buffers = {}
+        submean = None
+        for chunk in measurement_chunks(num_measurements, self.chunksize):
+            out = None if submean is None else submean[chunk]
+            value = self.resampler.from_samples(self._data_mean, self.expression.evaluate_chunk(chunk, buffers, {}, out))
+            if submean is None:
+                submean = np.empty((num_measurements, *value.shape[1:]), dtype=value.dtype)
+            if value is not out:
+                submean[chunk] = value
+        return submean
+
+    #############
+    # Operators #
+    #############
+    def _binop(self, op, other):
+        if lazy_mode['enabled']:
+            return LazyCorrelator.from_operation(operator_ufuncs[op], self, other)
+        return Correlator(self.data_mean, self.submean, self.resampler)._binop(op, other)
+
+    def _ibinop(self, op, other):
+        # The expression graph is immutable: in-place operators return a new Correlator
+        if lazy_mode['enabled']:
+            return self._binop(op, other)
+        return Correlator(self.data_mean, self.submean.copy(), self.resampler)._ibinop(op, other)
+
+    def _unop(self, op):
+        if lazy_mode['enabled']:
+            return LazyCorrelator.from_operation(operator_ufuncs[op], self)
+        return Correlator(self.data_mean, self.submean.copy(), self.resampler)._unop(op)
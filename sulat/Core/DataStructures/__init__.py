@@ -24,4 +24,8 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 from .Configurations import Configurations
-from .Correlator import Correlator
\ No newline at end of file
+from .Correlator import Correlator
+from .CorrelatorSet import CorrelatorSet
+from .LazyCorrelator import LazyCorrelator
+from .ArithmeticMixIn import lazy_arithmetic
+from .IncrementalCorrelator import IncrementalCorrelator
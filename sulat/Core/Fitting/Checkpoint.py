@@ -0,0 +1,139 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/Core/Fitting/Checkpoint.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import os
+import pickle
+
+import numpy as np
+
+
+class FitScanCheckpoint:
+    """
+    An append-only file holding the results of a fit scan as they complete, so that an interrupted scan can be resumed.
+    The file starts with a header holding the signature of the scan, followed by one pickled (key, result) record per
+    fit range combination. 'result' is a FitScanRow, an error string for a failed fit, or None for a fit rejected by
+    the screening predicate.
+    If the file already exists, its records are loaded into 'records'. A ValueError is raised if it was written by a
+    scan with a different signature. A partially-written record at the end of the file, as left by a process that was
+    killed mid-write, is discarded.
+    """
+    def __init__(self, path, signature):
+        self.path = path
+        self.signature = signature
+        self.records = {}
+        if os.path.exists(path):
+            self.load()
+        else:
+            with open(path, 'wb') as f:
+                pickle.dump({'signature': signature}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self):
+        signature, self.records, end_of_records = read_checkpoint(self.path)
+        if signature != self.signature:
+            raise ValueError(f"The checkpoint {self.path} was written by a different fit scan.")
+        os.truncate(self.path, end_of_records)
+
+    def append(self, key, result):
+        with open(self.path, 'ab') as f:
+            pickle.dump((key, result), f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.records[key] = result
+
+
+def read_checkpoint(path):
+    """
+    Reads a checkpoint file, returning the signature of its scan, a dictionary of its records, and the offset of the
+    end of the last complete record.
+    """
+    records = {}
+    with open(path, 'rb') as f:
+        try:
+            header = pickle.load(f)
+        except Exception:
+            raise ValueError(f"{path} is not a fit scan checkpoint.")
+        if not isinstance(header, dict) or 'signature' not in header:
+            raise ValueError(f"{path} is not a fit scan checkpoint.")
+        end_of_records = f.tell()
+        while True:
+            try:
+                key, result = pickle.load(f)
+            except EOFError:
+                break
+            except Exception:
+                # A truncated record can fail to unpickle in many ways; everything from here on is discarded
+                break
+            records[key] = result
+            end_of_records = f.tell()
+    return header['signature'], records, end_of_records
+
+
+def merge_checkpoints(paths, merged_path):
+    """
+    Combines the checkpoints 'paths' of the shards of a fit scan into a single checkpoint at 'merged_path', which can
+    be passed as the 'checkpoint' of the full scan. A ValueError is raised if the shards belong to different scans.
+    Returns the number of records in the merged checkpoint.
+    """
+    signature = None
+    records = {}
+    for path in paths:
+        shard_signature, shard_records, _ = read_checkpoint(path)
+        if signature is None:
+            signature = shard_signature
+        elif shard_signature != signature:
+            raise ValueError(f"The checkpoint {path} belongs to a different fit scan than {paths[0]}.")
+        records.update(shard_records)
+
+    with open(merged_path, 'wb') as f:
+        pickle.dump({'signature': signature}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        for key, result in records.items():
+            pickle.dump((key, result), f, protocol=pickle.HIGHEST_PROTOCOL)
+    return len(records)
+
+
+def scan_signature(corrs, **scan_arguments):
+    """
+    Returns a hash identifying a fit scan by the data of 'corrs' and the arguments that determine its results.
+    Functions are identified by their qualified names, arrays by their contents, and anything else by its repr.
+    """
+    digest = hashlib.sha256()
+    for corr in corrs:
+        digest.update(np.ascontiguousarray(corr.mean).tobytes())
+        digest.update(np.ascontiguousarray(corr.submean).tobytes())
+    for key in sorted(scan_arguments):
+        digest.update(key.encode())
+        digest.update(describe(scan_arguments[key]).encode())
+    return digest.hexdigest()
+
+
+def describe(obj):
+    if isinstance(obj, np.ndarray):
+        return hashlib.sha256(np.ascontiguousarray(obj).tobytes()).hexdigest()
+    elif isinstance(obj, (list, tuple)):
+        return '[' + ', '.join(describe(item) for item in obj) + ']'
+    elif isinstance(obj, dict):
+        return '{' + ', '.join(f"{key!r}: {describe(value)}" for key, value in obj.items()) + '}'
+    elif hasattr(obj, '__qualname__'):
+        return f"{obj.__module__}.{obj.__qualname__}"
+    return repr(obj)
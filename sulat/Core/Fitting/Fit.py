@@ -25,7 +25,7 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import numpy as np
 
-from sulat.Core.Fitting.JointCovariance import joint_weights_matrix, cov2weights
+from sulat.Core.Fitting.JointCovariance import JointCovarianceCache, cov2weights
 from sulat.ExtensibleLibraries.Lib_Minimisers.Resources import p_value
 
 
@@ -84,6 +84,22 @@ class FitResult:
         return list(self.__dict__.keys())
 
 
+class CentralFitResult:
+    """
+    The outcome of the central fit alone, as passed to the 'screen' predicate of a fit scan.
+    """
+    def __init__(self, args, mean_results, fit_ranges):
+        mean, goodness_of_fit, residuals = mean_results
+        self.mean = {key: arg_mean for key, arg_mean in zip(args, mean)}
+        self.pvalue, self.chi_sq_per_dof, self.Ndof = goodness_of_fit
+        self.residuals = residuals
+        self.fit_ranges = fit_ranges
+
+    @property
+    def attributes(self):
+        return list(self.__dict__.keys())
+
+
 class SubFitResult:
     def __init__(self, args, mean, submean, std, fit_range, constants, resampler, corr, func,
                  parameter_map, arg_slots, residuals, subresiduals):
@@ -91,11 +107,11 @@ class SubFitResult:
         Ndof = len(residuals) - len(mean)
         if Ndof > 0:
             chi_sq = np.sum(residuals**2)
-            sub_chi_sq = [np.sum(sp**2) for sp in subresiduals]
+            sub_chi_sq = [np.sum(resampler.samples(residuals, sp)**2) for sp in subresiduals]
             pvalue = p_value(Ndof, chi_sq)
-            subpvalues = [p_value(Ndof, subchi) for subchi in sub_chi_sq]
+            subpvalues = [resampler.from_samples(pvalue, p_value(Ndof, subchi)) for subchi in sub_chi_sq]
             chi_sq_per_dof = chi_sq / Ndof
-            subchi_sq_per_dof = [subchi / Ndof for subchi in sub_chi_sq]
+            subchi_sq_per_dof = [resampler.from_samples(chi_sq_per_dof, subchi / Ndof) for subchi in sub_chi_sq]
         else:
             chi_sq_per_dof, subchi_sq_per_dof, pvalue, subpvalues = None, None, None, None
 
@@ -144,20 +160,95 @@ class FitFunctionInformation:
         return prepare_functions_for_fitting([self.function])[0]
 
 
-def generate_weights(corrs, fit_ranges, correlation, frozen, cov, subcovs, C):
+def perform_fit(corrs, funcs, fit_ranges, args, arg_identities, correlation, frozen, cov, subcovs, constants,
+                fit_method, xs, correlator_db, cov_cache=None, screen=None):
+    """
+    Fits 'funcs' to 'corrs' over 'fit_ranges'. This is the body of 'MixInFitting.fit', factored out so that fits can
+    also be run from worker processes that do not hold an Analysis object.
+    'correlator_db' is the correlator database used to resolve vector constants of the form '{name}'.
+    'cov_cache' is an optional JointCovarianceCache of 'corrs' from which the weights are sliced, if 'cov' is None.
+    'screen' is an optional predicate that is passed the CentralFitResult of the central fit. If it returns False, the
+    fits to the resampled bins are skipped and None is returned.
+    """
+    resampler = corrs[0].resampler
+    if not resampler.holds_samples and not frozen:
+        raise ValueError(f"{type(resampler).__name__} propagates the fluctuations of the data linearly through the "
+                         f"central fit, so only frozen fits are available.")
+    constants = {} if constants is None else constants
+    fit_ranges = normalise_fit_ranges(fit_ranges)
+    mean_data = [corr.mean[fit_range] for corr, fit_range in zip(corrs, fit_ranges)]
+    submean_data = [corr.submean[:, fit_range] for corr, fit_range in zip(corrs, fit_ranges)]
+    C, T = corrs[0].submean.shape
+    if cov is None and cov_cache is None:
+        cov_cache = JointCovarianceCache(corrs, correlation, frozen)
+    weights = generate_central_weights(fit_ranges, frozen, cov, subcovs, cov_cache)
+
+    wrapped_functions = prepare_functions_for_fitting(funcs)
+    parameter_maps_mean, parameter_maps_bin, arg_location_maps, arg_idxs = transform_args(funcs, list(args.keys()),
+                                                                                          constants, arg_identities, T,
+                                                                                          C, correlator_db)
+
+    xs = [np.arange(T)[fr] for fr in fit_ranges] if xs is None else xs
+
+    def fit_wrapper(fit_vector, weights, initial_conditions, parameter_map):
+        return fit_method(fit_vector, initial_conditions, weights, wrapped_functions, xs, parameter_map,
+                          arg_location_maps)
+
+    # Minimisers that can fit all bins in a single call expose this through a 'fit_bins' attribute
+    fit_bins = getattr(fit_method, 'fit_bins', None)
+    if fit_bins is None:
+        batch_wrapper = None
+    else:
+        def batch_wrapper(fit_vectors, weights, initial_conditions, parameter_maps):
+            return fit_bins(fit_vectors, initial_conditions, weights, wrapped_functions, xs, parameter_maps,
+                            arg_location_maps)
+
+    initial_conditions = np.array(list(args.values()))
+    central_parameters = mk_central_fit_result(mean_data, weights, fit_wrapper, initial_conditions,
+                                               parameter_maps_mean)
+    if screen is not None and not screen(CentralFitResult(args, central_parameters[0], fit_ranges)):
+        return None
+
+    subweights = generate_subweights(fit_ranges, frozen, weights, subcovs, C, cov_cache)
+    if resampler.holds_samples:
+        central_parameters, bin_parameters = mk_fit_results(mean_data, submean_data, weights,
+                                                            fit_wrapper, subweights,
+                                                            C, initial_conditions,
+                                                            parameter_maps_mean, parameter_maps_bin,
+                                                            batch_lambda=batch_wrapper,
+                                                            central_parameters=central_parameters)
+    else:
+        vector_constants = any(item[0] == '{' and item[-1] == '}' for argids in arg_identities for item in argids)
+        bin_parameters = mk_linearised_fit_results(submean_data, weights, wrapped_functions, xs, central_parameters[0],
+                                                   parameter_maps_mean, parameter_maps_bin, arg_location_maps,
+                                                   resampler, vector_constants)
+
+    return FitResult(args, corrs, funcs, central_parameters, bin_parameters, weights, subweights, fit_ranges, constants,
+                     resampler, parameter_maps_mean, arg_location_maps, arg_identities)
+
+
+def generate_weights(corrs, fit_ranges, correlation, frozen, cov, subcovs, C, cov_cache=None):
+    if cov is None and cov_cache is None:
+        cov_cache = JointCovarianceCache(corrs, correlation, frozen)
+    weights = generate_central_weights(fit_ranges, frozen, cov, subcovs, cov_cache)
+    return weights, generate_subweights(fit_ranges, frozen, weights, subcovs, C, cov_cache)
+
+
+def generate_central_weights(fit_ranges, frozen, cov, subcovs, cov_cache):
     if cov is None:
-        weights, subweights = joint_weights_matrix(corrs, fit_ranges, correlation, frozen)
-    elif frozen:
-        weights = cov2weights(cov)
-        subweights = [weights for _ in range(C)]
-    elif subcovs is None:
+        return cov_cache.central_weights(fit_ranges)
+    elif not frozen and subcovs is None:
         raise ValueError("Attempted to do an unfrozen fit with a custom covariance matrix, "
                          "but no subcovs were provided.")
-    else:
-        weights = cov2weights(cov)
-        subweights = [cov2weights(subcov) for subcov in subcovs]
+    return cov2weights(cov)
 
-    return weights, subweights
+
+def generate_subweights(fit_ranges, frozen, weights, subcovs, C, cov_cache):
+    if frozen:
+        return [weights for _ in range(C)]
+    elif subcovs is None:
+        return cov_cache.subweights(fit_ranges)
+    return [cov2weights(subcov) for subcov in subcovs]
 
 
 def normalise_fit_ranges(fit_ranges):
@@ -176,6 +267,27 @@ def fit_func_factory(func):
             slot = fit_parameter_slots[key]
             prepared_map[slot] = fit_parameters[key]
         return func(xs, *prepared_map)
+    wrapped_func.is_linear = getattr(func, 'is_linear', False)
+
+    jacobian = getattr(func, 'jacobian', None)
+    if jacobian is not None:
+        def wrapped_jacobian(xs, fit_parameters, prepared_map, fit_parameter_slots):
+            """
+            Returns the derivatives of 'func' with respect to every fit parameter, stacked along the last axis.
+            Fit parameters that do not appear in 'func' have zero derivative.
+            """
+            for key in fit_parameter_slots:
+                slot = fit_parameter_slots[key]
+                prepared_map[slot] = fit_parameters[key]
+            derivatives = jacobian(xs, *prepared_map)
+            used_derivatives = {key: derivatives[slot] for key, slot in fit_parameter_slots.items()}
+            shape = np.broadcast(xs, *used_derivatives.values()).shape
+            retval = np.zeros((*shape, len(fit_parameters)))
+            for key, derivative in used_derivatives.items():
+                retval[..., key] = derivative
+            return retval
+        wrapped_func.jacobian = wrapped_jacobian
+
     return wrapped_func
 
 
@@ -201,7 +313,7 @@ def mk_automatic_constants(correlators_db, args, arg_identities, constants, T, C
         if item[0] == '{':
             key = item[1:-1]
             vec_constants_mean[item] = correlators_db[key].mean
-            vec_constants_sub[item] = correlators_db[key].submean
+            vec_constants_sub[item] = correlators_db[key].samples
 
     return constants, vec_constants_mean, vec_constants_sub
 
@@ -246,11 +358,20 @@ def transform_args(fit_functions, arg_names, const_dict, arg_identities, T, C, c
     return parameter_maps_mean, parameter_maps_bin, fit_parameter_slots, param_idxs
 
 
-def mk_fit_results(mean_data, bin_data, mean_cov, fit_lambda, bin_cov, configs, initial_conditions, pmap_mn, pmap_bin, verbose=False):
-    bin_parameters = [np.zeros((configs, len(initial_conditions)), dtype=np.float), [None]*configs, [None]*configs]
-    mean_data = np.concatenate(mean_data)
+def mk_central_fit_result(mean_data, mean_cov, fit_lambda, initial_conditions, pmap_mn):
+    return np.array([fit_lambda(np.concatenate(mean_data), mean_cov, initial_conditions, pmap_mn)])
+
+
+def mk_fit_results(mean_data, bin_data, mean_cov, fit_lambda, bin_cov, configs, initial_conditions, pmap_mn, pmap_bin,
+                   verbose=False, batch_lambda=None, central_parameters=None):
+    if central_parameters is None:
+        central_parameters = mk_central_fit_result(mean_data, mean_cov, fit_lambda, initial_conditions, pmap_mn)
+    if batch_lambda is not None:
+        parameters, fit_statistics, fvecs = batch_lambda(np.concatenate(bin_data, axis=1), bin_cov,
+                                                         central_parameters[0][0], pmap_bin)
+        return central_parameters, [parameters, list(fit_statistics), list(fvecs)]
 
-    central_parameters = np.array([fit_lambda(mean_data, mean_cov, initial_conditions, pmap_mn)])
+    bin_parameters = [np.zeros((configs, len(initial_conditions)), dtype=np.float), [None]*configs, [None]*configs]
     if verbose:
         print("Progress...    ", end="")
         mk_progbar(0, configs+1)
@@ -268,6 +389,46 @@ def mk_fit_results(mean_data, bin_data, mean_cov, fit_lambda, bin_cov, configs,
     return central_parameters, bin_parameters
 
 
+def mk_linearised_fit_results(bin_data, weights, funcs, xs, central_result, pmap_mn, pmap_bin, fit_parameter_slots,
+                              resampler, vector_constants=False):
+    """
+    Returns the fluctuations of the fit parameters, fit statistics and weighted residuals of each configuration, for
+    resamplers that hold the fluctuations of the data rather than samples, such as the GammaMethod. The fluctuations
+    of the data are propagated linearly through the gradient of the central fit parameters with respect to the data,
+    so no fit is performed beyond the central fit. If there are 'vector_constants', the fluctuations of the constants
+    shift the model of each configuration, and are propagated with those of the data.
+    """
+    parameters, (pvalue, chi_sq_per_dof, Ndof), residuals = central_result
+
+    def model(fit_parameters, parameter_maps):
+        return np.concatenate([func(x, fit_parameters, p_map, p_slot) for func, x, p_map, p_slot
+                               in zip(funcs, xs, parameter_maps, fit_parameter_slots)])
+
+    fluctuations = np.concatenate(bin_data, axis=1)
+    if vector_constants:
+        central_model = model(parameters, pmap_mn)
+        fluctuations = fluctuations - resampler.from_samples(central_model,
+                                                             np.array([model(parameters, pmap) for pmap in pmap_bin]))
+
+    # The Jacobian of the model at the central fit parameters, by central differences
+    steps = 1e-6*np.maximum(np.abs(parameters), 1e-8)
+    jacobian = np.stack([(model(parameters + step*unit, pmap_mn) - model(parameters - step*unit, pmap_mn))/(2*step)
+                         for step, unit in zip(steps, np.eye(len(parameters)))], axis=-1)
+
+    # The weighted residuals (data - model).weights are stationary in the parameters at the central fit
+    weighted_design = np.dot(weights.T, jacobian)
+    weighted_fluctuations = np.dot(fluctuations, weights)
+    parameter_fluctuations = np.dot(weighted_fluctuations, np.linalg.pinv(weighted_design).T)
+    residual_fluctuations = weighted_fluctuations - np.dot(parameter_fluctuations, weighted_design.T)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi_sq = np.sum(resampler.samples(residuals, residual_fluctuations)**2, axis=1)
+        subpvalues = resampler.from_samples(pvalue, p_value(Ndof, chi_sq))
+        subchi_sq_per_dof = resampler.from_samples(chi_sq_per_dof, chi_sq / Ndof)
+    fit_statistics = [(pv, chisqdof, Ndof) for pv, chisqdof in zip(subpvalues, subchi_sq_per_dof)]
+    return [parameter_fluctuations, fit_statistics, list(residual_fluctuations)]
+
+
 def mk_progbar(cur, total):
     prog_percent = mk_progval(cur, total)
     if prog_percent != mk_progval(cur-1, total):
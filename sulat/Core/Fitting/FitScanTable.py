@@ -0,0 +1,226 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/Core/Fitting/FitScanTable.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from collections.abc import Mapping
+
+import numpy as np
+
+from sulat.Core.Fitting.Fit import perform_fit
+from sulat.Core.Fitting.ModelAveraging import model_average
+
+
+class FitScanRow:
+    """
+    The summary of a single fit of a fit scan that is kept by a FitScanTable: the fitted parameters and their
+    statistics, without the weights, residuals and sub-results of a FitResult.
+    """
+    __slots__ = ('fit_ranges', 'mean', 'submean', 'std', 'chi_sq_per_dof', 'subchi_sq_per_dof', 'pvalue', 'Ndof')
+
+    def __init__(self, fit_ranges, mean, submean, std, chi_sq_per_dof, subchi_sq_per_dof, pvalue, Ndof):
+        self.fit_ranges = fit_ranges
+        self.mean = mean
+        self.submean = submean
+        self.std = std
+        self.chi_sq_per_dof = chi_sq_per_dof
+        self.subchi_sq_per_dof = subchi_sq_per_dof
+        self.pvalue = pvalue
+        self.Ndof = Ndof
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+    @classmethod
+    def from_fit_result(cls, fit_ranges, fit_result):
+        return cls(fit_ranges,
+                   np.array(list(fit_result.mean.values())),
+                   np.array(list(fit_result.submean.values())).T,
+                   np.array(list(fit_result.std.values())),
+                   fit_result.chi_sq_per_dof,
+                   np.array(fit_result.subchi_sq_per_dof),
+                   fit_result.pvalue,
+                   fit_result.Ndof)
+
+
+class ScanFitter:
+    """
+    Re-runs single fits of a fit scan from the arguments of the scan, to materialise the FitResults of a FitScanTable.
+    """
+    def __init__(self, **context):
+        self.context = context
+
+    def __call__(self, fit_ranges):
+        return perform_fit(fit_ranges=fit_ranges, **self.context)
+
+
+class FitScanTable(Mapping):
+    """
+    The results of a fit scan, held column-wise in NumPy arrays with one row per fit range combination:
+        fit_keys:          The stringified fit range combinations, as used by 'fit_scan'.
+        fit_ranges:        The fit range combinations.
+        mean:              The (fits, parameters) central values of the fit parameters, named by 'parameter_names'.
+        submean:           The (fits, bins, parameters) fit parameters of each resampled bin.
+        std:               The (fits, parameters) uncertainties of the fit parameters.
+        chi_sq_per_dof:    The (fits,) chi^2/Ndof of each central fit.
+        subchi_sq_per_dof: The (fits, bins) chi^2/Ndof of each resampled fit.
+        pvalue:            The (fits,) p-value of each central fit.
+        Ndof:              The (fits,) number of degrees of freedom of each fit.
+    The table is a read-only mapping from the keys to FitResults, as returned by 'fit_scan' before. The FitResults are
+    not stored, but are re-fitted on first access if the table was given a 'fitter', and then kept.
+    'filter', 'sort' and 'group_by' return tables holding a subset of the rows, and 'model_average' averages the fit
+    parameters over the rows.
+    """
+    columns = ('mean', 'submean', 'std', 'chi_sq_per_dof', 'subchi_sq_per_dof', 'pvalue', 'Ndof')
+
+    def __init__(self, parameter_names, fit_keys, fit_ranges, mean, submean, std, chi_sq_per_dof, subchi_sq_per_dof, pvalue,
+                 Ndof, resampler=None, fitter=None, materialised=None):
+        self.parameter_names = list(parameter_names)
+        self.fit_keys = np.array(fit_keys, dtype=object)
+        self.fit_ranges = list(fit_ranges)
+        self.mean = mean
+        self.submean = submean
+        self.std = std
+        self.chi_sq_per_dof = chi_sq_per_dof
+        self.subchi_sq_per_dof = subchi_sq_per_dof
+        self.pvalue = pvalue
+        self.Ndof = Ndof
+        self.resampler = resampler
+        self.fitter = fitter
+        self.materialised = {} if materialised is None else materialised
+        self.index = {key: i for i, key in enumerate(self.fit_keys)}
+
+    @classmethod
+    def from_rows(cls, parameter_names, fit_keys, rows, resampler=None, fitter=None):
+        """
+        Builds a table from a list of FitScanRows and their keys.
+        """
+        nparams = len(parameter_names)
+        if len(rows):
+            columns = {column: np.array([getattr(row, column) for row in rows]) for column in cls.columns}
+        else:
+            columns = {'mean': np.zeros((0, nparams)), 'submean': np.zeros((0, 0, nparams)),
+                       'std': np.zeros((0, nparams)), 'chi_sq_per_dof': np.zeros(0),
+                       'subchi_sq_per_dof': np.zeros((0, 0)), 'pvalue': np.zeros(0), 'Ndof': np.zeros(0, dtype=int)}
+        return cls(parameter_names, fit_keys, [row.fit_ranges for row in rows], resampler=resampler, fitter=fitter,
+                   **columns)
+
+    def __getitem__(self, key):
+        if key not in self.materialised:
+            if key not in self.index:
+                raise KeyError(key)
+            if self.fitter is None:
+                raise KeyError(f"The FitResult of {key} cannot be materialised, as the table has no fitter.")
+            self.materialised[key] = self.fitter(self.fit_ranges[self.index[key]])
+        return self.materialised[key]
+
+    def __iter__(self):
+        return iter(self.fit_keys)
+
+    def __len__(self):
+        return len(self.fit_keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __repr__(self):
+        return f"FitScanTable({len(self)} fits of {', '.join(self.parameter_names)})"
+
+    def row(self, key):
+        """
+        Returns the FitScanRow of 'key'.
+        """
+        i = self.index[key]
+        return FitScanRow(self.fit_ranges[i], *[getattr(self, column)[i] for column in self.columns])
+
+    def column(self, name):
+        """
+        Returns the column 'name', or the central values of the fit parameter 'name'.
+        """
+        if name in self.parameter_names:
+            return self.mean[:, self.parameter_names.index(name)]
+        elif name in self.columns:
+            return getattr(self, name)
+        raise KeyError(f"{name} is neither a column nor a fit parameter.")
+
+    def parameter(self, name):
+        """
+        Returns the (fits,) central values, (fits, bins) resampled values and (fits,) uncertainties of the fit
+        parameter 'name'.
+        """
+        i = self.parameter_names.index(name)
+        return self.mean[:, i], self.submean[:, :, i], self.std[:, i]
+
+    def take(self, indices):
+        """
+        Returns a table of the rows at 'indices', in that order.
+        """
+        indices = np.asarray(indices, dtype=int)
+        return FitScanTable(self.parameter_names, self.fit_keys[indices], [self.fit_ranges[i] for i in indices],
+                            resampler=self.resampler, fitter=self.fitter, materialised=self.materialised,
+                            **{column: getattr(self, column)[indices] for column in self.columns})
+
+    def filter(self, mask):
+        """
+        Returns a table of the rows selected by 'mask', a boolean array or a function of the table returning one,
+        e.g. 'lambda table: table.pvalue > 0.05'.
+        """
+        if callable(mask):
+            mask = mask(self)
+        return self.take(np.flatnonzero(mask))
+
+    def sort(self, by, descending=False):
+        """
+        Returns a table of the rows sorted by the column or fit parameter 'by', or by an array of sort keys.
+        """
+        values = self.column(by) if isinstance(by, str) else np.asarray(by)
+        order = np.argsort(values, kind='stable')
+        return self.take(order[::-1] if descending else order)
+
+    def group_by(self, by):
+        """
+        Returns a dictionary of tables, one for each distinct value of the column 'by'. 'by' may also be an array of
+        labels, or a function mapping a fit range combination to a label, such as 'lambda ranges: ranges[0][0]'.
+        """
+        if callable(by):
+            labels = [by(fit_ranges) for fit_ranges in self.fit_ranges]
+        elif isinstance(by, str):
+            labels = self.column(by)
+        else:
+            labels = by
+        groups = {}
+        for i, label in enumerate(labels):
+            groups.setdefault(label.item() if isinstance(label, np.generic) else label, []).append(i)
+        return {label: self.take(indices) for label, indices in groups.items()}
+
+    def model_average(self, weighting='aic', resampler=None):
+        """
+        Returns the ModelAverage of the fit parameters over the fits in the table, with the fits weighted by 'aic',
+        'pvalue', or 'flat', and the statistical uncertainties computed from 'resampler', which defaults to that of
+        the table. See sulat.Core.Fitting.ModelAveraging.model_average.
+        """
+        return model_average(self, weighting, resampler)
@@ -23,6 +23,8 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+from collections import OrderedDict
+
 import numpy as np
 
 measurements = 0
@@ -30,14 +32,194 @@ timeslices = 1
 
 
 def joint_weights_matrix(correlators, fit_ranges, correlation, frozen):
-    central_cov, subcovs = joint_cov(correlators, fit_ranges, correlation, frozen)
-    central_weights = cov2weights(central_cov)
-    # It's a bit messy to have two if statements operating on the 'frozen' argument, but it allows us to both increase
-    # atomicity and make a CPU+memory saving in the frozen case
-    if frozen:
-        return central_weights, [central_weights for _ in subcovs]
-    else:
-        return central_weights, [cov2weights(subcov) for subcov in subcovs]
+    return JointCovarianceCache(correlators, correlation, frozen).weights(fit_ranges)
+
+
+class JointCovarianceCache:
+    """
+    Holds the joint covariance matrix of a set of correlators over all of their timeslices, and for unfrozen fits the
+    double covariance matrices of every resampled bin, so that the weights matrices of many fit ranges can be cut out
+    of them by index-slicing rather than recomputed, as in a fit scan.
+    Weights matrices are cached per fit range combination. If the correlators are not correlated with one another
+    ('correlation' is 'block' or False), the joint weights matrix is block-diagonal and is instead assembled from
+    weights matrices cached per correlator and fit range, so that blocks shared between fit range combinations are
+    only inverted once. The least recently used weights are evicted once they occupy more than 'max_cache_bytes'.
+    If the resampler expresses its double covariance matrices as a shared Gram matrix plus a rank-one term per bin,
+    through a 'cov_double_factors' method as the Jackknife does, the double covariance matrices are never formed, and
+    the per-bin weights are instead computed from a single inversion by low_rank_subweights.
+    """
+    def __init__(self, correlators, correlation, frozen, max_cache_bytes=2**30):
+        assert all([isinstance(corr.resampler, type(correlators[0].resampler)) for corr in correlators]), \
+               "Input correlators do not all have the same resampling method."
+
+        self.correlation = correlation
+        self.frozen = frozen
+        self.max_cache_bytes = max_cache_bytes
+        self.C, self.T = correlators[0].submean.shape
+
+        means = np.concatenate([corr.mean for corr in correlators], axis=0)
+        submeans = np.concatenate([corr.submean for corr in correlators], axis=timeslices)
+        resampler = correlators[0].resampler
+        self.total_cov = resampler.cov_definition(means, submeans)
+        self.total_double_cov = None
+        self.double_cov_factors = None
+        if not frozen and hasattr(resampler, 'cov_double_factors'):
+            self.double_cov_factors = resampler.cov_double_factors(submeans)
+        elif not frozen:
+            self.total_double_cov = stream_cov_double(resampler, submeans, joint_configurations(correlators))
+
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+
+    def weights(self, fit_ranges):
+        """
+        Returns the central weights matrix of 'fit_ranges' and a list of the weights matrices of each resampled bin.
+        In the frozen case, every element of the list is the central weights matrix.
+        """
+        central_weights = self.central_weights(fit_ranges)
+        return central_weights, self.subweights(fit_ranges, central_weights)
+
+    def central_weights(self, fit_ranges):
+        """
+        Returns the weights matrix of the central fit over 'fit_ranges'.
+        """
+        return self.joint(fit_ranges, double=False)
+
+    def subweights(self, fit_ranges, central_weights=None):
+        """
+        Returns a list of the weights matrices of each resampled bin over 'fit_ranges'. In the frozen case, every
+        element of the list is 'central_weights', which is looked up if it is not given.
+        """
+        if self.frozen:
+            central_weights = self.central_weights(fit_ranges) if central_weights is None else central_weights
+            return [central_weights for _ in range(self.C)]
+        return list(self.joint(fit_ranges, double=True))
+
+    def joint(self, fit_ranges, double):
+        fit_ranges = [np.asarray(fit_range) for fit_range in fit_ranges]
+        if self.correlation and self.correlation != 'block':
+            indices = np.concatenate([i*self.T + fit_range for i, fit_range in enumerate(fit_ranges)])
+            return self.cached((double, tuple(tuple(fit_range.tolist()) for fit_range in fit_ranges)), indices,
+                               diagonal=False, double=double)
+        return block_diagonal([self.cached((double, i, tuple(fit_range.tolist())), i*self.T + fit_range,
+                                           diagonal=not self.correlation, double=double)
+                               for i, fit_range in enumerate(fit_ranges)])
+
+    def cached(self, key, indices, diagonal, double):
+        """
+        Returns the weights matrix of the timeslices 'indices' of the central covariance matrix, or the
+        (bins, n, n) array of weights matrices of the double covariance matrices if 'double' is True, computing it if
+        it is not cached under 'key'.
+        """
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        if not double:
+            weights = cov2weights(cut_cov(self.total_cov, indices, diagonal))
+        elif self.double_cov_factors is not None:
+            centred, gram, rank_one_factor, prefactor = self.double_cov_factors
+            weights = low_rank_subweights(centred[:, indices], cut_cov(gram, indices, diagonal), rank_one_factor,
+                                          prefactor, diagonal)
+        else:
+            weights = cov2weights(cut_cov(self.total_double_cov, indices, diagonal))
+
+        self._cache[key] = weights
+        self._cache_bytes += weights.nbytes
+        while self._cache_bytes > self.max_cache_bytes and len(self._cache) > 1:
+            _, old_weights = self._cache.popitem(last=False)
+            self._cache_bytes -= old_weights.nbytes
+        return weights
+
+
+def low_rank_subweights(centred, gram, rank_one_factor, prefactor, diagonal=False):
+    """
+    Returns the (bins, n, n) array of weights matrices cov2weights(K_i) of the covariance matrices
+        K_i = prefactor * (gram + rank_one_factor * t_i t_i^T)
+    of each row t_i of 'centred', or of their diagonals if 'diagonal' is True.
+    By the Sherman-Morrison formula, inv(K_i) = (inv(gram) - beta_i v_i v_i^T) / prefactor, with v_i = inv(gram) t_i
+    and beta_i = rank_one_factor / (1 + rank_one_factor t_i.v_i). The Cholesky factor of inv(gram) is computed once,
+    and each weights matrix follows from it by a rank-one downdate, which costs O(n^2) rather than the O(n^3) of an
+    inversion.
+    """
+    if diagonal:
+        variances = prefactor * (np.diag(gram)[None, :] + rank_one_factor * centred**2)
+        return (1 / np.sqrt(variances))[:, :, None] * np.eye(centred.shape[1])
+
+    central_factor = cov2weights(gram)
+    v = np.linalg.solve(gram, centred.T).T
+    beta = rank_one_factor / (1 + rank_one_factor * np.einsum('bi,bi->b', centred, v))
+    factors = np.repeat(central_factor[None, :, :], len(centred), axis=0)
+    cholesky_rank_one_downdate(factors, np.sqrt(beta)[:, None] * v)
+    return factors / np.sqrt(prefactor)
+
+
+def cholesky_rank_one_downdate(factors, x):
+    """
+    Overwrites the (bins, n, n) lower-triangular Cholesky factors L_i of the matrices M_i with the Cholesky factors of
+    M_i - x_i x_i^T, for each row x_i of 'x', by the standard sequence of rotations.
+    Raises a numpy.linalg.LinAlgError if any downdated matrix is not positive definite.
+    """
+    x = x.copy()
+    for k in range(factors.shape[-1]):
+        diagonal = factors[:, k, k]
+        squared = diagonal**2 - x[:, k]**2
+        if np.any(squared <= 0):
+            raise np.linalg.LinAlgError("Matrix is not positive definite")
+        r = np.sqrt(squared)
+        c = (r / diagonal)[:, None]
+        s = (x[:, k] / diagonal)[:, None]
+        factors[:, k, k] = r
+        factors[:, k+1:, k] = (factors[:, k+1:, k] - s * x[:, k+1:]) / c
+        x[:, k+1:] = c * x[:, k+1:] - s * factors[:, k+1:, k]
+
+
+def stream_cov_double(resampler, submeans, configurations=None):
+    """
+    Collects the double covariance matrices of 'submeans' from the chunks yielded by the resampler into a single
+    (bins, T, T) array, so that the double means of the resampler are never held in full.
+    """
+    cov_double = np.empty((submeans.shape[measurements], submeans.shape[timeslices], submeans.shape[timeslices]))
+    start = 0
+    for chunk in resampler.iter_cov_double_definition(submeans, configurations):
+        cov_double[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    return cov_double
+
+
+def joint_configurations(correlators):
+    """
+    Returns the configurations of 'correlators' joined along their timeslices, as their submeans are, or None if any
+    of them does not keep its configurations.
+    """
+    if any(corr.configurations is None for corr in correlators):
+        return None
+    return np.concatenate([corr.configurations for corr in correlators], axis=timeslices)
+
+
+def cut_cov(cov, indices, diagonal):
+    """
+    Cuts the rows and columns 'indices' out of the last two axes of 'cov', discarding the off-diagonal elements if
+    'diagonal' is True.
+    """
+    cut = cov[..., indices[:, None], indices[None, :]]
+    if diagonal:
+        cut = np.diagonal(cut, axis1=-2, axis2=-1)[..., None] * np.eye(len(indices))
+    return cut
+
+
+def block_diagonal(blocks):
+    """
+    Places the (..., n_i, n_i) arrays 'blocks' along the diagonal of a (..., sum n_i, sum n_i) array of zeros.
+    """
+    size = sum(block.shape[-1] for block in blocks)
+    retval = np.zeros((*blocks[0].shape[:-2], size, size))
+    start = 0
+    for block in blocks:
+        stop = start + block.shape[-1]
+        retval[..., start:stop, start:stop] = block
+        start = stop
+    return retval
 
 
 def joint_cov(correlators, fit_ranges, correlation, frozen):
@@ -48,7 +230,6 @@ def joint_cov(correlators, fit_ranges, correlation, frozen):
            "Input correlators do not all have the same resampling method."
 
     cov_func = correlators[0].resampler.cov_definition
-    double_cov_func = correlators[0].resampler.cov_double_definition
     C, T = correlators[0].submean.shape
 
     total_cov = cov_func(means, submeans)
@@ -57,12 +238,12 @@ def joint_cov(correlators, fit_ranges, correlation, frozen):
     if frozen:
         return central_cov, [central_cov for _ in range(C)]
     else:
-        double_submeans = np.concatenate([corr.submean_double for corr in correlators], axis=timeslices+1)
-        cov_double = double_cov_func(submeans, double_submeans)
         sub_covs = []
-        for subtotal_cov in cov_double:
-            sub_cov = cutdown_and_correlate(subtotal_cov, fit_ranges, correlation, T)
-            sub_covs.append(sub_cov)
+        for cov_double in correlators[0].resampler.iter_cov_double_definition(submeans,
+                                                                             joint_configurations(correlators)):
+            for subtotal_cov in cov_double:
+                sub_cov = cutdown_and_correlate(subtotal_cov, fit_ranges, correlation, T)
+                sub_covs.append(sub_cov)
         return central_cov, sub_covs
 
 
@@ -0,0 +1,116 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/Core/Fitting/ModelAveraging.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+from sulat.ExtensibleLibraries.Lib_Minimisers.Resources import p_value
+
+
+class ModelAverage:
+    """
+    The model average of the fit parameters of a set of fits:
+        weights:    The (fits,) normalised weights of the central fits.
+        subweights: The (bins, fits) normalised weights of the fits to each resampled bin.
+        mean:       The weighted averages of the central fit parameters.
+        submean:    The weighted averages of the fit parameters of each resampled bin.
+        std:        The statistical uncertainties of the averaged parameters, from the resampler of the fits.
+        sys_std:    The systematic uncertainties, as the weighted standard deviation of the central fit parameters over
+                    the fits.
+        sys_substd: The systematic uncertainties of each resampled bin, as the standard deviation of the fit
+                    parameters of the bin over the fits, weighted by the subweights.
+        sys_std_err: The statistical uncertainties of the systematic uncertainties, from the resampler of the fits
+                     applied to 'sys_std' and 'sys_substd'.
+        total_std:  The statistical and systematic uncertainties added in quadrature.
+        res_cov:    The statistical covariance matrix of the averaged parameters.
+    """
+    def __init__(self, parameter_names, weights, subweights, mean, submean, resampler):
+        average = weights @ mean
+        samples = resampler.samples(mean[:, None], submean)
+        subaverage_samples = np.einsum('bf,fbp->bp', subweights, samples)
+        subaverage = resampler.from_samples(average, subaverage_samples)
+        cov, _, stds = resampler.covvarstd(average, subaverage)
+        sys_stds = np.sqrt(np.maximum(weights @ (mean - average)**2, 0))
+        sys_substds = np.sqrt(np.maximum(np.einsum('bf,fbp->bp', subweights,
+                                                   (samples - subaverage_samples[None])**2), 0))
+        sys_substds = resampler.from_samples(sys_stds, sys_substds)
+        _, _, sys_std_errs = resampler.covvarstd(sys_stds, sys_substds)
+
+        self.weights = weights
+        self.subweights = subweights
+        self.mean = {key: value for key, value in zip(parameter_names, average)}
+        self.submean = {key: subaverage[:, i] for i, key in enumerate(parameter_names)}
+        self.std = {key: value for key, value in zip(parameter_names, stds)}
+        self.sys_std = {key: value for key, value in zip(parameter_names, sys_stds)}
+        self.sys_substd = {key: sys_substds[:, i] for i, key in enumerate(parameter_names)}
+        self.sys_std_err = {key: value for key, value in zip(parameter_names, sys_std_errs)}
+        self.total_std = {key: np.sqrt(std**2 + sys_std**2) for key, std, sys_std in zip(parameter_names, stds, sys_stds)}
+        self.res_cov = cov
+
+    @property
+    def attributes(self):
+        return list(self.__dict__.keys())
+
+
+def model_average(table, weighting='aic', resampler=None):
+    """
+    Averages the fit parameters of the fits in a FitScanTable, weighting each fit by:
+        'aic':    exp(-chi^2/2 + Ndof), the Akaike information criterion penalised by the number of data points
+                  excluded from the fit, normalised over the fits.
+        'pvalue': The p-value of the fit.
+        'flat':   Equal weights.
+    The fits to each resampled bin are weighted by their own chi^2, so that the uncertainty of the weights is
+    propagated into the statistical uncertainty of the average.
+    The systematic uncertainties are the weighted spreads of the fit parameters over the fits, for the central fits
+    and for each resampled bin, so that their own statistical uncertainties follow from the resampler.
+    :param resampler: The resampler from which the statistical uncertainties are computed. Defaults to that of the
+                      table, and must be given for tables without one.
+    """
+    resampler = table.resampler if resampler is None else resampler
+    weights = normalise_weights(log_weights(table.chi_sq_per_dof, table.Ndof, weighting))
+    subchi_sq_per_dof = resampler.samples(table.chi_sq_per_dof, table.subchi_sq_per_dof.T)
+    subweights = normalise_weights(log_weights(subchi_sq_per_dof, table.Ndof, weighting))
+    return ModelAverage(table.parameter_names, weights, subweights, table.mean, table.submean, resampler)
+
+
+def log_weights(chi_sq_per_dof, Ndof, weighting):
+    """
+    Returns the unnormalised logarithms of the model weights of fits with the given chi^2/Ndof and Ndof. The fits run
+    along the last axis.
+    """
+    chi_sq = chi_sq_per_dof * Ndof
+    if weighting == 'aic':
+        return -chi_sq / 2 + Ndof
+    elif weighting == 'pvalue':
+        with np.errstate(divide='ignore'):
+            return np.log(p_value(Ndof, chi_sq))
+    elif weighting == 'flat':
+        return np.zeros(np.shape(chi_sq))
+    raise ValueError(f"Unknown model weighting '{weighting}'; expected 'aic', 'pvalue', or 'flat'.")
+
+
+def normalise_weights(log_weights):
+    log_weights = log_weights - np.max(log_weights, axis=-1, keepdims=True)
+    weights = np.exp(log_weights)
+    return weights / np.sum(weights, axis=-1, keepdims=True)
@@ -0,0 +1,114 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/Core/Fitting/Parallel.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import uuid
+
+import numpy as np
+
+from sulat.Core.Fitting.Fit import perform_fit
+from sulat.Core.Fitting.FitScanTable import FitScanRow
+
+
+# Scan contexts that have already been loaded by this (worker) process, keyed by the path they were published to.
+_loaded_contexts = {}
+
+
+class FitPool:
+    """
+    A persistent pool of worker processes for running the fits of a fit scan in parallel.
+    The data required by a scan is published once per scan, and each worker loads it at most once per scan rather than
+    receiving a copy of the correlators with every task.
+    """
+    def __init__(self, processes):
+        self.processes = processes
+        self._pool = multiprocessing.Pool(processes)
+        self._directory = tempfile.mkdtemp(prefix='sulat_fitpool_')
+
+    def imap(self, context, fit_range_combos, chunksize=1):
+        """
+        Lazily yields (fit_range_combo, result) pairs in the same order as 'fit_range_combos'. 'result' is a FitScanRow,
+        an error string if the fit raised a numpy.linalg.LinAlgError, or None if the fit was rejected by the screening
+        predicate of the scan.
+
+        :param context: A dictionary of the keyword arguments of 'perform_fit', excluding 'fit_ranges'.
+        :param fit_range_combos: An iterable of fit range combinations.
+        :param chunksize: The number of fit range combinations to send to a worker per task.
+        """
+        path = os.path.join(self._directory, f"{uuid.uuid4().hex}.pkl")
+        with open(path, 'wb') as f:
+            pickle.dump(context, f, protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            tasks = ((path, chunk) for chunk in chunk_iterable(fit_range_combos, chunksize))
+            for results in self._pool.imap(fit_chunk, tasks):
+                yield from results
+        finally:
+            os.remove(path)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+
+def chunk_iterable(iterable, chunksize):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if len(chunk):
+        yield chunk
+
+
+def load_context(path):
+    if path not in _loaded_contexts:
+        # Only one scan runs through a pool at a time, so any previously-loaded context is stale
+        _loaded_contexts.clear()
+        with open(path, 'rb') as f:
+            _loaded_contexts[path] = pickle.load(f)
+    return _loaded_contexts[path]
+
+
+def fit_chunk(task):
+    path, fit_range_combos = task
+    context = load_context(path)
+    results = []
+    for fit_range_combo in fit_range_combos:
+        try:
+            result = perform_fit(fit_ranges=fit_range_combo, **context)
+            # Only the summary of each fit is sent back to the parent process
+            if result is not None:
+                result = FitScanRow.from_fit_result(fit_range_combo, result)
+        except np.linalg.LinAlgError as lae:
+            result = f"Fit range {fit_range_combo} failed: {lae}"
+        results.append((fit_range_combo, result))
+    return results
+
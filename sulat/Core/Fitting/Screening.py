@@ -0,0 +1,80 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/Core/Fitting/Screening.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+class MinPValue:
+    """
+    Screening predicate for fit scans that accepts central fits with a p-value of at least 'pvalue'.
+    """
+    def __init__(self, pvalue):
+        self.pvalue = pvalue
+
+    def __call__(self, central_fit):
+        return central_fit.pvalue >= self.pvalue
+
+    def __repr__(self):
+        return f"MinPValue({self.pvalue!r})"
+
+
+class MaxChiSqPerDof:
+    """
+    Screening predicate for fit scans that accepts central fits with a chi^2/Ndof of at most 'chi_sq_per_dof'.
+    """
+    def __init__(self, chi_sq_per_dof):
+        self.chi_sq_per_dof = chi_sq_per_dof
+
+    def __call__(self, central_fit):
+        return central_fit.chi_sq_per_dof <= self.chi_sq_per_dof
+
+    def __repr__(self):
+        return f"MaxChiSqPerDof({self.chi_sq_per_dof!r})"
+
+
+class MinNdof:
+    """
+    Screening predicate for fit scans that accepts fits with at least 'Ndof' degrees of freedom.
+    """
+    def __init__(self, Ndof):
+        self.Ndof = Ndof
+
+    def __call__(self, central_fit):
+        return central_fit.Ndof >= self.Ndof
+
+    def __repr__(self):
+        return f"MinNdof({self.Ndof!r})"
+
+
+class AllOf:
+    """
+    Screening predicate for fit scans that accepts central fits accepted by every one of 'predicates'.
+    """
+    def __init__(self, *predicates):
+        self.predicates = predicates
+
+    def __call__(self, central_fit):
+        return all(predicate(central_fit) for predicate in self.predicates)
+
+    def __repr__(self):
+        return f"AllOf({', '.join(repr(predicate) for predicate in self.predicates)})"
@@ -25,6 +25,9 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import numpy as np
 
+from .Resources import mutates_data, trim_to_bins
+from sulat.ExtensibleLibraries.Lib_Stats.GammaMethod import integrated_autocorrelation_time, recommended_binsize
+
 configurations = 0
 timeslices = 1
 
@@ -63,6 +66,7 @@ def roll_configurations(data, shift):
     return roll(data, shift, configurations)
 
 
+@mutates_data
 def fold(data, cutoff=1, backshift=0):
     """
     Returns the average of a slice of a numpy array and the time-reversed slice. By default, the slice cuts off the first timeslice of the array.
@@ -103,18 +107,33 @@ def bin(data, binsize, axis):
     # TODO: implement C%binsize!=0 case
     assert length % binsize == 0, f'Binsize {binsize} not an integer divisor of shape along axis {axis}: {length}.'
     num_bins = length // binsize
-    return np.mean(np.stack(np.split(data, num_bins, axis=axis), axis=axis), axis=staxis)
+    return np.mean(data.reshape(*data.shape[:axis], num_bins, binsize, *data.shape[staxis:]), axis=staxis)
 
 
 def bin_configurations(data, binsize):
     """
-    Averages 'binsize' consecutive configurations.
+    Averages 'binsize' consecutive configurations. Trailing configurations that do not fill a whole bin are dropped
+    with a warning.
 
     :param data: A numpy array.
     :param binsize: The number of configurations to include in each bin.
     :return:
     """
-    return bin(data, binsize, configurations)
+    return bin(trim_to_bins(data, binsize, configurations), binsize, configurations)
+
+
+def auto_bin_configurations(data, factor=4, S=1.5):
+    """
+    Averages consecutive configurations in bins of the size recommended by the integrated autocorrelation times of
+    the timeslices. Trailing configurations that do not fill a whole bin are dropped with a warning.
+
+    :param data: A numpy array, with the configurations in Monte Carlo order.
+    :param factor: The minimum size of the bins in units of the largest integrated autocorrelation time.
+    :param S: The parameter of the automatic windowing of the autocorrelation functions.
+    :return:
+    """
+    tau_int = integrated_autocorrelation_time(data, S)
+    return bin_configurations(data, recommended_binsize(tau_int, data.shape[configurations], factor))
 
 
 def bin_timeslices(data, binsize):
@@ -0,0 +1,58 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/ExtensibleLibraries/Lib_Combos/Resources.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import warnings
+
+
+def mutates_data(func):
+    """
+    Decorator that declares a transform to modify its input array in place, so that ingestion without copying copies
+    the data before applying it rather than modifying the caller's array.
+    Transforms without this declaration must leave their input unchanged, and may return views of it.
+    """
+    func.mutates_data = True
+    return func
+
+
+def is_mutating(transform):
+    """
+    Returns whether 'transform' modifies its input in place.
+    """
+    return getattr(transform, 'mutates_data', False)
+
+
+def trim_to_bins(data, binsize, axis):
+    """
+    Returns 'data' without the trailing values along 'axis' that do not fill a whole bin of 'binsize' values, warning
+    if any are dropped.
+    """
+    length = data.shape[axis]
+    leftover = length % binsize
+    if leftover:
+        warnings.warn(f"Dropping the last {leftover} of {length} values along axis {axis}, "
+                      f"which do not fill a bin of size {binsize}.")
+        data = data[(slice(None),)*axis + (slice(length - leftover),)]
+    return data
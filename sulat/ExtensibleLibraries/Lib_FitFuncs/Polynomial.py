@@ -26,15 +26,34 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import numpy as np
 
+from .Resources import declare_linear, register_jacobian
 
+
+@declare_linear
 def const(t, constant):
-    return constant
+    return constant + np.zeros(np.shape(t))
+
 
+@register_jacobian(const)
+def const_jacobian(t, constant):
+    return [np.ones(np.shape(t))]
 
+
+@declare_linear
 def linear(t, constant, gradient):
     return t*gradient + constant
 
 
+@register_jacobian(linear)
+def linear_jacobian(t, constant, gradient):
+    return [np.ones(np.shape(t)), t]
+
+
+@declare_linear
 def poly(t, *args):
-    args = np.array(args)
-    return np.sum(args*(t**np.arange(len(args))))
+    return sum(arg * t**i for i, arg in enumerate(args)) + np.zeros(np.shape(t))
+
+
+@register_jacobian(poly)
+def poly_jacobian(t, *args):
+    return [t**i + np.zeros(np.shape(t)) for i in range(len(args))]
@@ -0,0 +1,52 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/ExtensibleLibraries/Lib_FitFuncs/Resources.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+def register_jacobian(func):
+    """
+    Decorator that registers the decorated function as the analytic Jacobian of the fit function 'func'.
+    The Jacobian takes the same arguments as 'func' and returns a list holding the derivative of 'func' with respect to
+    each parameter after the independent variable, in order. Derivatives with respect to parameters that are held
+    constant in a fit are never used.
+    Fit functions without a registered Jacobian are differentiated numerically by the minimisers.
+    """
+    def decorator(jacobian):
+        func.jacobian = jacobian
+        jacobian.is_jacobian = True
+        return jacobian
+    return decorator
+
+
+def declare_linear(func):
+    """
+    Decorator that declares a fit function to be linear in all of its parameters after the independent variable, so
+    that the linear minimisers can skip checking this numerically.
+    """
+    func.is_linear = True
+    return func
+
+
+def is_fit_function(obj):
+    return callable(obj) and not getattr(obj, 'is_jacobian', False)
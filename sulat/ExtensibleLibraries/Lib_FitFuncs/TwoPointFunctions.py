@@ -26,15 +26,28 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import numpy as np
 
+from .Resources import register_jacobian
+
 
 def exp_2pt(t, Zsq, energy):
     return (Zsq/(2*energy)) * np.exp(-energy * t)
 
 
+@register_jacobian(exp_2pt)
+def exp_2pt_jacobian(t, Zsq, energy):
+    decay = np.exp(-energy * t) / (2*energy)
+    return [decay, -Zsq * decay * (1/energy + t)]
+
+
 def exp_2pt_excited(t, Aex0, Eex0, Aex1, Eex1):
     return exp_2pt(t, Aex0, Eex0) + exp_2pt(t, Aex1, Eex1)
 
 
+@register_jacobian(exp_2pt_excited)
+def exp_2pt_excited_jacobian(t, Aex0, Eex0, Aex1, Eex1):
+    return [*exp_2pt_jacobian(t, Aex0, Eex0), *exp_2pt_jacobian(t, Aex1, Eex1)]
+
+
 def exp_2pt_series(t, *args):
     prefactors = args[::2]
     exponents = args[1::2]
@@ -42,17 +55,51 @@ def exp_2pt_series(t, *args):
     return sum([exp_2pt(t, prefactor, exponent) for prefactor, exponent in zip(prefactors, exponents)])
 
 
+@register_jacobian(exp_2pt_series)
+def exp_2pt_series_jacobian(t, *args):
+    prefactors = args[::2]
+    exponents = args[1::2]
+
+    return [deriv for prefactor, exponent in zip(prefactors, exponents)
+            for deriv in exp_2pt_jacobian(t, prefactor, exponent)]
+
+
 def cosh_2pt(t, T, Zsq, energy):
     return (Zsq/(2*energy)) * (np.exp(-energy * t) + np.exp(-energy * (T - t)))
 
 
+@register_jacobian(cosh_2pt)
+def cosh_2pt_jacobian(t, T, Zsq, energy):
+    forward = np.exp(-energy * t)
+    backward = np.exp(-energy * (T - t))
+    return [-(Zsq/2) * backward,
+            (forward + backward) / (2*energy),
+            -(Zsq/(2*energy)) * ((forward + backward)/energy + t*forward + (T - t)*backward)]
+
+
 def cosh_2pt_excited(t, T, Aex0, Eex0, Aex1, Eex1) -> float:
 
     return cosh_2pt(t, T, Aex0, Eex0) + cosh_2pt(t, T, Aex1, Eex1)
 
 
+@register_jacobian(cosh_2pt_excited)
+def cosh_2pt_excited_jacobian(t, T, Aex0, Eex0, Aex1, Eex1):
+    dT0, dA0, dE0 = cosh_2pt_jacobian(t, T, Aex0, Eex0)
+    dT1, dA1, dE1 = cosh_2pt_jacobian(t, T, Aex1, Eex1)
+    return [dT0 + dT1, dA0, dE0, dA1, dE1]
+
+
 def corr_cosh_series(t, T, *args):
     prefactors = args[::2]
     exponents = args[1::2]
 
     return sum([cosh_2pt(t, T, prefactor, exponent) for prefactor, exponent in zip(prefactors, exponents)])
+
+
+@register_jacobian(corr_cosh_series)
+def corr_cosh_series_jacobian(t, T, *args):
+    prefactors = args[::2]
+    exponents = args[1::2]
+
+    terms = [cosh_2pt_jacobian(t, T, prefactor, exponent) for prefactor, exponent in zip(prefactors, exponents)]
+    return [sum([term[0] for term in terms]), *[deriv for term in terms for deriv in term[1:]]]
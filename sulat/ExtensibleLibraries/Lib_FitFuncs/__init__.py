@@ -25,5 +25,6 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
 from sulat.ExtensibleLibraries.Resources import ExtensibleLibrary
+from .Resources import is_fit_function
 
-ExLib_FitFuncs = ExtensibleLibrary(__file__, __package__, (callable,))
+ExLib_FitFuncs = ExtensibleLibrary(__file__, __package__, (is_fit_function,))
@@ -0,0 +1,284 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/ExtensibleLibraries/Lib_Minimisers/LevenburgMarquardtBatched/Resources.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import numpy as np
+
+from sulat.ExtensibleLibraries.Lib_Minimisers.LevenburgMarquardtScipy import LevenburgMarquardtScipy, \
+    LevenburgMarquardtScipyJacobian
+from sulat.ExtensibleLibraries.Lib_Minimisers.Resources import p_value
+
+
+def parameter_maps_are_shared(parameter_maps):
+    """
+    Checks whether the parameter maps of every bin hold the same values, i.e. whether they contain no vector constants.
+    """
+    first = parameter_maps[0]
+    for pmap in parameter_maps[1:]:
+        for func_map, first_func_map in zip(pmap, first):
+            for value, first_value in zip(func_map, first_func_map):
+                if value is first_value:
+                    continue
+                if value is None or first_value is None or not np.array_equal(value, first_value):
+                    return False
+    return True
+
+
+def mk_binwise_model(funcs, xs, parameter_maps, fit_parameter_slots, attribute=None):
+    """
+    Returns a function mapping a (bins, parameters) array onto the (bins, data) array of fitted values, evaluating the
+    fit functions one bin at a time. If 'attribute' is given, 'getattr(func, attribute)' is evaluated instead of each
+    fit function, e.g. 'jacobian' to produce the (bins, data, parameters) Jacobian of the fitted values.
+    """
+    evaluators = funcs if attribute is None else [getattr(func, attribute) for func in funcs]
+
+    def model(parameters, bins):
+        return np.array([np.concatenate([func(x, params, list(p_map), p_slot)
+                                         for func, x, p_map, p_slot in zip(evaluators, xs, parameter_maps[b], fit_parameter_slots)])
+                         for params, b in zip(parameters, bins)])
+    return model
+
+
+def mk_broadcast_model(funcs, xs, parameter_map, fit_parameter_slots, attribute=None):
+    """
+    Returns a function mapping a (bins, parameters) array onto the (bins, data) array of fitted values, evaluating each
+    fit function once for all bins by passing the fit parameters as (bins, 1) columns. 'attribute' is as for
+    mk_binwise_model.
+    """
+    evaluators = funcs if attribute is None else [getattr(func, attribute) for func in funcs]
+
+    def model(parameters, bins):
+        columns = parameters.T[:, :, None]
+        shapes = [(len(parameters), len(x)) if attribute is None else (len(parameters), len(x), parameters.shape[1])
+                  for x in xs]
+        return np.concatenate([np.broadcast_to(func(x, columns, list(p_map), p_slot), shape)
+                               for func, x, p_map, p_slot, shape in zip(evaluators, xs, parameter_map, fit_parameter_slots, shapes)], axis=1)
+    return model
+
+
+def mk_batched_model(funcs, xs, parameter_maps, fit_parameter_slots, test_parameters, analytic_jacobian=False):
+    """
+    Chooses the cheapest way of evaluating the fit functions for many bins at once. Broadcasting is only used if the
+    parameter maps are shared between bins and the fit functions reproduce their bin-by-bin values when broadcast.
+    Returns the model and, if 'analytic_jacobian' is True, the Jacobian of the model from the analytic Jacobians of the
+    fit functions. Otherwise, the Jacobian is None.
+    """
+    analytic = analytic_jacobian
+    binwise_model = mk_binwise_model(funcs, xs, parameter_maps, fit_parameter_slots)
+    binwise_jacobian = mk_binwise_model(funcs, xs, parameter_maps, fit_parameter_slots, 'jacobian') if analytic else None
+    if not parameter_maps_are_shared(parameter_maps):
+        return binwise_model, binwise_jacobian
+
+    broadcast_model = mk_broadcast_model(funcs, xs, parameter_maps[0], fit_parameter_slots)
+    broadcast_jacobian = mk_broadcast_model(funcs, xs, parameter_maps[0], fit_parameter_slots, 'jacobian') if analytic else None
+    test_parameters = np.atleast_2d(test_parameters)[:1]
+    candidates = [(broadcast_model, binwise_model)]
+    if analytic:
+        candidates.append((broadcast_jacobian, binwise_jacobian))
+    try:
+        with np.errstate(all='ignore'):
+            for broadcast, binwise in candidates:
+                broadcast_values = broadcast(test_parameters, [0])
+                binwise_values = binwise(test_parameters, [0])
+                if broadcast_values.shape != binwise_values.shape or \
+                   not np.allclose(broadcast_values, binwise_values, rtol=1e-12, atol=0, equal_nan=True):
+                    return binwise_model, binwise_jacobian
+    except (ValueError, TypeError, IndexError):
+        return binwise_model, binwise_jacobian
+    return broadcast_model, broadcast_jacobian
+
+
+def mk_batched_residuals(model, vds, sqCinvs):
+    """
+    Returns a function computing the weighted residuals (vd - fit).sqCinv for the requested bins.
+    """
+    frozen = sqCinvs.ndim == 2
+
+    def residuals(parameters, bins):
+        diff = vds[bins] - model(parameters, bins)
+        if frozen:
+            return np.dot(diff, sqCinvs)
+        return np.einsum('bi,bij->bj', diff, sqCinvs[bins])
+    return residuals
+
+
+def mk_batched_jacobian(model, sqCinvs, model_jacobian=None):
+    """
+    Returns a function computing the Jacobian of the weighted residuals with respect to the fit parameters. This uses
+    'model_jacobian' if it is provided, and otherwise forward differences with the same step size as
+    scipy.optimize.leastsq.
+    """
+    frozen = sqCinvs.ndim == 2
+    epsilon = np.sqrt(np.finfo(float).eps)
+
+    def jacobian(parameters, bins):
+        if model_jacobian is not None:
+            derivatives = model_jacobian(parameters, bins)
+        else:
+            derivatives = finite_differences(parameters, bins)
+        if frozen:
+            return -np.einsum('bik,ij->bjk', derivatives, sqCinvs)
+        return -np.einsum('bik,bij->bjk', derivatives, sqCinvs[bins])
+
+    def finite_differences(parameters, bins):
+        base = model(parameters, bins)
+        steps = epsilon * np.abs(parameters)
+        steps[steps == 0] = epsilon
+        derivatives = np.empty((*base.shape, parameters.shape[1]))
+        for k in range(parameters.shape[1]):
+            shifted = parameters.copy()
+            shifted[:, k] += steps[:, k]
+            derivatives[:, :, k] = (model(shifted, bins) - base) / steps[:, k, None]
+        return derivatives
+
+    return jacobian
+
+
+def batched_levenberg_marquardt(residuals, jacobian, initial_parameters, maxiter=200, ftol=1e-10, xtol=1e-10):
+    """
+    Minimises the sum of squared residuals of every bin simultaneously with a stacked Levenberg-Marquardt iteration.
+    Each bin keeps its own damping parameter, and bins drop out of the iteration once they have converged.
+
+    :param residuals: Function of (parameters, bins) returning the (bins, data) weighted residuals.
+    :param jacobian: Function of (parameters, bins) returning the (bins, data, parameters) Jacobian of the residuals.
+    :param initial_parameters: A (bins, parameters) array of starting values.
+    :return: The (bins, parameters) best-fit parameters, the (bins, data) residuals at those parameters, and a boolean
+             mask of the bins that converged.
+    """
+    parameters = np.array(initial_parameters, dtype=float)
+    nbins, nparams = parameters.shape
+    all_bins = np.arange(nbins)
+    res = residuals(parameters, all_bins)
+    chisq = np.sum(res**2, axis=1)
+    jac = jacobian(parameters, all_bins)
+    damping = np.full(nbins, 1e-3)
+    active = np.ones(nbins, dtype=bool)
+    converged = np.zeros(nbins, dtype=bool)
+
+    for _ in range(maxiter):
+        bins = np.flatnonzero(active)
+        if not len(bins):
+            break
+        J = jac[bins]
+        JTJ = np.matmul(J.swapaxes(1, 2), J)
+        gradient = np.einsum('bjk,bj->bk', J, res[bins])
+        diagonal = np.diagonal(JTJ, axis1=1, axis2=2).copy()
+        diagonal[diagonal == 0] = 1.
+        damped = JTJ + damping[bins, None, None] * (diagonal[:, :, None] * np.eye(nparams))
+        try:
+            step = np.linalg.solve(damped, -gradient[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            step = np.array([np.linalg.lstsq(d, -g, rcond=None)[0] for d, g in zip(damped, gradient)])
+
+        trial = parameters[bins] + step
+        with np.errstate(all='ignore'):
+            trial_res = residuals(trial, bins)
+        trial_chisq = np.sum(trial_res**2, axis=1)
+        accepted = np.isfinite(trial_chisq) & (trial_chisq <= chisq[bins])
+
+        accepted_bins = bins[accepted]
+        reduction = chisq[accepted_bins] - trial_chisq[accepted]
+        relative_step = np.max(np.abs(step[accepted]) / (np.abs(trial[accepted]) + xtol), axis=1)
+        # A small reduction in chi^2 alone can occur far from the minimum along a shallow direction, so also require
+        # the step to be small
+        small_reduction = (reduction <= ftol * chisq[accepted_bins]) & (relative_step <= np.sqrt(ftol))
+        small_step = relative_step <= xtol
+
+        parameters[accepted_bins] = trial[accepted]
+        res[accepted_bins] = trial_res[accepted]
+        chisq[accepted_bins] = trial_chisq[accepted]
+        if len(accepted_bins):
+            jac[accepted_bins] = jacobian(parameters[accepted_bins], accepted_bins)
+
+        damping[accepted_bins] /= 10
+        damping[bins[~accepted]] *= 10
+
+        done = accepted_bins[small_reduction | small_step]
+        converged[done] = True
+        # Bins whose damping has grown this large cannot make further progress: they sit at a minimum to within
+        # machine precision
+        stalled = bins[~accepted][damping[bins[~accepted]] > 1e16]
+        converged[stalled] = True
+        active[done] = False
+        active[stalled] = False
+
+    return parameters, res, converged
+
+
+def mkchisqvals(res, nparams):
+    """
+    Vectorised equivalent of LevenburgMarquardtScipy.Resources.mkchisqval: returns the p-values, chi^2/Ndof and Ndof
+    of each row of residuals.
+    """
+    Ndof = res.shape[1] - nparams
+    chisq = np.sum(res**2, axis=1)
+    return p_value(Ndof, chisq), chisq / Ndof, Ndof
+
+
+def stack_weights(sqCinvs):
+    """
+    Returns a single weights matrix if every bin shares the same one, as for frozen fits, and otherwise a
+    (bins, data, data) array of the per-bin weights matrices.
+    """
+    if isinstance(sqCinvs, list):
+        return sqCinvs[0] if all(w is sqCinvs[0] for w in sqCinvs) else np.array(sqCinvs)
+    return np.asarray(sqCinvs)
+
+
+def fit_bins(vds, args, sqCinvs, funcs, xs, parameter_maps, fit_parameter_slots, maxiter=200, analytic_jacobian=False):
+    """
+    Fits a function to every row of 'vds' at once. Bins that have not converged after 'maxiter' iterations are refitted
+    one at a time by LevenburgMarquardtScipy, as they would be without batching.
+    The Jacobian of the residuals is computed by forward differences, or, if 'analytic_jacobian' is True, from the
+    analytic Jacobians of the fit functions, in which case the bins are refitted by LevenburgMarquardtScipyJacobian.
+    :param vds: A (bins, data) array.
+    :param args: The initial conditions, shared by all bins.
+    :param sqCinvs: A single weights matrix shared by all bins, or a list of one weights matrix per bin.
+    :param funcs:
+    :param xs:
+    :param parameter_maps: A list of one parameter map per bin.
+    :param fit_parameter_slots:
+    :return: The (bins, parameters) best-fit parameters, a list of (p-value, chi^2/Ndof, Ndof) per bin, and the
+             (bins, data) residuals.
+    """
+    vds = np.asarray(vds)
+    nbins = len(vds)
+    sqCinvs = stack_weights(sqCinvs)
+    initial_parameters = np.tile(np.asarray(args, dtype=float), (nbins, 1))
+
+    model, model_jacobian = mk_batched_model(funcs, xs, parameter_maps, fit_parameter_slots, initial_parameters,
+                                             analytic_jacobian)
+    residuals = mk_batched_residuals(model, vds, sqCinvs)
+    jacobian = mk_batched_jacobian(model, sqCinvs, model_jacobian)
+    parameters, fvecs, converged = batched_levenberg_marquardt(residuals, jacobian, initial_parameters, maxiter)
+    single_fit = LevenburgMarquardtScipyJacobian if analytic_jacobian else LevenburgMarquardtScipy
+    for b in np.flatnonzero(~converged):
+        sqCinv = sqCinvs if sqCinvs.ndim == 2 else sqCinvs[b]
+        parameters[b], _, fvecs[b] = single_fit(vds[b], args, sqCinv, funcs, xs, parameter_maps[b],
+                                                fit_parameter_slots)
+
+    pvalues, chisqdofs, Ndof = mkchisqvals(fvecs, parameters.shape[1])
+    fit_statistics = [(pv, chisqdof, Ndof) for pv, chisqdof in zip(pvalues, chisqdofs)]
+    return parameters, fit_statistics, fvecs
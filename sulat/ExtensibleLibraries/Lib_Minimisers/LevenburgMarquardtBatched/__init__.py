@@ -0,0 +1,70 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/ExtensibleLibraries/Lib_Minimisers/LevenburgMarquardtBatched/__init__.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from functools import partial
+
+from .Resources import fit_bins
+from ..LevenburgMarquardtScipy import LevenburgMarquardtScipy, LevenburgMarquardtScipyJacobian
+
+
+def LevenburgMarquardtBatched(vd, args, sqCinv, funcs, xs, parameter_maps, fit_parameter_slots):
+    """
+    Fits a function to some input data using the Levenburg-Marquardt algorithm.
+    A single fit, such as the central fit, is delegated to LevenburgMarquardtScipy. When used as the 'fit_method' of a
+    fit, the fits to all resampled bins are then solved simultaneously by a stacked NumPy Levenburg-Marquardt iteration
+    starting from the central fit, rather than by one scipy.optimize.leastsq call per bin. As for
+    LevenburgMarquardtScipy, the Jacobians of the residuals are computed by finite differences.
+    :param vd:
+    :param args:
+    :param sqCinv:
+    :param funcs:
+    :param xs:
+    :param parameter_maps:
+    :param fit_parameter_slots:
+    :return:
+    """
+    return LevenburgMarquardtScipy(vd, args, sqCinv, funcs, xs, parameter_maps, fit_parameter_slots)
+
+
+LevenburgMarquardtBatched.fit_bins = fit_bins
+
+
+def LevenburgMarquardtBatchedJacobian(vd, args, sqCinv, funcs, xs, parameter_maps, fit_parameter_slots):
+    """
+    As LevenburgMarquardtBatched, but with the analytic Jacobians of the fit functions in place of finite differences,
+    as for LevenburgMarquardtScipyJacobian. Every fit function must have a Jacobian.
+    :param vd:
+    :param args:
+    :param sqCinv:
+    :param funcs:
+    :param xs:
+    :param parameter_maps:
+    :param fit_parameter_slots:
+    :return:
+    """
+    return LevenburgMarquardtScipyJacobian(vd, args, sqCinv, funcs, xs, parameter_maps, fit_parameter_slots)
+
+
+LevenburgMarquardtBatchedJacobian.fit_bins = partial(fit_bins, analytic_jacobian=True)
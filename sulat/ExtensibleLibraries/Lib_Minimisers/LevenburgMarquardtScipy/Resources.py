@@ -25,10 +25,30 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
 import numpy as np
+import scipy.optimize as opt
 
 from sulat.ExtensibleLibraries.Lib_Minimisers.Resources import p_value
 
 
+def leastsq_fit(vd, args, sqCinv, funcs, xs, parameter_maps, fit_parameter_slots, analytic_jacobian):
+    """
+    Fits the functions to the data with scipy.optimize.leastsq, computing the Jacobian of the residuals from the
+    analytic Jacobians of the fit functions if 'analytic_jacobian' is True, and by finite differences otherwise.
+    Returns the fit parameters, the fit statistics and the weighted residuals.
+    """
+    Dfun = mk_sqresiduals_jacobian if analytic_jacobian else None
+    # function wrapper in rescos.
+    res = opt.leastsq(mk_sqresiduals, args, args=(vd, sqCinv, funcs, xs, parameter_maps, fit_parameter_slots), Dfun=Dfun, maxfev=2000, ftol=1e-10, xtol=1e-10, full_output=True)
+    # get chisquared value
+    fit_statistics = mkchisqval(res)
+    # extract data from the fitting
+    parameters = np.zeros(len(args))
+    for ii in range(0, len(args)):
+        parameters[ii] = res[0][ii]
+
+    return parameters, fit_statistics, res[2]['fvec']
+
+
 def mk_sqresiduals(args, vec_data, sqCinv, funcs, xs, parameter_maps, fit_parameter_slots):
     """
     Computes the square residuals between a fitted function and some data.
@@ -39,6 +59,16 @@ def mk_sqresiduals(args, vec_data, sqCinv, funcs, xs, parameter_maps, fit_parame
     return err
 
 
+def mk_sqresiduals_jacobian(args, vec_data, sqCinv, funcs, xs, parameter_maps, fit_parameter_slots):
+    """
+    Computes the Jacobian of mk_sqresiduals with respect to the fit parameters from the analytic Jacobians of the fit
+    functions.
+    """
+    fit_jacobian = np.concatenate([func.jacobian(x, args, p_map, p_slot) for func, x, p_map, p_slot in zip(funcs, xs, parameter_maps, fit_parameter_slots)])
+
+    return -np.dot(sqCinv.T, fit_jacobian)
+
+
 def mkchisqval(res):
     """
      takes result of scipy.opt.leastsq as input and returns
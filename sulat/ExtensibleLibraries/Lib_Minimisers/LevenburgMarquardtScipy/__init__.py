@@ -23,10 +23,7 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import numpy as np
-import scipy.optimize as opt
-
-from .Resources import mk_sqresiduals, mkchisqval
+from .Resources import leastsq_fit
 
 
 def LevenburgMarquardtScipy(vd, args, sqCinv, funcs, xs, parameter_maps, fit_parameter_slots):
@@ -41,13 +38,15 @@ def LevenburgMarquardtScipy(vd, args, sqCinv, funcs, xs, parameter_maps, fit_par
     :param fit_parameter_slots:
     :return:
     """
-    # function wrapper in rescos.
-    res = opt.leastsq(mk_sqresiduals, args, args=(vd, sqCinv, funcs, xs, parameter_maps, fit_parameter_slots), maxfev=2000, ftol=1e-10, xtol=1e-10, full_output=True)
-    # get chisquared value
-    fit_statistics = mkchisqval(res)
-    # extract data from the fitting
-    parameters = np.zeros(len(args))
-    for ii in range(0, len(args)):
-        parameters[ii] = res[0][ii]
-
-    return parameters, fit_statistics, res[2]['fvec']
+    return leastsq_fit(vd, args, sqCinv, funcs, xs, parameter_maps, fit_parameter_slots, analytic_jacobian=False)
+
+
+def LevenburgMarquardtScipyJacobian(vd, args, sqCinv, funcs, xs, parameter_maps, fit_parameter_slots):
+    """
+    As LevenburgMarquardtScipy, but passes the analytic Jacobians of the fit functions to leastsq in place of finite
+    differences, saving model evaluations. Every fit function must have a Jacobian. The steps taken differ from those
+    with finite differences, so from poor initial values the fit may converge to a different local minimum.
+    """
+    if not all(hasattr(func, 'jacobian') for func in funcs):
+        raise ValueError("LevenburgMarquardtScipyJacobian requires every fit function to have an analytic Jacobian.")
+    return leastsq_fit(vd, args, sqCinv, funcs, xs, parameter_maps, fit_parameter_slots, analytic_jacobian=True)
@@ -0,0 +1,115 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/ExtensibleLibraries/Lib_Minimisers/LinearLeastSquares/Resources.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import numpy as np
+
+from ..LevenburgMarquardtBatched.Resources import mk_batched_model, mkchisqvals, stack_weights
+
+
+def mk_design_matrices(model, model_jacobian, nbins, nparams):
+    """
+    Returns the (bins, data) offsets and (bins, data, parameters) design matrices of a model that is linear in its
+    parameters, such that model(p) = offset + design.p in every bin. The design matrices are taken from the analytic
+    Jacobian of the model if there is one, and otherwise from the model evaluated at unit parameter vectors.
+    Floating-point errors are ignored here, since a non-linear model may not be defined at these points; such a model is
+    rejected by check_linearity.
+    """
+    bins = np.arange(nbins)
+    zeros = np.zeros((nbins, nparams))
+    with np.errstate(all='ignore'):
+        offsets = model(zeros, bins)
+        if model_jacobian is not None:
+            design = model_jacobian(zeros, bins)
+        else:
+            design = np.stack([model(np.tile(unit, (nbins, 1)), bins) - offsets for unit in np.eye(nparams)],
+                              axis=-1)
+    return offsets, design
+
+
+def check_linearity(model, offsets, design, args):
+    """
+    Raises a ValueError if the model does not reproduce offset + design.p at two test points derived from the
+    initial conditions.
+    """
+    bins = np.arange(len(offsets))
+    for test_parameters in (args, 2*args + 1):
+        test_parameters = np.tile(test_parameters, (len(bins), 1))
+        with np.errstate(all='ignore'):
+            values = model(test_parameters, bins)
+        predicted = offsets + np.einsum('bik,bk->bi', design, test_parameters)
+        if not np.allclose(values, predicted, rtol=1e-8, atol=1e-12*np.max(np.abs(predicted))):
+            raise ValueError("The fit functions are not linear in the fit parameters, "
+                             "so they cannot be fitted with a linear least-squares minimiser.")
+
+
+def solve_linear_fits(vds, offsets, design, sqCinvs):
+    """
+    Minimises |(vd - offset - design.p).sqCinv|^2 for every bin in closed form through the pseudo-inverse of the
+    weighted design matrix. If the weights and design matrices are shared by all bins, the pseudo-inverse is computed
+    once and applied to every bin in a single matrix product.
+    :return: The (bins, parameters) best-fit parameters and the (bins, data) weighted residuals.
+    """
+    weighted_data = vds - offsets
+    if sqCinvs.ndim == 2:
+        weighted_data = np.dot(weighted_data, sqCinvs)
+        if np.all(design == design[0]):
+            weighted_design = np.dot(sqCinvs.T, design[0])
+            parameters = np.dot(weighted_data, np.linalg.pinv(weighted_design).T)
+            return parameters, weighted_data - np.dot(parameters, weighted_design.T)
+        weighted_design = np.einsum('ij,bik->bjk', sqCinvs, design)
+    else:
+        weighted_data = np.einsum('bi,bij->bj', weighted_data, sqCinvs)
+        weighted_design = np.einsum('bij,bik->bjk', sqCinvs, design)
+    parameters = np.einsum('bkj,bj->bk', np.linalg.pinv(weighted_design), weighted_data)
+    return parameters, weighted_data - np.einsum('bjk,bk->bj', weighted_design, parameters)
+
+
+def fit_bins(vds, args, sqCinvs, funcs, xs, parameter_maps, fit_parameter_slots):
+    """
+    Fits a linear model to every row of 'vds' at once.
+    :param vds: A (bins, data) array.
+    :param args: The initial conditions, only used to check that the fit functions are linear.
+    :param sqCinvs: A single weights matrix shared by all bins, or a list of one weights matrix per bin.
+    :param funcs:
+    :param xs:
+    :param parameter_maps: A list of one parameter map per bin.
+    :param fit_parameter_slots:
+    :return: The (bins, parameters) best-fit parameters, a list of (p-value, chi^2/Ndof, Ndof) per bin, and the
+             (bins, data) residuals.
+    """
+    vds = np.asarray(vds)
+    args = np.asarray(args, dtype=float)
+    sqCinvs = stack_weights(sqCinvs)
+
+    model, model_jacobian = mk_batched_model(funcs, xs, parameter_maps, fit_parameter_slots, args)
+    offsets, design = mk_design_matrices(model, model_jacobian, len(vds), len(args))
+    if not all(getattr(func, 'is_linear', False) for func in funcs):
+        check_linearity(model, offsets, design, args)
+    parameters, fvecs = solve_linear_fits(vds, offsets, design, sqCinvs)
+
+    pvalues, chisqdofs, Ndof = mkchisqvals(fvecs, parameters.shape[1])
+    fit_statistics = [(pv, chisqdof, Ndof) for pv, chisqdof in zip(pvalues, chisqdofs)]
+    return parameters, fit_statistics, fvecs
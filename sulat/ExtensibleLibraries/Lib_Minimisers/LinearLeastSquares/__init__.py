@@ -0,0 +1,51 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/ExtensibleLibraries/Lib_Minimisers/LinearLeastSquares/__init__.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+from .Resources import fit_bins
+
+
+def LinearLeastSquares(vd, args, sqCinv, funcs, xs, parameter_maps, fit_parameter_slots):
+    """
+    Fits a function that is linear in its fit parameters, such as 'const', 'linear' or 'poly', to some input data by
+    solving the weighted least-squares problem in closed form. Functions that are not declared linear with
+    'declare_linear' are checked numerically, and a ValueError is raised if they are not linear.
+    When used as the 'fit_method' of a fit, the fits to all resampled bins are solved together in one batched solve.
+    :param vd:
+    :param args:
+    :param sqCinv:
+    :param funcs:
+    :param xs:
+    :param parameter_maps:
+    :param fit_parameter_slots:
+    :return:
+    """
+    parameters, fit_statistics, fvecs = fit_bins(np.asarray(vd)[None, :], args, sqCinv, funcs, xs, [parameter_maps],
+                                                 fit_parameter_slots)
+    return parameters[0], fit_statistics[0], fvecs[0]
+
+
+LinearLeastSquares.fit_bins = fit_bins
@@ -0,0 +1,139 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/ExtensibleLibraries/Lib_Stats/BlockBootstrap.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import copy
+
+import numpy as np
+
+from .Bootstrap import Bootstrap, draw_counts, inner_sample_stream, outer_sample_stream
+from .Resources import sample_rng
+from sulat.Utilities.Evaluation import lazy_readonly
+
+
+class BlockBootstrap(Bootstrap):
+    def __init__(self, seed, nsamples, block_length, stationary=False, chunksize=256, inner_nsamples=None,
+                 counter_based=False, double_bootstrap=False):
+        """
+        A bootstrap that draws blocks of consecutive configurations, wrapping around the end of the ensemble, so that
+        the samples retain the autocorrelations of the Monte Carlo chain without binning the configurations.
+        :param block_length: The length of the blocks for the moving-block bootstrap, or their mean length for the
+                             stationary bootstrap.
+        :param stationary: If True, draw blocks of geometrically-distributed lengths (the stationary bootstrap of
+                           Politis and Romano) rather than of fixed length.
+        See Bootstrap for the remaining parameters.
+        """
+        super().__init__(seed, nsamples, chunksize, inner_nsamples, counter_based, double_bootstrap)
+        self.block_length = block_length
+        self.stationary = stationary
+        self.draws_rng = None
+
+    @lazy_readonly
+    def counts(self):
+        """
+        The (nsamples, configs) matrix of the number of times each configuration is drawn into each bootstrap sample.
+        The blocks are drawn for consecutive chunks of samples and only their counts are kept. The state of the random
+        number generator is saved first, so that the draws can be replayed for the double bootstrap.
+        """
+        if self.counter_based:
+            return self.sample_counts(0, self.nsamples)
+        counts = np.empty((self.nsamples, self.configs), dtype=np.int32)
+        self.draws_rng = copy.deepcopy(self.rng)
+        for start, draws in self.iter_draw_chunks(self.rng):
+            counts[start:start + len(draws)] = draw_counts(draws, self.configs)
+        return counts
+
+    def iter_draw_chunks(self, rng):
+        """
+        Yields the first sample and the (chunksize, configs) draws of each consecutive chunk of samples drawn by 'rng'.
+        """
+        for start in range(0, self.nsamples, self.chunksize):
+            yield start, block_indices(rng, min(self.chunksize, self.nsamples - start), self.configs, self.block_length,
+                                       self.stationary)
+
+    def sample_draws(self, sample):
+        if not self.counter_based:
+            raise ValueError("Individual bootstrap samples can only be regenerated by a counter-based Bootstrap.")
+        rng = sample_rng(self.entropy, outer_sample_stream, sample)
+        return block_indices(rng, 1, self.configs, self.block_length, self.stationary)[0]
+
+    def iter_sample_configurations(self, start, stop):
+        """
+        Yields the configurations of bootstrap samples 'start' to 'stop' in the order in which they were drawn, so that
+        the inner samples of the double bootstrap are drawn as blocks. Without a counter-based resampler, the draws are
+        replayed from the saved state of the random number generator, up to the last chunk containing the samples.
+        """
+        if self.counter_based:
+            yield from (self.sample_draws(sample) for sample in range(start, stop))
+            return
+        # The state of the random number generator is saved when the counts are drawn
+        self.counts
+        for chunk_start, draws in self.iter_draw_chunks(copy.deepcopy(self.draws_rng)):
+            if chunk_start >= stop:
+                return
+            yield from draws[max(start - chunk_start, 0):stop - chunk_start]
+
+    def sample_configurations(self, sample):
+        return next(self.iter_sample_configurations(sample, sample + 1))
+
+    def inner_draws(self, outer_sample, nsamples):
+        """
+        Draws the inner samples of the double bootstrap as blocks of consecutive positions in the configurations of
+        bootstrap sample 'outer_sample', in the order in which they were drawn.
+        """
+        rng = sample_rng(self.entropy, inner_sample_stream, outer_sample)
+        return block_indices(rng, nsamples, self.configs, self.block_length, self.stationary)
+
+    def configure(self, seed=None, nsamples=None, inner_nsamples=None, counter_based=None, double_bootstrap=None,
+                  block_length=None, stationary=None):
+        if block_length is not None:
+            self.block_length = block_length
+        if stationary is not None:
+            self.stationary = stationary
+        super().configure(seed, nsamples, inner_nsamples, counter_based, double_bootstrap)
+
+
+def block_indices(rng, nsamples, configs, block_length, stationary=False):
+    """
+    Returns an (nsamples, configs) array of the configurations drawn into each of 'nsamples' block bootstrap samples.
+    Each sample is a sequence of blocks of consecutive configurations, with uniformly-drawn starts, wrapping around the
+    end of the ensemble. The blocks are of length 'block_length', or, if 'stationary', each configuration starts a new
+    block with probability 1/block_length.
+    """
+    positions = np.arange(configs)
+    if not stationary:
+        num_blocks = -(-configs // block_length)
+        starts = rng.integers(0, configs, size=(nsamples, num_blocks))
+        indices = starts[:, :, None] + np.arange(block_length)[None, None, :]
+        return indices.reshape(nsamples, -1)[:, :configs] % configs
+
+    new_block = rng.random(size=(nsamples, configs)) < 1/block_length
+    new_block[:, 0] = True
+    starts = rng.integers(0, configs, size=(nsamples, configs))
+    # The position in the sample at which the block containing each position began
+    block_start = np.maximum.accumulate(np.where(new_block, positions[None, :], 0), axis=1)
+    first_index = np.take_along_axis(starts, block_start, axis=1)
+    return (first_index + positions[None, :] - block_start) % configs
+
@@ -0,0 +1,59 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/ExtensibleLibraries/Lib_Stats/BlockedJackknife.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import numpy as np
+
+from .Jackknife import Jackknife
+
+configurations = 0
+
+
+class BlockedJackknife(Jackknife):
+    def __init__(self, nblocks):
+        """
+        A jackknife that removes one of 'nblocks' contiguous, equally-sized blocks of configurations from each sample,
+        rather than a single configuration. The samples are the leave-one-out jackknife samples of the block means, so
+        the mean, covariance and double definitions of the Jackknife apply to them unchanged, at the cost of 'nblocks'
+        rather than one sample per configuration.
+        :param nblocks: The number of blocks, and so of samples. Must divide the number of configurations.
+        """
+        self.nblocks = nblocks
+
+    def resample(self, data):
+        num_configs = data.shape[configurations]
+        if num_configs % self.nblocks:
+            raise ValueError(f"Cannot divide {num_configs} configurations into {self.nblocks} blocks of equal size. Please re-initialise the resampler with `Analysis.configure_resampler'.")
+        block_size = num_configs // self.nblocks
+        block_sums = np.sum(data.reshape(self.nblocks, block_size, *data.shape[1:]), axis=1)
+        return (np.sum(block_sums, axis=configurations)[None, ...] - block_sums)/(num_configs - block_size)
+
+    def resample_out_of_core(self, data, storage):
+        # Only the (nblocks, T) samples are held in memory, with the block sums read through the disk-backed data
+        return self.resample(data)
+
+    def configure(self, nblocks=None):
+        if nblocks is not None:
+            self.nblocks = nblocks
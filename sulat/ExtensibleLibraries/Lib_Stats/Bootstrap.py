@@ -26,34 +26,123 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import numpy as np
 
-from .Resources import ResamplerBase
+from .Resources import ResamplerBase, sample_rng
 from sulat.Utilities.Evaluation import lazy_readonly
 
+# Keys of the counter-based random number streams derived from the seed
+outer_sample_stream = 0
+inner_sample_stream = 1
+
 
 class Bootstrap(ResamplerBase):
-    def __init__(self, seed, nsamples):
+    def __init__(self, seed, nsamples, chunksize=256, inner_nsamples=None, counter_based=False, double_bootstrap=False):
+        """
+        :param seed: The seed of the random number generator that draws the bootstrap samples.
+        :param nsamples: The number of bootstrap samples.
+        :param inner_nsamples: The number of inner samples per bootstrap sample of the double bootstrap used by
+                               unfrozen fits. Defaults to 'nsamples'.
+        :param chunksize: The number of configurations drawn, and of bootstrap samples computed, at once. This bounds
+                          the memory used to draw and compute the samples, and does not affect which configurations
+                          are drawn.
+        :param counter_based: If True, draw the configurations of each bootstrap sample from its own counter-based
+                              stream of the seed, so that any sample can be regenerated independently of the others
+                              and the samples are computed without storing the matrix of draws. This draws different
+                              samples to the default sequential generator.
+        :param double_bootstrap: If True, Correlators built from configurations keep them, so that the double bootstrap
+                                 needed by unfrozen fits can resample the configurations of each bootstrap sample.
+                                 Otherwise, no configurations are kept, and only frozen fits are available.
+        """
         self.rng = np.random.default_rng(seed)
+        self.entropy = np.random.SeedSequence(seed).entropy
         self.nsamples = nsamples
+        self.chunksize = chunksize
+        self.inner_nsamples = inner_nsamples
+        self.counter_based = counter_based
+        self.double_resamples_configurations = double_bootstrap
         self.configs = None
 
     @lazy_readonly
-    def random_numbers(self):
-        return self.rng.integers(0, self.configs, size=(self.configs, self.nsamples))
+    def counts(self):
+        """
+        The (nsamples, configs) matrix of the number of times each configuration is drawn into each bootstrap sample.
+        The configuration indices are drawn as consecutive chunks of rows of a (configs, nsamples) matrix, which
+        consumes the random number generator exactly as drawing the whole matrix at once would.
+        """
+        if self.counter_based:
+            return self.sample_counts(0, self.nsamples)
+        counts = np.zeros((self.nsamples, self.configs), dtype=np.int32)
+        flat_counts = counts.reshape(-1)
+        sample_offsets = np.arange(self.nsamples) * self.configs
+        for start in range(0, self.configs, self.chunksize):
+            draws = self.rng.integers(0, self.configs, size=(min(self.chunksize, self.configs - start), self.nsamples))
+            # Only the entries drawn in this chunk are counted, so the memory used is bounded by the chunk
+            drawn, times_drawn = np.unique((sample_offsets[None, :] + draws).ravel(), return_counts=True)
+            flat_counts[drawn] += times_drawn.astype(np.int32)
+        return counts
+
+    def sample_draws(self, sample):
+        """
+        Returns the indices of the configurations drawn into bootstrap sample 'sample' by a counter-based resampler.
+        """
+        if not self.counter_based:
+            raise ValueError("Individual bootstrap samples can only be regenerated by a counter-based Bootstrap.")
+        return sample_rng(self.entropy, outer_sample_stream, sample).integers(0, self.configs, size=self.configs)
+
+    def sample_counts(self, start, stop):
+        """
+        Returns the rows 'start' to 'stop' of 'counts'. A counter-based resampler regenerates these from the streams
+        of the samples, rather than storing every row.
+        """
+        if not self.counter_based:
+            return self.counts[start:stop]
+        counts = np.empty((stop - start, self.configs), dtype=np.int32)
+        for i, sample in enumerate(range(start, stop)):
+            counts[i] = np.bincount(self.sample_draws(sample), minlength=self.configs)
+        return counts
 
     def resample(self, data):
         configs = data.shape[0]
         if self.configs is None:
             self.configs = configs
-        if configs != self.random_numbers.shape[0]:
+        if configs != self.configs:
+            raise ValueError(f"Bootstrap was initialised for {self.configs} configurations, not {configs}. Please re-initialise the resampler with `Analysis.configure_resampler'.")
+        if not self.counter_based:
+            return counts_product(self.counts, data, self.chunksize)
+        flat_data = data.reshape(configs, -1)
+        samples = np.empty((self.nsamples, flat_data.shape[1]), dtype=np.result_type(flat_data, float))
+        for start in range(0, self.nsamples, self.chunksize):
+            stop = min(start + self.chunksize, self.nsamples)
+            samples[start:stop] = counts_product(self.sample_counts(start, stop), flat_data, self.chunksize)
+        return samples.reshape(self.nsamples, *data.shape[1:])
+
+    def resample_out_of_core(self, data, storage):
+        """
+        Accumulates the samples over chunks of configurations, so that the disk-backed data is read once. The
+        (nsamples, T) samples are held in memory.
+        """
+        configs = data.shape[0]
+        if self.configs is None:
+            self.configs = configs
+        if configs != self.configs:
             raise ValueError(f"Bootstrap was initialised for {self.configs} configurations, not {configs}. Please re-initialise the resampler with `Analysis.configure_resampler'.")
-        return np.mean(data[self.random_numbers], axis=0)
+        samples = np.zeros((self.nsamples, int(np.prod(data.shape[1:]))), dtype=np.result_type(data, float))
+        for chunk in storage.chunks(configs):
+            samples += np.dot(self.counts[:, chunk], data[chunk].reshape(chunk.stop - chunk.start, -1))
+        return (samples / configs).reshape(self.nsamples, *data.shape[1:])
 
-    def configure(self, seed=None, nsamples=None):
+    def configure(self, seed=None, nsamples=None, inner_nsamples=None, counter_based=None, double_bootstrap=None):
         if seed is not None:
             self.rng = np.random.default_rng(seed)
+            self.entropy = np.random.SeedSequence(seed).entropy
         if nsamples is not None:
             self.nsamples = nsamples
-        del self.random_numbers
+        if inner_nsamples is not None:
+            self.inner_nsamples = inner_nsamples
+        if counter_based is not None:
+            self.counter_based = counter_based
+        if double_bootstrap is not None:
+            self.double_resamples_configurations = double_bootstrap
+        del self.counts
         self.configs = None
 
     #######################
@@ -62,15 +151,144 @@ class Bootstrap(ResamplerBase):
     def mean_definition(self, data_mean, sample_mean):
         return data_mean
 
+    def sample_configurations(self, sample):
+        """
+        Returns the indices of the configurations drawn into bootstrap sample 'sample', in the order in which they were
+        drawn by a counter-based resampler, and otherwise in ensemble order.
+        """
+        if self.counter_based:
+            return self.sample_draws(sample)
+        return np.repeat(np.arange(self.configs), self.counts[sample])
+
+    def iter_sample_configurations(self, start, stop):
+        """
+        Yields the configurations of bootstrap samples 'start' to 'stop', as given by 'sample_configurations'.
+        """
+        for sample in range(start, stop):
+            yield self.sample_configurations(sample)
+
+    def inner_draws(self, outer_sample, nsamples):
+        """
+        Returns the (nsamples, configs) positions, within the configurations of bootstrap sample 'outer_sample', of
+        the configurations drawn into each of its inner samples. They are regenerated on demand from a counter-based
+        stream of the seed, so are never stored.
+        """
+        rng = sample_rng(self.entropy, inner_sample_stream, outer_sample)
+        return rng.integers(0, self.configs, size=(nsamples, self.configs))
+
+    def inner_counts(self, outer_sample, outer_configurations, nsamples):
+        """
+        Returns the (nsamples, configs) matrix of the number of times each configuration is drawn into each inner
+        sample of bootstrap sample 'outer_sample', whose configurations are 'outer_configurations'.
+        """
+        return draw_counts(outer_configurations[self.inner_draws(outer_sample, nsamples)], self.configs)
+
+    def submean_double_definition(self, submean, data=None):
+        """
+        The double bootstrap. The inner samples of each bootstrap sample are bootstrap samples of the configurations
+        drawn into it, so that they are means of 'data', the configurations resampled into 'submean'. Unlike for the
+        Jackknife, the double means cannot be recovered from the bootstrap samples alone.
+        """
+        num_samples = submean.shape[0]
+        inner_nsamples = num_samples if self.inner_nsamples is None else self.inner_nsamples
+        sub_double = np.empty((num_samples, inner_nsamples, *submean.shape[1:]))
+        start = 0
+        for chunk in self.iter_submean_double_definition(submean, data):
+            sub_double[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        return sub_double
+
+    def iter_submean_double_definition(self, submean, data=None, chunksize=None):
+        """
+        Yields the double bootstrap means of 'submean' for consecutive chunks of at most 'chunksize' outer samples.
+        """
+        self.check_double_data(submean, data)
+        chunksize = self.chunksize if chunksize is None else chunksize
+        num_samples = submean.shape[0]
+        inner_nsamples = num_samples if self.inner_nsamples is None else self.inner_nsamples
+        outer_configurations = self.iter_sample_configurations(0, num_samples)
+        for start in range(0, num_samples, chunksize):
+            outer = range(start, min(start + chunksize, num_samples))
+            yield np.array([counts_product(self.inner_counts(k, next(outer_configurations), inner_nsamples), data,
+                                           self.chunksize) for k in outer])
+
+    def check_double_data(self, submean, data):
+        if data is None:
+            raise ValueError("The double bootstrap resamples the configurations drawn into each bootstrap sample, so is "
+                             "only available for Correlators built from configurations by a Bootstrap initialised "
+                             "with double_bootstrap=True.")
+        if data.shape[0] != self.configs or submean.shape[0] != self.nsamples:
+            raise ValueError(f"Bootstrap was initialised for {self.configs} configurations and {self.nsamples} samples, "
+                             f"not {data.shape[0]} and {submean.shape[0]}.")
+
     def cov_definition(self, mean, submean):
         submean = np.atleast_2d(submean)
         mean = np.atleast_1d(mean)
-        num_configs = submean.shape[-1]
+        num_samples = submean.shape[0]
         d = (submean - mean[None, :])
-        return np.dot(d.T, d)/num_configs
+        return np.dot(d.T, d)/num_samples
+
+    def batched_cov_definition(self, mean, submean):
+        d = submean - mean[:, None, :]
+        return np.matmul(d.swapaxes(1, 2), d)/submean.shape[1]
+
+    def cov_double_definition(self, submean, submean_double):
+        submean_double = np.atleast_3d(submean_double)
+        data = np.atleast_2d(submean)
+        cov_double = np.empty((len(submean_double), data.shape[1], data.shape[1]))
+        for start in range(0, len(submean_double), self.chunksize):
+            d = submean_double[start:start + self.chunksize] - data[start:start + self.chunksize, None, :]
+            cov_double[start:start + self.chunksize] = np.matmul(d.swapaxes(1, 2), d) / submean_double.shape[1]
+        return cov_double
+
+    def iter_cov_double_definition(self, submean, data=None, chunksize=None):
+        """
+        Yields the double bootstrap covariance matrices of 'submean' for consecutive chunks of at most 'chunksize'
+        outer samples, holding the inner samples of only one outer sample at once.
+        """
+        self.check_double_data(submean, data)
+        chunksize = self.chunksize if chunksize is None else chunksize
+        submean = np.atleast_2d(submean)
+        num_samples = submean.shape[0]
+        inner_nsamples = num_samples if self.inner_nsamples is None else self.inner_nsamples
+        flat_data = data.reshape(data.shape[0], -1)
+        outer_configurations = self.iter_sample_configurations(0, num_samples)
+        for start in range(0, num_samples, chunksize):
+            outer = range(start, min(start + chunksize, num_samples))
+            chunk = np.empty((len(outer), submean.shape[1], submean.shape[1]))
+            for i, k in enumerate(outer):
+                inner_counts = self.inner_counts(k, next(outer_configurations), inner_nsamples)
+                d = counts_product(inner_counts, flat_data, self.chunksize) - submean[k][None, :]
+                chunk[i] = np.dot(d.T, d) / inner_nsamples
+            yield chunk
 
     def var_definition(self, cov):
         return np.diag(np.atleast_2d(cov))
 
+    def batched_var_definition(self, cov):
+        return np.diagonal(cov, axis1=1, axis2=2).copy()
+
     def std_definition(self, var):
         return np.sqrt(var)
+
+
+def counts_product(counts, data, chunksize):
+    """
+    Returns the means over the configurations of 'data' weighted by each row of 'counts', computed as a matrix product
+    over chunks of 'chunksize' rows so that only a (chunksize, configs) block of weights is converted at once.
+    """
+    configs = data.shape[0]
+    flat_data = data.reshape(configs, -1)
+    samples = np.empty((len(counts), flat_data.shape[1]), dtype=np.result_type(flat_data, float))
+    for start in range(0, len(counts), chunksize):
+        samples[start:start + chunksize] = np.dot(counts[start:start + chunksize], flat_data) / configs
+    return samples.reshape(len(counts), *data.shape[1:])
+
+
+def draw_counts(draws, configs):
+    """
+    Returns the number of times each of 'configs' configurations appears in each row of 'draws'.
+    """
+    sample_offsets = np.arange(len(draws)) * configs
+    return np.bincount((sample_offsets[:, None] + draws).ravel(),
+                       minlength=len(draws)*configs).reshape(len(draws), configs)
@@ -0,0 +1,184 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/ExtensibleLibraries/Lib_Stats/GammaMethod.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import numpy as np
+
+from .Resources import ResamplerBase
+from sulat.Utilities.Storage import chunked_sum
+
+configurations = 0
+
+
+class GammaMethod(ResamplerBase):
+    holds_samples = False
+
+    def __init__(self, S=1.5, bias_correction=True, step=1e-6):
+        """
+        Errors from the autocorrelation functions of the Monte Carlo chain (the Gamma method of Wolff, hep-lat/0306017).
+        The configurations must be in Monte Carlo order.
+        A correlator holds the (C, T) fluctuations data_i - mean of its configurations in chain order in place of
+        resampled means, and its covariance matrix is computed directly from their autocorrelation functions with FFTs.
+        The fluctuations of a derived quantity are those of its inputs propagated linearly through its gradient, which
+        is evaluated by differentiating the quantity along the fluctuation of each configuration with step 'step'.
+        Fits propagate the fluctuations of the data linearly through the gradient of the central fit parameters, so
+        only the central fit is performed, and only frozen fits are available.
+        :param S: The parameter of the automatic windowing procedure, trading the statistical error of the integrated
+                  autocorrelation time against its truncation bias.
+        :param bias_correction: Whether to correct the autocorrelation functions for the bias of estimating the mean.
+        :param step: The size of the steps along the fluctuations at which derived quantities are differentiated, in
+                     units of the fluctuations.
+        """
+        self.S = S
+        self.bias_correction = bias_correction
+        self.step = step
+
+    def resample(self, data):
+        return data - np.mean(data, axis=configurations)[None, ...]
+
+    def resample_out_of_core(self, data, storage):
+        num_configs = data.shape[configurations]
+        mean = chunked_sum(data, storage.chunksize)/num_configs
+        return storage.map(lambda chunk: data[chunk] - mean[None, ...], num_configs)
+
+    def configure(self, S=None, bias_correction=None, step=None):
+        if S is not None:
+            self.S = S
+        if bias_correction is not None:
+            self.bias_correction = bias_correction
+        if step is not None:
+            self.step = step
+
+    #######################
+    # Used by Correlators #
+    #######################
+    def samples(self, mean, submean):
+        """
+        Returns the points 'mean' + step * fluctuation, at which derived quantities are evaluated to differentiate them
+        along the fluctuation of each configuration.
+        """
+        return mean + self.step*submean
+
+    def from_samples(self, mean, samples):
+        """
+        Returns the fluctuations of a derived quantity with mean 'mean', from its values at the points of 'samples'.
+        """
+        return (samples - mean)/self.step
+
+    def mean_definition(self, data_mean, sample_mean):
+        return data_mean
+
+    def cov_definition(self, mean, submean):
+        """
+        The covariance matrix of the mean, from the fluctuations 'submean'. The standard deviations of each variable
+        are those of the Gamma method, and the correlations between variables are those of the fluctuations at zero
+        Monte Carlo time separation, which keeps the covariance matrix positive semi-definite.
+        """
+        fluctuations = np.reshape(submean, (np.shape(submean)[configurations], -1))
+        num_configs = fluctuations.shape[configurations]
+        variances = gamma_variances(fluctuations, self.S, self.bias_correction)[0]
+        naive_cov = np.dot(fluctuations.T, fluctuations)/num_configs
+        naive_std = np.sqrt(np.diag(naive_cov))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.where(naive_std > 0, np.sqrt(variances)/naive_std, 0)
+        return naive_cov * np.outer(scale, scale)
+
+    def var_definition(self, cov):
+        return np.diag(np.atleast_2d(cov))
+
+    def std_definition(self, var):
+        return np.sqrt(var)
+
+
+def autocorrelation(fluctuations):
+    """
+    Returns the autocorrelation functions Gamma(t), for t = 0, ..., C-1, of each variable of the (C, ...) array of
+    mean-subtracted 'fluctuations', computed with FFTs along the configurations in O(C log C) per variable.
+    """
+    num_configs = fluctuations.shape[configurations]
+    size = 2**int(np.ceil(np.log2(2*num_configs)))
+    spectrum = np.fft.rfft(fluctuations, n=size, axis=configurations)
+    gamma = np.fft.irfft(np.abs(spectrum)**2, n=size, axis=configurations)[:num_configs]
+    norm = (num_configs - np.arange(num_configs)).reshape(-1, *[1]*(fluctuations.ndim - 1))
+    return gamma / norm
+
+
+def automatic_window(rho, num_configs, S=1.5):
+    """
+    Returns the summation window W of each variable chosen by the automatic windowing procedure of Wolff, given the
+    normalised autocorrelation functions 'rho': the first W at which
+        g(W) = exp(-W/tau(W)) - tau(W)/sqrt(W C)
+    is negative, with tau(W) = S / log((2 tau_int(W) + 1)/(2 tau_int(W) - 1)).
+    """
+    windows = np.arange(1, len(rho)).reshape(-1, *[1]*(rho.ndim - 1))
+    tau_int = 0.5 + np.cumsum(rho[1:], axis=configurations)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        tau = np.where(tau_int > 0.5, S/np.log((2*tau_int + 1)/(2*tau_int - 1)), np.finfo(float).tiny)
+        g = np.exp(-windows/tau) - tau/np.sqrt(windows*num_configs)
+    negative = g < 0
+    return np.where(np.any(negative, axis=configurations), np.argmax(negative, axis=configurations) + 1, len(rho) - 1)
+
+
+def gamma_variances(fluctuations, S=1.5, bias_correction=True):
+    """
+    Returns the variances of the means of each variable of the (C, ...) array of 'fluctuations' around their means,
+    together with their integrated autocorrelation times and summation windows.
+    """
+    num_configs = fluctuations.shape[configurations]
+    gamma = autocorrelation(fluctuations)
+    gamma_0 = gamma[0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rho = np.where(gamma_0 > 0, gamma / gamma_0, 0)
+    window = automatic_window(rho, num_configs, S)
+
+    summed = np.cumsum(gamma, axis=configurations)
+    C_F = 2*np.take_along_axis(summed, window[None, ...], axis=configurations)[0] - gamma_0
+    if bias_correction:
+        C_F = C_F * (1 + (2*window + 1)/num_configs)
+        gamma_0 = gamma_0 + C_F/num_configs
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tau_int = np.where(gamma_0 > 0, C_F/(2*gamma_0), 0.5)
+    return C_F/num_configs, tau_int, window
+
+
+def integrated_autocorrelation_time(data, S=1.5):
+    """
+    Returns the integrated autocorrelation time of each variable of the (C, ...) array of Monte Carlo 'data', in units
+    of configurations, with the automatic window of the Gamma method. All trailing axes are handled at once, so many
+    correlators can be stacked along a second axis.
+    """
+    return gamma_variances(data - np.mean(data, axis=configurations)[None, ...], S)[1]
+
+
+def recommended_binsize(tau_int, num_configs, factor=4):
+    """
+    Returns the smallest bin size that is at least 'factor' times the largest of 'tau_int', so that the bins are
+    effectively independent while keeping as many of them as possible. The bin size need not divide 'num_configs';
+    binning drops the leftover configurations.
+    """
+    binsize = max(1, int(np.ceil(factor*np.max(tau_int))))
+    if num_configs // binsize < 2:
+        raise ValueError(f"A bin size of {binsize} leaves fewer than two bins of {num_configs} configurations.")
+    return binsize
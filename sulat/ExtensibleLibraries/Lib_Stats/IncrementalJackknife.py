@@ -0,0 +1,69 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/ExtensibleLibraries/Lib_Stats/IncrementalJackknife.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import numpy as np
+
+from .Jackknife import Jackknife
+
+configurations = 0
+
+
+class IncrementalJackknife(Jackknife):
+    """
+    A Jackknife that can also compute its statistics from the sufficient statistics of the configurations: their
+    number, mean, and sum of outer products of deviations from the mean. These are merged as configurations are
+    appended to an IncrementalCorrelator, so that the mean and covariance are updated in time proportional to the new
+    configurations.
+    """
+    def moments(self, data):
+        """
+        Returns the number of configurations in 'data', their mean, and the sum of the outer products of their
+        deviations from the mean.
+        """
+        data = np.atleast_2d(data)
+        mean = np.mean(data, axis=configurations)
+        d = data - mean[None, :]
+        return data.shape[configurations], mean, np.dot(d.T, d)
+
+    def merge_moments(self, moments, other_moments):
+        """
+        Returns the moments of the union of two sets of configurations from the moments of each, with the pairwise
+        update of Chan, Golub and LeVeque, which is stable for deviations small compared to the mean.
+        """
+        num_configs, mean, M2 = moments
+        other_num_configs, other_mean, other_M2 = other_moments
+        total = num_configs + other_num_configs
+        delta = other_mean - mean
+        merged_mean = mean + delta*(other_num_configs/total)
+        merged_M2 = M2 + other_M2 + np.outer(delta, delta)*(num_configs*other_num_configs/total)
+        return total, merged_mean, merged_M2
+
+    def cov_from_moments(self, num_configs, mean, M2):
+        """
+        The jackknife covariance matrix of the mean. The deviations of the jackknife samples from their mean are
+        -(data_i - mean)/(C-1), so (C-1)/C times their sum of squares is M2/(C(C-1)).
+        """
+        return M2/(num_configs*(num_configs - 1))
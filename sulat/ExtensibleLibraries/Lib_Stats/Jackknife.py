@@ -27,6 +27,7 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import numpy as np
 
 from .Resources import ResamplerBase
+from sulat.Utilities.Storage import chunked_gram, chunked_sum, is_disk_backed
 
 configurations = 0
 timeslices = 1
@@ -39,43 +40,103 @@ class Jackknife(ResamplerBase):
         w = (mn[None, :] - data)/(data.shape[configurations] - 1)
         return w
 
+    def resample_out_of_core(self, data, storage):
+        num_configs = data.shape[configurations]
+        mn = chunked_sum(data, storage.chunksize)
+        return storage.map(lambda chunk: (mn[None, :] - data[chunk])/(num_configs - 1), num_configs)
+
     #######################
     # Used by Correlators #
     #######################
     def mean_definition(self, data_mean, sample_mean):
         return sample_mean
 
-    def submean_double_definition(self, submean):
+    def submean_double_definition(self, submean, data=None):
+        num_samples = submean.shape[configurations]
+        sub_double = np.empty((num_samples, num_samples - 1, *submean.shape[1:]))
+        start = 0
+        for chunk in self.iter_submean_double_definition(submean):
+            sub_double[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        return sub_double
+
+    def iter_submean_double_definition(self, submean, chunksize=64):
+        """
+        Yields the double-jackknife means of 'submean' for consecutive chunks of at most 'chunksize' outer samples, so
+        that only a (chunksize, C-1, T) slice of the (C, C-1, T) double-jackknife means is held at once.
+        """
         num_samples = submean.shape[configurations]
         # Add get total value for each x-value
         mn = np.sum(submean, axis=configurations)
-        # Make all double-removals
-        jackknife_removed_data = submean[None, :, :] + submean[:, None, :]
-        # Drop the diagonal in the configs x configs slice --- same value removed twice instead of different values
-        new_shape = list(jackknife_removed_data.shape)
-        new_shape[configurations + 1] -= 1
-        jackknife_removed_data = jackknife_removed_data[~np.eye(num_samples, dtype=bool), :].reshape(*new_shape)
-
-        # Subtract double-removal from each total, divide to make the average over the N-2 samples
-        sub_double = (mn[None, None, :] - jackknife_removed_data) / (submean.shape[configurations] - 2)
-        return sub_double
+        for start in range(0, num_samples, chunksize):
+            outer = submean[start:start + chunksize]
+            # Make all double-removals
+            jackknife_removed_data = outer[:, None, :] + submean[None, :, :]
+            # Drop the same value removed twice instead of different values
+            keep = np.arange(num_samples)[None, :] != np.arange(start, start + len(outer))[:, None]
+            jackknife_removed_data = jackknife_removed_data[keep, :].reshape(len(outer), num_samples - 1,
+                                                                             *submean.shape[1:])
+
+            # Subtract double-removal from each total, divide to make the average over the N-2 samples
+            yield (mn[None, None, :] - jackknife_removed_data) / (num_samples - 2)
 
     def cov_definition(self, mean, submean):
         submean = np.atleast_2d(submean)
         mean = np.atleast_1d(mean)
         num_configs = submean.shape[configurations]
+        if is_disk_backed(submean):
+            return chunked_gram(submean, mean)*((num_configs - 1)/num_configs)
         d = (submean - mean[None, :])
         return np.dot(d.T, d)*((num_configs - 1)/num_configs)
 
-    def cov_double_definition(self, submean, submean_double):
+    def batched_cov_definition(self, mean, submean):
+        num_configs = submean.shape[1]
+        d = submean - mean[:, None, :]
+        return np.matmul(d.swapaxes(1, 2), d)*((num_configs - 1)/num_configs)
+
+    def cov_double_definition(self, submean, submean_double, chunksize=64):
         submean_double = np.atleast_3d(submean_double)
         data = np.atleast_2d(submean)
         num_configs = submean.shape[configurations]
-        d = submean_double - data[:, None, :]
-        return np.matmul(d.swapaxes(1, 2), d)*((num_configs - 1)/num_configs)
+        cov_double = np.empty((len(submean_double), data.shape[timeslices], data.shape[timeslices]))
+        for start in range(0, len(submean_double), chunksize):
+            d = submean_double[start:start + chunksize] - data[start:start + chunksize, None, :]
+            cov_double[start:start + chunksize] = np.matmul(d.swapaxes(1, 2), d)*((num_configs - 1)/num_configs)
+        return cov_double
+
+    def iter_cov_double_definition(self, submean, data=None, chunksize=64):
+        """
+        Yields the double-jackknife covariance matrices of 'submean' for consecutive chunks of at most 'chunksize'
+        outer samples, without forming the double-jackknife means. These follow from 'submean' alone, so the
+        configurations 'data' are not needed.
+        With the mean-subtracted submeans t_i and their Gram matrix G = sum_i t_i t_i^T, the leave-two-out deviations
+        from outer sample i are -((C-1) t_i + t_j)/(C-2), which sum to the closed form
+            cov_double_i = (C-1)/C / (C-2)^2 * (G + ((C-1)^3 - 2(C-1) - 1) t_i t_i^T).
+        """
+        data = np.atleast_2d(submean)
+        num_configs = data.shape[configurations]
+        centred, gram, rank_one_factor, prefactor = self.cov_double_factors(data)
+        for start in range(0, num_configs, chunksize):
+            t = centred[start:start + chunksize]
+            yield prefactor * (gram[None, :, :] + rank_one_factor * t[:, :, None] * t[:, None, :])
+
+    def cov_double_factors(self, submean):
+        """
+        Returns the terms of the closed form of the double-jackknife covariance matrices in iter_cov_double_definition:
+        the mean-subtracted submeans, their Gram matrix, the coefficient of the rank-one term, and the prefactor.
+        """
+        num_configs = submean.shape[configurations]
+        centred = submean - np.mean(submean, axis=configurations)[None, :]
+        gram = np.dot(centred.T, centred)
+        rank_one_factor = (num_configs - 1)**3 - 2*(num_configs - 1) - 1
+        prefactor = ((num_configs - 1)/num_configs) / (num_configs - 2)**2
+        return centred, gram, rank_one_factor, prefactor
 
     def var_definition(self, cov):
         return np.diag(cov)
 
+    def batched_var_definition(self, cov):
+        return np.diagonal(cov, axis1=1, axis2=2).copy()
+
     def std_definition(self, var):
         return np.sqrt(var)
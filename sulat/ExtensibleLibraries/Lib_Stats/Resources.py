@@ -23,13 +23,47 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import numpy as np
 
 
+def sample_rng(entropy, *key):
+    """
+    Returns a counter-based (Philox) random number generator for the stream 'key' of the seed 'entropy'. The streams of
+    different keys are independent, and each can be regenerated on its own, in any order or process.
+    """
+    return np.random.Generator(np.random.Philox(np.random.SeedSequence(entropy, spawn_key=key)))
+
 
 class ResamplerBase:
+    # Whether the double samples are resampled from the configurations, which Correlators must then keep
+    double_resamples_configurations = False
+    # Whether 'submean' holds the samples themselves, on which derived quantities and fits are evaluated directly.
+    # Otherwise, it is converted to and from samples by 'samples' and 'from_samples'
+    holds_samples = True
+
     def resample(self, data):
         raise NotImplementedError
 
+    def resample_out_of_core(self, data, storage):
+        """
+        Resamples disk-backed 'data' a chunk of measurements at a time, writing samples as large as the data to the
+        DiskStorage 'storage'. Resamplers whose samples are much smaller than the data may return them in memory.
+        """
+        return self.resample(data)
+
+    def samples(self, mean, submean):
+        """
+        Returns the samples on which quantities derived from the 'submean' of a correlator are evaluated. 'mean' is
+        the data mean of the correlator, broadcastable against 'submean'.
+        """
+        return submean
+
+    def from_samples(self, mean, samples):
+        """
+        The inverse of 'samples', returning the 'submean' of a derived quantity with data mean 'mean' from its samples.
+        """
+        return samples
+
     def mean_definition(self, *args, **kwargs):
         raise NotImplementedError
 
@@ -45,12 +79,30 @@ class ResamplerBase:
     def cov_double_definition(self, submean, mean):
         raise NotImplementedError
 
+    def iter_cov_double_definition(self, submean, data=None, chunksize=None):
+        """
+        Yields the double covariance matrices of 'submean', resampled from the configurations 'data' where the
+        resampler needs them, in chunks of outer samples. Resamplers that can compute them without materialising
+        'submean_double' override this.
+        """
+        yield self.cov_double_definition(submean, self.submean_double_definition(submean, data))
+
     def var_definition(self, cov_definition):
         raise NotImplementedError
 
     def std_definition(self, var):
         raise NotImplementedError
 
+    def batched_cov_definition(self, mean, submean):
+        """
+        The covariance matrices of a stack of N correlators, from their (N, T) means and (N, samples, T) submeans.
+        Resamplers override this to compute all of them at once.
+        """
+        return np.stack([self.cov_definition(m, s) for m, s in zip(mean, submean)])
+
+    def batched_var_definition(self, cov):
+        return np.stack([self.var_definition(c) for c in cov])
+
     def covvarstd(self, mean, submean):
         cov = self.cov_definition(mean, submean)
         var = self.var_definition(cov)
@@ -22,8 +22,12 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
+import numpy as np
+
 from sulat import Analysis
-from .Utilities import gen_fake_2pt_data
+from sulat.Core.DataStructures import LazyCorrelator, lazy_arithmetic
+from sulat.Utilities.Storage import is_disk_backed
+from .Utilities import gen_fake_2pt_data, gen_fake_2pt_ensemble
 
 
 def test_build_combination():
@@ -41,3 +45,106 @@ def test_build_combination():
     an.combine_correlators('{corr} + {corr}')
     an.combine('{corr} + {corr}')
     an.combine('flip', [corr])
+
+
+def test_out_of_core_combination(tmp_path):
+    data = gen_fake_2pt_ensemble(configs=100)
+    np.save(tmp_path / 'data.npy', data)
+    for resampler in ('Jackknife', 'Bootstrap'):
+        an = Analysis()
+        an.init_resampler(resampler, *((10, 50) if resampler == 'Bootstrap' else ()))
+        an.init_storage(tmp_path / 'storage', chunksize=16)
+        conf = an.build_configurations(np.load(tmp_path / 'data.npy', mmap_mode='r'), copy_data=False)
+        an.configurations['conf'] = conf
+        corr = an.configs_to_correlator(conf)
+        an.correlators['corr'] = corr
+
+        reference = Analysis()
+        reference.init_resampler(resampler, *((10, 50) if resampler == 'Bootstrap' else ()))
+        expected = reference.build_correlator(data)
+        assert is_disk_backed(conf.data) and is_disk_backed(corr.submean) == (resampler == 'Jackknife')
+        for stat in ('mean', 'submean', 'cov'):
+            reference_stat = getattr(expected, stat)
+            assert np.allclose(getattr(corr, stat), reference_stat, rtol=0, atol=1e-12*np.max(np.abs(reference_stat)))
+
+        combined = an.combine_configurations('{conf} * {conf}')
+        assert is_disk_backed(combined.data) and np.allclose(combined.data, data**2, rtol=1e-14, atol=0)
+        combined = an.combine('flip', [corr])
+        assert is_disk_backed(combined.submean) == (resampler == 'Jackknife')
+        assert np.allclose(combined.submean, np.flip(expected.submean, axis=1), rtol=1e-12, atol=0)
+        assert np.allclose(an.combine('{corr} / {corr}').mean, 1, rtol=1e-14, atol=0)
+
+
+def test_correlator_set():
+    data = np.stack([gen_fake_2pt_ensemble(seed=seed) for seed in range(5)])
+    for resampler, args in (('Jackknife', ()), ('Bootstrap', (10, 40))):
+        an = Analysis()
+        an.init_resampler(resampler, *args)
+        corr_set = an.build_correlator_set(data, transforms=['fold'])
+        an.init_resampler(resampler, *args)
+        corrs = [an.build_correlator(channel, transforms=['fold']) for channel in data]
+
+        for stat in ('mean', 'submean', 'cov', 'std'):
+            expected = np.stack([getattr(corr, stat) for corr in corrs])
+            assert np.allclose(getattr(corr_set, stat), expected, rtol=0, atol=1e-12*np.max(np.abs(expected)))
+        assert np.shares_memory(corr_set[2].submean, corr_set.submean)
+
+        ratio = corr_set / corr_set[0]
+        assert np.allclose(ratio[0].mean, 1, rtol=1e-14, atol=0)
+        flipped = corr_set.apply(np.flip, axis=1)
+        assert np.allclose(flipped[1].submean, np.flip(corrs[1].submean, axis=1), rtol=1e-14, atol=0)
+
+        # In-place arithmetic on the stack or on a view forgets the cached statistics of every view of the stack
+        view, sliced = corr_set[1], corr_set[1:]
+        std = view.std.copy()
+        corr_set *= 2
+        assert np.allclose(view.std, 2*std, rtol=1e-12, atol=0)
+        assert np.allclose(sliced.std[0], 2*std, rtol=1e-12, atol=0)
+        view *= 3
+        assert np.allclose(corr_set.std[1], 6*std, rtol=1e-12, atol=0)
+
+        # Unary operators return new sets, leaving the views sharing memory with the stack
+        negated = -corr_set
+        assert negated is not corr_set
+        assert np.allclose(negated.mean, -corr_set.mean, rtol=1e-14, atol=0)
+        assert np.shares_memory(view.submean, corr_set.submean)
+
+
+def test_numpy_protocol():
+    data = gen_fake_2pt_ensemble()
+    an = Analysis()
+    an.init_resampler('Jackknife')
+    corr = an.build_correlator(data)
+
+    log_corr = np.log(corr)
+    assert np.allclose(log_corr.submean, np.log(corr.submean), rtol=1e-14, atol=0)
+    effective_mass = np.arccosh((np.roll(corr, -1, axis=1) + np.roll(corr, 1, axis=1)) / (corr * 2))
+    assert np.all(np.abs(effective_mass.mean[4:12] - 0.3) < 0.1)
+
+    # In-place ufuncs forget the cached statistics
+    std = corr.std
+    np.multiply(corr, 2, out=corr)
+    assert np.allclose(corr.std, 2*std, rtol=1e-12, atol=0)
+
+    configs = an.build_configurations(data)
+    assert np.allclose(np.sqrt(configs).mean, np.mean(np.sqrt(data), axis=0), rtol=1e-14, atol=0)
+
+
+def test_lazy_arithmetic():
+    an = Analysis()
+    an.init_resampler('Jackknife')
+    corrs = [an.build_correlator(gen_fake_2pt_ensemble(seed=seed)) for seed in range(3)]
+    c1, c2, c3 = corrs
+    expected = (c1 * c2) / (c3 * c3) - 1
+
+    with lazy_arithmetic(chunksize=7):
+        ratio = (c1 * c2) / (c3 * c3) - 1
+        log_ratio = -np.log(ratio + 2)
+    assert isinstance(ratio, LazyCorrelator) and isinstance(log_ratio, LazyCorrelator)
+    assert not ratio.is_evaluated
+    for stat in ('mean', 'submean', 'std'):
+        assert np.allclose(getattr(ratio, stat), getattr(expected, stat), rtol=1e-14, atol=0)
+    assert np.allclose(log_ratio.submean, -np.log(expected.submean + 2), rtol=1e-14, atol=0)
+
+    # Outside the lazy mode, arithmetic on a LazyCorrelator is evaluated immediately
+    assert type(ratio + 1) is not LazyCorrelator
@@ -22,8 +22,19 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
+import os
+import pickle
+from functools import partial
+
+import numpy as np
+
 from sulat import Analysis
-from .Utilities import gen_fake_2pt_data
+from sulat.Core.Fitting.Checkpoint import FitScanCheckpoint, merge_checkpoints
+from sulat.Core.Fitting.JointCovariance import JointCovarianceCache, joint_cov, cov2weights, low_rank_subweights
+from sulat.Core.Fitting.Screening import AllOf, MinNdof, MinPValue
+from sulat.ExtensibleLibraries.Lib_Minimisers.LevenburgMarquardtBatched import LevenburgMarquardtBatched
+from sulat.ExtensibleLibraries.Lib_Minimisers.LevenburgMarquardtBatched.Resources import fit_bins
+from .Utilities import gen_fake_2pt_data, gen_fake_2pt_ensemble
 
 
 def test_fit_twopoints():
@@ -43,3 +54,268 @@ def test_fit_twopoints():
     an.fit([corr], ['cosh_2pt_excited'], fit_ranges=[[3, 25]], correlation=True,
            args={'Aex0': 1, 'Eex0': 1, 'Aex1': 1, 'Eex1': 1},
            arg_identities=[['T', 'Aex0', 'Eex0', 'Aex1', 'Eex1']])
+
+
+def test_fit_scan_parallel():
+    data = gen_fake_2pt_data()
+    an = Analysis()
+    an.init_resampler('Jackknife')
+    corr = an.build_correlator(data)
+
+    kwargs = dict(fit_ranges=[[10, 20]], correlation=True, args={'A': 1, 'E': 1}, arg_identities=[['T', 'A', 'E']],
+                  frozen=True, min_fit=10)
+    serial = an.fit_scan([corr], ['cosh_2pt'], **kwargs)
+    parallel = an.fit_scan([corr], ['cosh_2pt'], processes=2, chunksize=2, **kwargs)
+    parallel_again = an.fit_scan([corr], ['cosh_2pt'], processes=2, **kwargs)
+    an.close_fit_pool()
+
+    assert list(serial.keys()) == list(parallel.keys()) == list(parallel_again.keys())
+    assert np.all(serial.submean == parallel.submean)
+    assert np.all(serial.pvalue == parallel.pvalue)
+
+    # Unfrozen fits take their double covariance matrices from the parent process, so the configurations kept for the
+    # double bootstrap are not sent to the workers
+    an.init_resampler('Bootstrap', seed=10, nsamples=20, inner_nsamples=10, double_bootstrap=True)
+    corr = an.build_correlator(data)
+    kwargs = dict(kwargs, args={'A': 0.03, 'E': 0.3}, frozen=False)
+    serial = an.fit_scan([corr], ['cosh_2pt'], **kwargs)
+    parallel = an.fit_scan([corr], ['cosh_2pt'], processes=2, **kwargs)
+    an.close_fit_pool()
+    assert np.all(serial.submean == parallel.submean)
+
+
+def test_fit_batched_minimiser():
+    data = gen_fake_2pt_ensemble()
+    an = Analysis()
+    an.init_resampler('Jackknife')
+    corr = an.build_correlator(data)
+
+    for frozen in [True, False]:
+        kwargs = dict(fit_ranges=[[1, 31]], correlation=True, args={'Aex0': 1, 'Eex0': 1, 'Aex1': 1, 'Eex1': 1},
+                      arg_identities=[['T', 'Aex0', 'Eex0', 'Aex1', 'Eex1']], frozen=frozen)
+        scipy_fit = an.fit([corr], ['cosh_2pt_excited'], **kwargs)
+        batched_fit = an.fit([corr], ['cosh_2pt_excited'], fit_method='LevenburgMarquardtBatched', **kwargs)
+        for key in scipy_fit.mean:
+            assert np.allclose(scipy_fit.submean[key], batched_fit.submean[key], rtol=0, atol=1e-3*scipy_fit.std[key])
+        assert np.allclose(scipy_fit.subchi_sq_per_dof, batched_fit.subchi_sq_per_dof, rtol=1e-8)
+
+        # Analytic Jacobians are only used when requested, by the batched and scipy minimisers alike
+        jacobian_kwargs = dict(kwargs, args=dict(scipy_fit.mean))
+        scipy_jacobian_fit = an.fit([corr], ['cosh_2pt_excited'], fit_method='LevenburgMarquardtScipyJacobian',
+                                    **jacobian_kwargs)
+        batched_jacobian_fit = an.fit([corr], ['cosh_2pt_excited'], fit_method='LevenburgMarquardtBatchedJacobian',
+                                      **jacobian_kwargs)
+        for key in scipy_jacobian_fit.mean:
+            assert np.allclose(scipy_jacobian_fit.submean[key], batched_jacobian_fit.submean[key], rtol=0,
+                               atol=1e-3*scipy_jacobian_fit.std[key])
+        assert np.allclose(scipy_jacobian_fit.subchi_sq_per_dof, batched_jacobian_fit.subchi_sq_per_dof, rtol=1e-8)
+
+    # Bins that do not converge within the iteration limit are refitted one at a time
+    def truncated_batched(*args):
+        return LevenburgMarquardtBatched(*args)
+    truncated_batched.fit_bins = partial(fit_bins, maxiter=1)
+    truncated_fit = an.fit([corr], ['cosh_2pt_excited'], fit_method=truncated_batched, **kwargs)
+    assert np.allclose(scipy_fit.subchi_sq_per_dof, truncated_fit.subchi_sq_per_dof, rtol=1e-12)
+
+
+def test_fit_linear_minimiser():
+    data = gen_fake_2pt_ensemble()
+    an = Analysis()
+    an.init_resampler('Jackknife')
+    corr = an.build_correlator(data)
+
+    for frozen in [True, False]:
+        for func, args in [('const', {'c': 1}), ('poly', {'c0': 1, 'c1': 1, 'c2': 1})]:
+            kwargs = dict(fit_ranges=[[12, 20]], correlation=True, args=args, arg_identities=[list(args)], frozen=frozen)
+            scipy_fit = an.fit([corr], [func], fit_method='LevenburgMarquardtScipyJacobian', **kwargs)
+            linear_fit = an.fit([corr], [func], fit_method='LinearLeastSquares', **kwargs)
+            for key in scipy_fit.mean:
+                assert np.isclose(scipy_fit.mean[key], linear_fit.mean[key], rtol=0, atol=1e-6*scipy_fit.std[key])
+                assert np.allclose(scipy_fit.submean[key], linear_fit.submean[key], rtol=0, atol=1e-6*scipy_fit.std[key])
+            assert np.isclose(scipy_fit.pvalue, linear_fit.pvalue, rtol=1e-8)
+            assert np.allclose(scipy_fit.subchi_sq_per_dof, linear_fit.subchi_sq_per_dof, rtol=1e-8)
+
+    # The nonlinear fit function is rejected without floating-point errors from probing it at zero parameters
+    try:
+        with np.errstate(all='raise'):
+            an.fit([corr], ['cosh_2pt'], fit_ranges=[[12, 20]], correlation=True, args={'A': 1, 'E': 1},
+                   arg_identities=[['T', 'A', 'E']], fit_method='LinearLeastSquares')
+    except ValueError:
+        pass
+    else:
+        assert False, "A nonlinear fit function was accepted by the linear minimiser."
+
+
+def test_joint_covariance_cache():
+    data = gen_fake_2pt_ensemble(configs=50)
+    an = Analysis()
+    an.init_resampler('Jackknife')
+    corrs = [an.build_correlator(data), an.build_correlator(data[:, ::-1])]
+
+    fit_ranges = [np.arange(3, 9), np.arange(5, 12)]
+    for correlation in [True, 'block', False]:
+        for frozen in [True, False]:
+            cache = JointCovarianceCache(corrs, correlation, frozen)
+            central_cov, subcovs = joint_cov(corrs, fit_ranges, correlation, frozen)
+            expected_weights = cov2weights(central_cov)
+            expected_subweights = np.array([cov2weights(subcov) for subcov in subcovs])
+            for _ in range(2):
+                weights, subweights = cache.weights(fit_ranges)
+                assert np.allclose(weights, expected_weights, rtol=0, atol=1e-10*np.max(np.abs(expected_weights)))
+                # The unfrozen weights are computed by rank-one downdates rather than by inverting each covariance
+                # matrix, which agrees with the direct inversions to the precision of the latter
+                assert np.allclose(subweights, expected_subweights, rtol=0,
+                                   atol=1e-7*np.max(np.abs(expected_subweights)))
+            if frozen:
+                assert all(subweight is weights for subweight in subweights)
+
+
+def test_fit_scan_screening():
+    data = gen_fake_2pt_ensemble(configs=50)
+    an = Analysis()
+    an.init_resampler('Jackknife')
+    corr = an.build_correlator(data)
+
+    kwargs = dict(fit_ranges=[[4, 16]], correlation=True, args={'A': 0.03, 'E': 0.3}, arg_identities=[['T', 'A', 'E']],
+                  frozen=False, min_fit=5)
+    unscreened = an.fit_scan([corr], ['cosh_2pt'], **kwargs)
+    screened = an.fit_scan([corr], ['cosh_2pt'], screen=AllOf(MinPValue(0.05), MinNdof(4)), **kwargs)
+
+    expected = unscreened.filter((unscreened.pvalue >= 0.05) & (unscreened.Ndof >= 4))
+    assert 0 < len(expected) < len(unscreened)
+    assert list(screened.keys()) == list(expected.keys())
+    assert np.all(screened.submean == expected.submean)
+
+
+def test_fit_scan_checkpoint(tmp_path):
+    data = gen_fake_2pt_ensemble(configs=50)
+    an = Analysis()
+    an.init_resampler('Jackknife')
+    corr = an.build_correlator(data)
+
+    kwargs = dict(fit_ranges=[[4, 14]], correlation=True, args={'A': 0.03, 'E': 0.3}, arg_identities=[['T', 'A', 'E']],
+                  frozen=True, min_fit=6)
+    path = str(tmp_path / 'scan.pkl')
+    uncheckpointed = an.fit_scan([corr], ['cosh_2pt'], **kwargs)
+    an.fit_scan([corr], ['cosh_2pt'], checkpoint=path, **kwargs)
+
+    # Simulate a scan killed part of the way through writing a record
+    with open(path, 'rb+') as f:
+        signature = pickle.load(f)['signature']
+        f.truncate(os.path.getsize(path) // 2)
+    partial = FitScanCheckpoint(path, signature)
+    assert 0 < len(partial.records) < len(uncheckpointed)
+
+    resumed = an.fit_scan([corr], ['cosh_2pt'], checkpoint=path, **kwargs)
+    assert list(resumed.keys()) == list(uncheckpointed.keys())
+    assert np.all(resumed.submean == uncheckpointed.submean)
+
+    kwargs['frozen'] = False
+    try:
+        an.fit_scan([corr], ['cosh_2pt'], checkpoint=path, **kwargs)
+    except ValueError:
+        pass
+    else:
+        assert False, "A checkpoint was resumed by a different fit scan."
+
+
+def test_fit_scan_table():
+    data = gen_fake_2pt_ensemble(configs=50)
+    an = Analysis()
+    an.init_resampler('Jackknife')
+    corr = an.build_correlator(data)
+
+    kwargs = dict(correlation=True, args={'A': 0.03, 'E': 0.3}, arg_identities=[['T', 'A', 'E']], frozen=True)
+    table = an.fit_scan([corr], ['cosh_2pt'], fit_ranges=[[4, 14]], min_fit=6, **kwargs)
+    assert table.submean.shape == (len(table), 50, 2)
+
+    key = table.fit_keys[3]
+    fit_result = table[key]
+    assert fit_result is table[key]
+    assert np.all(fit_result.submean['E'] == table.parameter('E')[1][3])
+    assert fit_result.pvalue == table.pvalue[3]
+    assert fit_result.subresults[0].corr is corr
+    single = an.fit([corr], ['cosh_2pt'], fit_ranges=table.fit_ranges[3], **kwargs)
+    assert np.all(single.submean['E'] == fit_result.submean['E'])
+
+    by_pvalue = table.sort('pvalue', descending=True)
+    assert np.all(np.diff(by_pvalue.pvalue) <= 0)
+    assert by_pvalue[by_pvalue.fit_keys[0]].pvalue == np.max(table.pvalue)
+    good = table.filter(lambda t: t.pvalue > 0.1)
+    assert np.all(good.pvalue > 0.1)
+    groups = table.group_by(lambda fit_ranges: fit_ranges[0][0])
+    assert sorted(groups) == sorted(set(fit_ranges[0][0] for fit_ranges in table.fit_ranges))
+    assert sum(len(group) for group in groups.values()) == len(table)
+    assert set(table.group_by('Ndof')) == set(table.Ndof.tolist())
+
+
+def test_model_average():
+    data = gen_fake_2pt_ensemble(configs=50)
+    an = Analysis()
+    an.init_resampler('Jackknife')
+    corr = an.build_correlator(data)
+
+    table = an.fit_scan([corr], ['cosh_2pt'], fit_ranges=[[4, 14]], min_fit=6, correlation=True,
+                        args={'A': 0.03, 'E': 0.3}, arg_identities=[['T', 'A', 'E']], frozen=True)
+    chi_sq = table.chi_sq_per_dof * table.Ndof
+    expected_weights = np.exp(-chi_sq/2 + table.Ndof)
+    expected_weights /= np.sum(expected_weights)
+    expected_mean = np.sum(expected_weights * table.parameter('E')[0])
+
+    average = table.model_average('aic')
+    assert np.allclose(average.weights, expected_weights)
+    assert np.isclose(average.mean['E'], expected_mean)
+    assert np.allclose(np.sum(average.subweights, axis=1), 1)
+    assert average.std['E'] > 0 and average.sys_std['E'] >= 0
+    expected_sys_substd = np.sqrt(np.sum(average.subweights * (table.parameter('E')[1].T
+                                                              - average.submean['E'][:, None])**2, axis=1))
+    assert np.allclose(average.sys_substd['E'], expected_sys_substd)
+    assert np.isclose(average.sys_std_err['E'], corr.resampler.covvarstd(average.sys_std['E'],
+                                                                          expected_sys_substd[:, None])[2][0])
+
+    flat = table.model_average('flat')
+    assert np.isclose(flat.mean['E'], np.mean(table.parameter('E')[0]))
+    assert np.allclose(flat.submean['E'], np.mean(table.parameter('E')[1], axis=0))
+    assert np.isclose(flat.std['E'], corr.resampler.covvarstd(flat.mean['E'], flat.submean['E'][:, None])[2][0])
+
+    # The resampler sets the statistical uncertainties, including those of the systematic spread over the fits
+    an.init_resampler('Bootstrap', seed=10, nsamples=50)
+    rescaled = table.model_average('flat', resampler=an.resampler)
+    assert np.isclose(rescaled.std['E'], flat.std['E'] * np.sqrt(1/(corr.submean.shape[0] - 1)))
+    assert np.isclose(rescaled.sys_std_err['E'], flat.sys_std_err['E'] * np.sqrt(1/(corr.submean.shape[0] - 1)))
+    assert rescaled.sys_std['E'] == flat.sys_std['E']
+
+
+def test_fit_scan_shards(tmp_path):
+    data = gen_fake_2pt_ensemble(configs=50)
+    an = Analysis()
+    an.init_resampler('Jackknife')
+    corr = an.build_correlator(data)
+
+    kwargs = dict(fit_ranges=[[4, 14]], correlation=True, args={'A': 0.03, 'E': 0.3}, arg_identities=[['T', 'A', 'E']],
+                  frozen=True, min_fit=6)
+    unsharded = an.fit_scan([corr], ['cosh_2pt'], **kwargs)
+
+    paths = [str(tmp_path / f'shard_{i}.pkl') for i in range(3)]
+    shards = [an.fit_scan([corr], ['cosh_2pt'], checkpoint=path, shard=(i, 3), **kwargs) for i, path in enumerate(paths)]
+    assert sum(len(shard) for shard in shards) == len(unsharded)
+    assert list(shards[1].keys()) == list(unsharded.keys())[1::3]
+
+    merged_path = str(tmp_path / 'merged.pkl')
+    assert merge_checkpoints(paths, merged_path) == len(unsharded)
+    merged = an.fit_scan([corr], ['cosh_2pt'], checkpoint=merged_path, **kwargs)
+    assert list(merged.keys()) == list(unsharded.keys())
+    assert np.all(merged.submean == unsharded.submean)
+
+
+def test_low_rank_subweights():
+    rng = np.random.default_rng(3)
+    centred = rng.normal(size=(40, 6))
+    centred -= np.mean(centred, axis=0)
+    gram = np.dot(centred.T, centred)
+
+    expected = cov2weights(0.3 * (gram[None, :, :] + 50 * centred[:, :, None] * centred[:, None, :]))
+    assert np.allclose(low_rank_subweights(centred, gram, 50, 0.3), expected, rtol=1e-10, atol=0)
+    expected_diagonal = cov2weights(0.3 * (np.diag(gram)[None, :] + 50 * centred**2)[:, :, None] * np.eye(6))
+    assert np.allclose(low_rank_subweights(centred, gram, 50, 0.3, diagonal=True), expected_diagonal,
+                       rtol=1e-12, atol=0)
@@ -23,8 +23,13 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import warnings
+
+import numpy as np
+
 from sulat import Analysis
-from .Utilities import gen_fake_2pt_data
+from sulat.ExtensibleLibraries.Lib_Stats.GammaMethod import recommended_binsize
+from .Utilities import gen_fake_2pt_data, gen_fake_2pt_ensemble
 
 
 def test_build_configurations():
@@ -44,3 +49,53 @@ def test_build_configurations():
     an.build_configurations(data, transforms={'bin': [2, 1]})
     an.build_configurations(data, transforms={'bin_timeslices': [2]})
     an.build_configurations(data, transforms={'bin_configurations': [2]})
+
+
+def test_autocorrelation_binsize():
+    # Autoregressive chains with integrated autocorrelation times of 0.5 and 4.5
+    rng = np.random.default_rng(10)
+    noise = rng.normal(size=(3000, 2, 32))
+    for i in range(1, len(noise)):
+        noise[i, 1] += 0.8*noise[i - 1, 1]
+    data = np.mean(gen_fake_2pt_ensemble(), axis=0)[None, None, :]*(1 + 0.01*noise)
+    an = Analysis()
+
+    tau_int = an.integrated_autocorrelation_times(data[:, 0], an.build_configurations(data[:, 1]))
+    assert tau_int.shape == (2, 32)
+    assert np.all(np.mean(tau_int, axis=1) < [1, 6]) and np.all(np.mean(tau_int, axis=1) > [0.25, 3.5])
+    binsize = an.recommend_binsize(data[:, 1], factor=2)
+    assert binsize == np.ceil(2*np.max(tau_int[1]))
+
+    binned = an.build_configurations(data[:, 1], transforms={'auto_bin_configurations': [2]})
+    assert len(binned.data) == 3000 // binsize
+
+    # The bins have the recommended size whether or not it divides the number of configurations, and the leftover
+    # configurations are dropped with a warning
+    for num_configs, num_bins in [(998, 199), (1009, 201), (1000, 200)]:
+        assert recommended_binsize(np.full(32, 1.25), num_configs) == 5
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            binned = an.build_configurations(data[:num_configs, 1], transforms={'bin_configurations': [5]})
+        assert len(binned.data) == num_bins and len(caught) == (num_configs % 5 != 0)
+        assert np.allclose(binned.data, np.mean(data[:5*num_bins, 1].reshape(num_bins, 5, 32), axis=1),
+                           rtol=1e-14, atol=0)
+    try:
+        recommended_binsize(np.full(32, 1.25), 9)
+    except ValueError:
+        pass
+    else:
+        assert False, "A bin size was recommended that leaves fewer than two bins."
+
+
+def test_build_without_copying():
+    data = gen_fake_2pt_ensemble()
+    original = data.copy()
+    an = Analysis()
+    an.init_resampler('Jackknife')
+
+    assert an.build_configurations(data, copy_data=False).data is data
+    assert np.shares_memory(an.build_configurations(data, transforms=['flip'], copy_data=False).data, data)
+    for transforms in (['fold'], {'fold': [1, 0], 'bin_configurations': [2]}):
+        corr = an.build_correlator(data, transforms=transforms, copy_data=False)
+        assert np.array_equal(data, original)
+        assert np.allclose(corr.submean, an.build_correlator(data, transforms=transforms).submean, rtol=1e-14, atol=0)
@@ -0,0 +1,81 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/Tests/FitFunctions.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+from sulat.Core.Fitting.Fit import fit_func_factory
+from sulat.ExtensibleLibraries.Lib_FitFuncs import ExLib_FitFuncs
+
+
+def numerical_jacobian(func, t, params, step=1e-6):
+    derivatives = []
+    for i in range(len(params)):
+        shifted_up = list(params)
+        shifted_down = list(params)
+        shifted_up[i] += step
+        shifted_down[i] -= step
+        derivatives.append((func(t, *shifted_up) - func(t, *shifted_down)) / (2*step))
+    return derivatives
+
+
+def test_analytic_jacobians():
+    t = np.arange(1., 20.)
+    cases = {'const': [0.5],
+             'linear': [0.5, 0.3],
+             'poly': [0.5, 0.3, 0.2, 0.1],
+             'exp_2pt': [0.5, 0.3],
+             'exp_2pt_excited': [0.5, 0.3, 0.2, 0.9],
+             'exp_2pt_series': [0.5, 0.3, 0.2, 0.9, 0.1, 1.4],
+             'cosh_2pt': [32, 0.5, 0.3],
+             'cosh_2pt_excited': [32, 0.5, 0.3, 0.2, 0.9],
+             'corr_cosh_series': [32, 0.5, 0.3, 0.2, 0.9, 0.1, 1.4]}
+    for name, params in cases.items():
+        func = ExLib_FitFuncs[name]
+        analytic = func.jacobian(t, *params)
+        numerical = numerical_jacobian(func, t, params)
+        assert len(analytic) == len(params)
+        for a, n in zip(analytic, numerical):
+            assert np.allclose(a, n, rtol=1e-5, atol=1e-8)
+    assert 'exp_2pt_jacobian' not in ExLib_FitFuncs
+
+
+def test_wrapped_jacobian_slots():
+    # 'T' is a constant and 'E' is the second of three fit parameters
+    t = np.arange(3., 12.)
+    func = fit_func_factory(ExLib_FitFuncs['cosh_2pt'])
+    fit_parameters = np.array([0.7, 0.3, 0.5])
+    parameter_map = [32, None, None]
+    slots = {2: 1, 1: 2}
+
+    jacobian = func.jacobian(t, fit_parameters, list(parameter_map), slots)
+    assert jacobian.shape == (len(t), 3)
+    assert np.all(jacobian[:, 0] == 0)
+    for key in slots:
+        shifted_up = fit_parameters.copy()
+        shifted_down = fit_parameters.copy()
+        shifted_up[key] += 1e-7
+        shifted_down[key] -= 1e-7
+        numerical = (func(t, shifted_up, list(parameter_map), slots) -
+                     func(t, shifted_down, list(parameter_map), slots)) / 2e-7
+        assert np.allclose(jacobian[:, key], numerical, rtol=1e-5, atol=1e-8)
@@ -23,8 +23,11 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import numpy as np
+
 from sulat import Analysis
-from .Utilities import gen_fake_2pt_data
+from sulat.ExtensibleLibraries.Lib_Stats.GammaMethod import gamma_variances
+from .Utilities import gen_fake_2pt_data, gen_fake_2pt_ensemble
 
 
 def test_build_jackknife_correlators():
@@ -70,3 +73,193 @@ def test_build_bootstrap_correlators():
     an.build_correlator(data, transforms={'bin_timeslices': [2]})
     an.configure_resampler(nsamples=50)
     an.build_correlator(data, transforms={'bin_configurations': [2]})
+
+
+def test_streaming_double_jackknife():
+    data = gen_fake_2pt_data()
+    an = Analysis()
+    an.init_resampler('Jackknife')
+    corr = an.build_correlator(data)
+    submean = corr.submean
+    C = submean.shape[0]
+
+    # The double-jackknife means and covariances as originally defined, from the full (C, C, T) double removals
+    double_removals = submean[None, :, :] + submean[:, None, :]
+    double_removals = double_removals[~np.eye(C, dtype=bool), :].reshape(C, C - 1, -1)
+    expected_double = (np.sum(submean, axis=0)[None, None, :] - double_removals) / (C - 2)
+    d = expected_double - submean[:, None, :]
+    expected_cov_double = np.matmul(d.swapaxes(1, 2), d) * ((C - 1) / C)
+
+    assert np.allclose(corr.submean_double, expected_double, rtol=1e-12, atol=0)
+    assert np.allclose(corr.cov_double, expected_cov_double, rtol=1e-12, atol=0)
+    streamed = np.concatenate(list(corr.resampler.iter_cov_double_definition(submean, chunksize=7)))
+    assert np.allclose(streamed, expected_cov_double, rtol=0, atol=1e-12*np.max(np.abs(expected_cov_double)))
+
+
+def test_bootstrap_counts():
+    data = gen_fake_2pt_data()
+    an = Analysis()
+    an.init_resampler('Bootstrap', seed=10, nsamples=50, chunksize=7)
+    corr = an.build_correlator(data)
+
+    # The samples are those of gathering every draw of a single (configs, nsamples) matrix of random indices
+    random_numbers = np.random.default_rng(10).integers(0, data.shape[0], size=(data.shape[0], 50))
+    assert np.allclose(corr.submean, np.mean(data[random_numbers], axis=0), rtol=1e-12, atol=0)
+    assert np.all(np.sum(an.resampler.counts, axis=1) == data.shape[0])
+
+
+def test_double_bootstrap():
+    data = gen_fake_2pt_data()
+    an = Analysis()
+    # Configurations are only kept for the double bootstrap when it is requested
+    an.init_resampler('Bootstrap', seed=10, nsamples=40, chunksize=7, inner_nsamples=30)
+    assert an.build_correlator(data).configurations is None
+    an.configure_resampler(double_bootstrap=True)
+    corr = an.build_correlator(data)
+    submean = corr.submean
+
+    # The inner samples are regenerated identically on demand, and the streamed covariances match the explicit ones
+    assert corr.submean_double.shape == (40, 30, submean.shape[1])
+    assert np.all(an.resampler.inner_draws(3, 30) == an.resampler.inner_draws(3, 30))
+    streamed = np.concatenate(list(corr.resampler.iter_cov_double_definition(submean, data, chunksize=6)))
+    assert np.allclose(streamed, corr.cov_double, rtol=0, atol=1e-12*np.max(np.abs(corr.cov_double)))
+
+    # The inner samples resample the configurations of their outer sample, so each double covariance matrix tracks
+    # the covariance of the mean of the configurations drawn into that sample
+    an.configure_resampler(inner_nsamples=400)
+    corr = an.build_correlator(data)
+    deviations = data[None, :, :] - corr.submean[:, None, :]
+    sample_cov = np.einsum('kc,kct,kcs->kts', an.resampler.counts, deviations, deviations) / data.shape[0]**2
+    double_var = np.trace(corr.cov_double, axis1=1, axis2=2)
+    sample_var = np.trace(sample_cov, axis1=1, axis2=2)
+    assert np.corrcoef(double_var, sample_var)[0, 1] > 0.9
+    assert np.isclose(np.mean(double_var / sample_var), 1, atol=0.05)
+
+    # Correlators derived by arithmetic do not keep the configurations needed for their inner samples
+    try:
+        (corr * 2).cov_double
+    except ValueError:
+        pass
+    else:
+        assert False, "A double bootstrap was computed without the configurations of the samples."
+
+    an.fit([corr], ['cosh_2pt'], fit_ranges=[[15, 25]], correlation=True, args={'A': 1, 'E': 1},
+           arg_identities=[['T', 'A', 'E']], frozen=False)
+
+
+def test_counter_based_bootstrap():
+    data = gen_fake_2pt_data()
+    an = Analysis()
+    an.init_resampler('Bootstrap', seed=10, nsamples=50, chunksize=7, counter_based=True)
+    corr = an.build_correlator(data)
+    resampler = an.resampler
+
+    # Each sample is regenerated independently from its own stream, whatever the chunking
+    assert np.allclose(corr.submean[13], np.mean(data[resampler.sample_draws(13)], axis=0), rtol=1e-12, atol=0)
+    assert np.all(resampler.sample_counts(13, 14)[0] == resampler.counts[13])
+    assert np.all(np.bincount(resampler.sample_draws(13), minlength=len(data)) == resampler.counts[13])
+    an.configure_resampler(seed=10)
+    resampler.chunksize = 50
+    assert np.allclose(an.build_correlator(data).submean, corr.submean, rtol=1e-12, atol=0)
+    assert np.all(resampler.counts[20:30] == resampler.sample_counts(20, 30))
+
+
+def test_blocked_jackknife():
+    data = gen_fake_2pt_data()
+    an = Analysis()
+    an.init_resampler('BlockedJackknife', nblocks=16)
+    corr = an.build_correlator(data)
+
+    # The samples are the jackknife samples of the block means
+    block_means = np.mean(data.reshape(16, -1, data.shape[1]), axis=1)
+    an.init_resampler('Jackknife')
+    blocks = an.build_correlator(block_means)
+    assert corr.submean.shape == (16, data.shape[1])
+    assert np.allclose(corr.mean, np.mean(data, axis=0), rtol=1e-12, atol=0)
+    assert np.allclose(corr.submean, blocks.submean, rtol=1e-12, atol=0)
+    assert np.allclose(corr.cov, blocks.cov, rtol=1e-12, atol=0)
+    assert np.allclose(corr.cov_double, blocks.cov_double, rtol=1e-12, atol=0)
+
+    an.fit([corr], ['cosh_2pt'], fit_ranges=[[15, 25]], correlation=True, args={'A': 1, 'E': 1},
+           arg_identities=[['T', 'A', 'E']], frozen=False)
+
+
+def test_block_bootstrap():
+    data = gen_fake_2pt_data()
+    an = Analysis()
+    for stationary in (False, True):
+        an.init_resampler('BlockBootstrap', seed=10, nsamples=50, block_length=4, stationary=stationary, chunksize=7)
+        corr = an.build_correlator(data)
+        assert np.all(np.sum(an.resampler.counts, axis=1) == data.shape[0])
+
+        # The draws of the double bootstrap are replayed chunk by chunk rather than stored
+        for sample in (3, 7, 49):
+            assert np.all(np.bincount(an.resampler.sample_configurations(sample), minlength=data.shape[0])
+                          == an.resampler.counts[sample])
+
+        assert corr.std.shape == (data.shape[1],)
+
+        # Each sample is a sequence of runs of consecutive configurations
+        an.configure_resampler(counter_based=True)
+        submean = an.build_correlator(data).submean
+        draws = an.resampler.sample_draws(3)
+        assert np.mean(np.diff(draws) % data.shape[0] == 1) > 0.5
+        assert np.allclose(submean[3], np.mean(data[draws], axis=0), rtol=1e-12, atol=0)
+
+
+def test_gamma_method():
+    # An autoregressive chain with integrated autocorrelation time (1 + phi)/(2(1 - phi)) = 4.5 on every timeslice
+    rng = np.random.default_rng(10)
+    noise = rng.normal(size=(4000, 32))
+    for i in range(1, len(noise)):
+        noise[i] += 0.8*noise[i - 1]
+    data = np.mean(gen_fake_2pt_ensemble(), axis=0)[None, :]*(1 + 0.01*noise)
+
+    an = Analysis()
+    an.init_resampler('GammaMethod')
+    corr = an.build_correlator(data)
+    assert np.allclose(corr.submean, data - np.mean(data, axis=0))
+    tau_int = gamma_variances(corr.submean)[1]
+    assert abs(np.mean(tau_int) - 4.5) < 0.5 and np.all(np.abs(tau_int - 4.5) < 2.5)
+
+    # Derived quantities are propagated linearly
+    assert np.allclose(np.log(corr).std, corr.std / corr.mean, rtol=1e-4)
+
+    # Fits are propagated linearly through the central fit, which is exact for a linear fit function
+    fit = an.fit([corr], ['const'], fit_ranges=[[8, 10]], correlation=False, args={'constant': 1.},
+                 arg_identities=[['constant']])
+    fit_weights = 1 / corr.std[8:11]**2
+    expected = corr.submean[:, 8:11] @ fit_weights / np.sum(fit_weights)
+    assert np.allclose(fit.submean['constant'], expected, rtol=1e-6, atol=1e-6*np.max(np.abs(expected)))
+    try:
+        an.fit([corr], ['const'], fit_ranges=[[8, 10]], correlation=False, args={'constant': 1.},
+               arg_identities=[['constant']], frozen=False)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+    gamma_fit = an.fit([corr], ['cosh_2pt'], fit_ranges=[[8, 24]], correlation=True, args={'A': 0.03, 'E': 0.3},
+                       arg_identities=[['T', 'A', 'E']])
+    an.init_resampler('Jackknife')
+    jackknife_corr = an.build_correlator(data)
+    assert np.all(corr.std > 2*jackknife_corr.std)
+    jackknife_fit = an.fit([jackknife_corr], ['cosh_2pt'], fit_ranges=[[8, 24]], correlation=True,
+                           args={'A': 0.03, 'E': 0.3}, arg_identities=[['T', 'A', 'E']])
+    assert gamma_fit.std['E'] > 2*jackknife_fit.std['E']
+
+
+def test_incremental_jackknife():
+    data = gen_fake_2pt_ensemble(configs=300)
+    an = Analysis()
+    an.init_resampler('IncrementalJackknife')
+    corr = an.build_incremental_correlator(data[:100], transforms=['fold'])
+    corr.append(data[100:250])
+    corr.append(data[250:])
+    rebuilt = an.build_correlator(data, transforms=['fold'])
+
+    assert corr.num_configs == 300
+    for stat in ('mean', 'submean', 'cov', 'std'):
+        expected = getattr(rebuilt, stat)
+        assert np.allclose(getattr(corr, stat), expected, rtol=0, atol=1e-12*np.max(np.abs(expected)))
+    assert np.allclose((corr/rebuilt).mean, 1, rtol=1e-12, atol=0)
@@ -38,3 +38,19 @@ def gen_fake_2pt_data():
     data = lin_data + lin_data * random_generated_numbers
 
     return data
+
+
+def gen_fake_2pt_ensemble(configs=200, T=32, seed=10):
+    """
+    Generates a (configs, T) array of noisy, timeslice-correlated two-state cosh correlators.
+    """
+    rng = np.random.default_rng(seed)
+
+    t = np.arange(T)
+    amp, energy, energy_2 = 0.03, 0.3, 0.9
+    lin_data = amp * (np.exp(-energy * t) + np.exp(-energy * (T - t))) + \
+               amp * (np.exp(-energy_2 * t) + np.exp(-energy_2 * (T - t)))
+    noise = rng.normal(scale=0.02, size=(configs, T))
+    noise = noise + 0.5 * np.roll(noise, 1, axis=1)
+
+    return lin_data[None, :] * (1 + noise)
@@ -0,0 +1,109 @@
+"""
+sulat data analysis library for Lattice QCD (available at: https://github.com/RChrHill/sulat)
+
+Copyright (C) 2018-2020
+
+File: sulat/Utilities/Storage.py
+
+Author: Nils Asmussen <https://github.com/nils-asmussen>
+Author: Ryan Hill <https://github.com/RChrHill>
+Author: James Richings <https://github.com/JPRichings>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import tempfile
+
+import numpy as np
+
+measurements = 0
+
+# The number of measurements read from disk at once when no storage has been configured
+default_chunksize = 4096
+
+
+def is_disk_backed(data):
+    return isinstance(data, np.memmap)
+
+
+def measurement_chunks(length, chunksize=default_chunksize):
+    """
+    Yields slices covering 'length' measurements in consecutive chunks of at most 'chunksize'.
+    """
+    for start in range(0, length, chunksize):
+        yield slice(start, min(start + chunksize, length))
+
+
+def chunked_sum(data, chunksize=default_chunksize):
+    """
+    Returns the sum of 'data' over the measurements, reading 'chunksize' measurements at a time.
+    """
+    total = np.zeros(data.shape[1:], dtype=np.result_type(data, float))
+    for chunk in measurement_chunks(data.shape[measurements], chunksize):
+        total += np.sum(data[chunk], axis=measurements)
+    return total
+
+
+def chunked_gram(data, mean, chunksize=default_chunksize):
+    """
+    Returns the sum over the measurements of the outer products of the deviations of 'data' from 'mean', reading
+    'chunksize' measurements at a time.
+    """
+    gram = np.zeros((data.shape[1], data.shape[1]), dtype=np.result_type(data, float))
+    for chunk in measurement_chunks(data.shape[measurements], chunksize):
+        d = data[chunk] - mean[None, :]
+        gram += np.dot(d.T, d)
+    return gram
+
+
+class DiskStorage:
+    def __init__(self, directory, chunksize=default_chunksize):
+        """
+        Allocates the disk-backed arrays of out-of-core analyses, and sets how many measurements are processed at once.
+        :param directory: The directory in which to create the files backing the arrays.
+        :param chunksize: The number of measurements read into memory at once.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunksize = chunksize
+
+    def allocate(self, shape, dtype=float):
+        """
+        Returns a new np.memmap of 'shape' backed by a file in the storage directory.
+        """
+        fd, path = tempfile.mkstemp(suffix='.npy', dir=self.directory)
+        os.close(fd)
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    def chunks(self, length):
+        return measurement_chunks(length, self.chunksize)
+
+    def map(self, func, length):
+        """
+        Evaluates 'func' on the slices of each chunk of 'length' measurements, and writes the results into a new
+        disk-backed array. 'func' must act independently on each measurement.
+        """
+        result = None
+        for chunk in self.chunks(length):
+            values = np.asarray(func(chunk))
+            if values.shape[:1] != (chunk.stop - chunk.start,):
+                raise ValueError(f"A function evaluated on {chunk.stop - chunk.start} measurements returned shape "
+                                 f"{values.shape}. Only functions acting independently on each measurement can be "
+                                 "evaluated out of core.")
+            if result is None:
+                result = self.allocate((length, *values.shape[1:]), values.dtype)
+            result[chunk] = values
+        return result